@@ -7,6 +7,7 @@ from aws_cdk import (
     aws_s3 as s3,
     RemovalPolicy,
     aws_cloudtrail as cloudtrail,
+    aws_events as events,
     aws_events_targets as targets,
     aws_glue as glue,
     aws_athena as athena,
@@ -14,6 +15,11 @@ from aws_cdk import (
     aws_apigateway as apigateway,
     aws_logs as logs,
     aws_kms as kms,
+    aws_sqs as sqs,
+    aws_sns as sns,
+    aws_sns_subscriptions as sns_subscriptions,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_kinesisfirehose as firehose,
     BundlingOptions
 )
 from aws_cdk.custom_resources import (
@@ -23,6 +29,45 @@ from aws_cdk.custom_resources import (
 )
 import aws_cdk.aws_glue_alpha as glue_alpha
 
+# columns of the feedback tables, in the order the processors emit them
+FEEDBACK_COLUMNS = [
+    ("recordid", "string"),
+    ("interactionid", "string"),
+    ("prompt", "string"),
+    ("response", "string"),
+    ("source_attribution_urls", "array<string>"),
+    ("sourceattribution", "string"),
+    ("appidentifier", "string"),
+    ("feedback", "string"),
+    ("comment", "string"),
+    ("userid", "string"),
+    ("submittedat", "string"),
+    ("submittedatraw", "string"),
+    ("ingestedat", "string"),
+    ("promptdigest", "string"),
+    ("responsedigest", "string"),
+    ("sourceattributiondigest", "string"),
+]
+
+# attributes moved to the content store when content_dedup is enabled, and their digest column
+CONTENT_COLUMNS = [
+    ("prompt", "promptdigest"),
+    ("response", "responsedigest"),
+    ("sourceattribution", "sourceattributiondigest"),
+]
+
+# columns of the feedback_daily_summary table, one row per day, app and feedback value
+SUMMARY_COLUMNS = [
+    ("appidentifier", "string"),
+    ("feedback", "string"),
+    ("ratings", "bigint"),
+    ("comments", "bigint"),
+    ("users", "bigint"),
+]
+
+SUMMARY_TABLE = "feedback_daily_summary"
+
+
 class FeedbackStack(Stack):
     def __init__(self, scope: Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
@@ -32,6 +77,59 @@ class FeedbackStack(Stack):
         self.classification = self.node.try_get_context("classification")
         self.glue_database_name = self.node.try_get_context("glue_database")
 
+        # "sync" writes feedback from the API request, "queue" buffers requests in SQS
+        # and stores them with a batched consumer, "firehose" sends requests to a Firehose
+        # stream that writes large compressed objects
+        self.ingestion_mode = self.node.try_get_context("ingestion_mode") or "sync"
+
+        # "json" (default) or "parquet" for the objects written in batches
+        self.output_format = self.node.try_get_context("output_format") or "json"
+
+        # "projection" (default) or "events" for the partitions of the feedback tables
+        self.partition_registration = self.node.try_get_context("partition_registration") or "projection"
+
+        # partition columns of the feedback layout, any of app, year, month, day and hour
+        self.partition_scheme = (self.node.try_get_context("partition_scheme") or "year,month,day").split(",")
+
+        # "none" (default), "gzip" or "zstd" for the JSON objects written by the functions
+        self.output_compression = self.node.try_get_context("output_compression") or "none"
+
+        # number of hash named sub-prefixes per partition the writers spread objects over,
+        # 0 (default) writes the objects directly into the partition
+        self.key_shards = str(self.node.try_get_context("key_shards") or "0")
+
+        # "direct" (default) stores Q Business feedback from the processor through the shared
+        # feedback sink, "api" posts it to the feedback API like any other client
+        self.qbusiness_sink = self.node.try_get_context("qbusiness_sink") or "direct"
+
+        # when "true", PutFeedback events are buffered in SQS and processed in batches
+        self.qbusiness_queue = str(self.node.try_get_context("qbusiness_queue")).lower() == "true"
+
+        # store large prompts, responses and source attributions once, by content digest
+        self.content_dedup = str(self.node.try_get_context("content_dedup")).lower() == "true"
+
+        # share of invocations emitting per stage timing metrics, 0 (default) disables them
+        self.metrics_sample_rate = str(self.node.try_get_context("metrics_sample_rate") or "0")
+
+        # feedback values counted as positive and negative by the report queries, case insensitive
+        self.positive_feedback = (
+            self.node.try_get_context("positive_feedback") or "thumbsup,thumbs_up,useful,positive"
+        ).lower().split(",")
+        self.negative_feedback = (
+            self.node.try_get_context("negative_feedback") or "thumbsdown,thumbs_down,not_useful,negative"
+        ).lower().split(",")
+
+        # keep per app and day feedback counts up to date as objects arrive
+        self.rollups = str(self.node.try_get_context("rollups")).lower() == "true"
+
+        # index the comments of negative feedback for term and phrase searches, "comment"
+        # or e.g. "comment,prompt" for the indexed attributes
+        self.comment_index = str(self.node.try_get_context("comment_index")).lower() == "true"
+        self.comment_index_fields = self.node.try_get_context("comment_index_fields") or "comment"
+
+        # serve GET /feedback from a read index kept up to date as objects arrive
+        self.read_api = str(self.node.try_get_context("read_api")).lower() == "true"
+
         # bucket to store analytics data.
         self.create_s3_bucket()
 
@@ -41,11 +139,34 @@ class FeedbackStack(Stack):
         # create lambda proxy which will act as proxy for API Gateway
         self.create_api_proxy_lambda()
 
+        # create the queue and its batched consumer when requests are buffered
+        if self.ingestion_mode == "queue":
+            self.create_ingestion_queue()
+
+        # create the delivery stream and its record transformation when requests are streamed
+        if self.ingestion_mode == "firehose":
+            self.create_delivery_stream()
+
         # create API Gateway
         self.create_api_gateway()
 
-        # create glue crawler and athena workgroup to analyze the feedback
-        self.create_glue_crawler()
+        # create glue tables and athena workgroup to analyze the feedback
+        self.create_glue_catalog()
+
+        # create the scheduled job that merges small feedback objects of closed days
+        self.create_compaction_job()
+
+        # create the function that maintains the pre-aggregated feedback rollups
+        if self.rollups:
+            self.create_rollup_job()
+
+        # create the function that indexes the comments of negative feedback
+        if self.comment_index:
+            self.create_comment_index_job()
+
+        # create the function that maintains the read index and the GET /feedback method
+        if self.read_api:
+            self.create_read_api()
 
         # Code below is optional and is to show how to use the solution to process Qbuiness feedback
         if self.application_id and self.application_id != "":
@@ -56,8 +177,14 @@ class FeedbackStack(Stack):
             self.create_cloudtrail()
 
     def create_lambda_layer(self):
-        # This function creates an AWS Lambda layer containing the boto3 library for Python 3.11.
+        # This function creates an AWS Lambda layer for Python 3.11 with the shared "common" package
+        # (lambda_assets/layer/common, importable as common.<module>), botocore and requests.
         # Layers allow sharing common code/dependencies between Lambda functions to avoid duplicating packages.
+        # boto3 is not bundled, the functions only use botocore. botocore is, because the runtime's
+        # may predate the S3 conditional writes (If-None-Match, If-Match) the writers rely on.
+        # The layer ships compiled
+        # bytecode because /opt is read only and modules without it are compiled on every cold start
+        # (hash based, as zipping the asset does not preserve source timestamps exactly).
         self.lambda_layer = _lambda.LayerVersion(
             self,
             "boto_python3_11_layer",
@@ -68,13 +195,43 @@ class FeedbackStack(Stack):
                     command=[
                         "bash",
                         "-c",
-                        "pip install -r requirements.txt -t /asset-output/python && cp -au . /asset-output/python/common",
+                        "pip install --no-cache-dir --no-compile -r requirements.txt -t /asset-output/python"
+                        " && cp -au common /asset-output/python/"
+                        " && python -m compileall -q --invalidation-mode unchecked-hash /asset-output/python"
+                        " && rm -rf /asset-output/python/bin",
                     ],
                 ),
             ),
             compatible_runtimes=[_lambda.Runtime.PYTHON_3_11],
         )
 
+        # Functions writing feedback get the shared layer, plus the AWS SDK for pandas layer
+        # (which provides pyarrow) when feedback is written as Parquet
+        self.writer_layers = [self.lambda_layer]
+        if self.output_format == "parquet":
+            pandas_layer_arn = self.node.try_get_context("pandas_layer_arn")
+            if not pandas_layer_arn:
+                raise ValueError(
+                    "output_format parquet requires the pandas_layer_arn context, "
+                    "the ARN of the AWS SDK for pandas (AWSSDKPandas-Python311) layer in the target region"
+                )
+            self.writer_layers.append(
+                _lambda.LayerVersion.from_layer_version_arn(self, "aws_sdk_pandas_layer", pandas_layer_arn)
+            )
+
+    def writer_environment(self):
+        # environment shared by the functions that write feedback objects
+        return {
+            "S3_DATA_BUCKET": self.data_bucket.bucket_name,
+            "GLUE_DATABASE_NAME": self.glue_database_name,
+            "OUTPUT_FORMAT": self.output_format,
+            "PARTITION_SCHEME": ",".join(self.partition_scheme),
+            "CONTENT_DEDUP": str(self.content_dedup).lower(),
+            "OUTPUT_COMPRESSION": self.output_compression,
+            "METRICS_SAMPLE_RATE": self.metrics_sample_rate,
+            "KEY_SHARDS": self.key_shards,
+        }
+
     def create_s3_bucket(self):
         # The bucket is encrypted using AWS KMS for security.
         # Public access is blocked to prevent unauthorized access to the data.
@@ -129,15 +286,247 @@ class FeedbackStack(Stack):
             timeout=Duration.seconds(240),
             memory_size=256,
             role=self.api_proxy_lambda_role,
-            environment={
-                "S3_DATA_BUCKET": self.data_bucket.bucket_name,
-                "GLUE_DATABASE_NAME": self.glue_database_name,
-            },
+            environment=self.writer_environment(),
+            layers=self.writer_layers,
         )
 
         # Assigning permissions to the created Lambda function for S3 bucket
         self.data_bucket.grant_write(self.api_proxy_lambda)
 
+    def create_ingestion_queue(self):
+        # Messages that keep failing (e.g. invalid payloads) end up in the dead letter queue
+        self.ingestion_dlq = sqs.Queue(
+            self,
+            "llm-app-feedback-dlq",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+        )
+        self.ingestion_queue = sqs.Queue(
+            self,
+            "llm-app-feedback-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            # six times the consumer timeout, as recommended for Lambda event sources
+            visibility_timeout=Duration.seconds(360),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=5, queue=self.ingestion_dlq
+            ),
+        )
+
+        # The consumer shares the code of the API proxy lambda and drains the queue in batches.
+        # Its concurrency is capped so a burst of requests is absorbed by the queue instead
+        # of by a matching number of Lambda invocations and S3 PUTs.
+        self.queue_consumer_lambda = _lambda.Function(
+            self,
+            "llm-app-feedback-queue-consumer",
+            function_name="llm_app_feedback_queue_consumer",
+            handler="lambda-handler.sqs_batch_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/llm_app_feedback_processor"),
+            timeout=Duration.seconds(60),
+            memory_size=256,
+            role=self.api_proxy_lambda_role,
+            environment=self.writer_environment(),
+            layers=self.writer_layers,
+        )
+        self.queue_consumer_lambda.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                self.ingestion_queue,
+                batch_size=int(self.node.try_get_context("queue_batch_size") or 100),
+                max_batching_window=Duration.seconds(
+                    int(self.node.try_get_context("queue_batching_window_seconds") or 10)
+                ),
+                max_concurrency=int(self.node.try_get_context("queue_max_concurrency") or 5),
+                report_batch_item_failures=True,
+            )
+        )
+
+        # Assigning permissions to the consumer for S3 bucket
+        self.data_bucket.grant_write(self.queue_consumer_lambda)
+
+    def create_delivery_stream(self):
+        # Firehose buffers the requests and writes them as GZIP compressed NDJSON objects into
+        # the partitions of the feedback table. The transformation shares the code of the API
+        # proxy lambda: it validates and normalizes every request body and returns the
+        # partition of its records as the partition keys of the dynamic partitioning.
+        self.firehose_transform_lambda = _lambda.Function(
+            self,
+            "llm-app-feedback-firehose-transform",
+            function_name="llm_app_feedback_firehose_transform",
+            handler="lambda-handler.firehose_transform_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/llm_app_feedback_processor"),
+            timeout=Duration.seconds(60),
+            memory_size=512,
+            role=self.api_proxy_lambda_role,
+            environment=self.writer_environment(),
+            layers=self.writer_layers,
+        )
+        # the content store of content_dedup writes to the bucket
+        self.data_bucket.grant_write(self.firehose_transform_lambda)
+
+        firehose_log_group = logs.LogGroup(
+            self,
+            "llm-app-feedback-firehose-log-group",
+            removal_policy=RemovalPolicy.DESTROY,
+            retention=logs.RetentionDays.ONE_MONTH,
+        )
+        firehose_log_stream = logs.LogStream(
+            self, "llm-app-feedback-firehose-log-stream", log_group=firehose_log_group
+        )
+
+        firehose_role = iam.Role(
+            self,
+            "FeedbackDeliveryStreamRole",
+            assumed_by=iam.ServicePrincipal("firehose.amazonaws.com"),
+        )
+        self.data_bucket.grant_read_write(firehose_role)
+        self.firehose_transform_lambda.grant_invoke(firehose_role)
+        firehose_log_group.grant_write(firehose_role)
+
+        partitions = "/".join(
+            f"{name}=!{{partitionKeyFromLambda:{name}}}" for name in self.partition_scheme
+        )
+        self.delivery_stream = firehose.CfnDeliveryStream(
+            self,
+            "llm-app-feedback-stream",
+            delivery_stream_type="DirectPut",
+            delivery_stream_encryption_configuration_input=firehose.CfnDeliveryStream.DeliveryStreamEncryptionConfigurationInputProperty(
+                key_type="AWS_OWNED_CMK"
+            ),
+            extended_s3_destination_configuration=firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
+                bucket_arn=self.data_bucket.bucket_arn,
+                role_arn=firehose_role.role_arn,
+                prefix=f"{self.glue_database_name}/feedback/{partitions}/",
+                # failed requests are kept outside of the tables for inspection
+                error_output_prefix=(
+                    f"{self.glue_database_name}/feedback_firehose_errors/"
+                    "!{firehose:error-output-type}/!{timestamp:yyyy/MM/dd}/"
+                ),
+                compression_format="GZIP",
+                # Athena picks the codec from the extension
+                file_extension=".json.gz",
+                buffering_hints=firehose.CfnDeliveryStream.BufferingHintsProperty(
+                    # dynamic partitioning requires a buffer of at least 64 MB
+                    size_in_m_bs=int(self.node.try_get_context("firehose_buffer_mb") or 128),
+                    interval_in_seconds=int(self.node.try_get_context("firehose_buffer_seconds") or 300),
+                ),
+                dynamic_partitioning_configuration=firehose.CfnDeliveryStream.DynamicPartitioningConfigurationProperty(
+                    enabled=True,
+                    retry_options=firehose.CfnDeliveryStream.RetryOptionsProperty(duration_in_seconds=300),
+                ),
+                processing_configuration=firehose.CfnDeliveryStream.ProcessingConfigurationProperty(
+                    enabled=True,
+                    processors=[
+                        firehose.CfnDeliveryStream.ProcessorProperty(
+                            type="Lambda",
+                            parameters=[
+                                firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                    parameter_name="LambdaArn",
+                                    parameter_value=self.firehose_transform_lambda.function_arn,
+                                ),
+                                firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                    parameter_name="BufferSizeInMBs", parameter_value="1"
+                                ),
+                                firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                    parameter_name="BufferIntervalInSeconds", parameter_value="60"
+                                ),
+                                firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                    parameter_name="NumberOfRetries", parameter_value="3"
+                                ),
+                            ],
+                        )
+                    ],
+                ),
+                cloud_watch_logging_options=firehose.CfnDeliveryStream.CloudWatchLoggingOptionsProperty(
+                    enabled=True,
+                    log_group_name=firehose_log_group.log_group_name,
+                    log_stream_name=firehose_log_stream.log_stream_name,
+                ),
+            ),
+        )
+        # the role has to be able to write before Firehose validates the destination
+        self.delivery_stream.node.add_dependency(firehose_role)
+
+    def create_firehose_integration(self):
+        # API Gateway puts the raw request body on the delivery stream, the transformation
+        # validates it later
+        api_firehose_role = iam.Role(
+            self,
+            "ApiGatewayFeedbackStreamRole",
+            assumed_by=iam.ServicePrincipal("apigateway.amazonaws.com"),
+        )
+        api_firehose_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["firehose:PutRecord"],
+                resources=[self.delivery_stream.attr_arn],
+            )
+        )
+
+        request_template = (
+            f'{{"DeliveryStreamName": "{self.delivery_stream.ref}", '
+            '"Record": {"Data": "$util.base64Encode($input.body)"}}'
+        )
+        return apigateway.AwsIntegration(
+            service="firehose",
+            action="PutRecord",
+            integration_http_method="POST",
+            options=apigateway.IntegrationOptions(
+                credentials_role=api_firehose_role,
+                passthrough_behavior=apigateway.PassthroughBehavior.NEVER,
+                request_parameters={
+                    "integration.request.header.Content-Type": "'application/x-amz-json-1.1'"
+                },
+                request_templates={
+                    "application/json": request_template,
+                    "application/x-ndjson": request_template,
+                },
+                integration_responses=[
+                    apigateway.IntegrationResponse(
+                        status_code="200",
+                        response_templates={
+                            "application/json": '{"status": "accepted", "recordId": "$input.path(\'$.RecordId\')"}'
+                        },
+                    )
+                ],
+            ),
+        )
+
+    def create_queue_integration(self):
+        # API Gateway sends the raw request body to SQS, the consumer validates it later
+        api_queue_role = iam.Role(
+            self,
+            "ApiGatewayFeedbackQueueRole",
+            assumed_by=iam.ServicePrincipal("apigateway.amazonaws.com"),
+        )
+        self.ingestion_queue.grant_send_messages(api_queue_role)
+
+        return apigateway.AwsIntegration(
+            service="sqs",
+            path=f"{Aws.ACCOUNT_ID}/{self.ingestion_queue.queue_name}",
+            integration_http_method="POST",
+            options=apigateway.IntegrationOptions(
+                credentials_role=api_queue_role,
+                passthrough_behavior=apigateway.PassthroughBehavior.NEVER,
+                request_parameters={
+                    "integration.request.header.Content-Type": "'application/x-www-form-urlencoded'"
+                },
+                request_templates={
+                    "application/json": "Action=SendMessage&MessageBody=$util.urlEncode($input.body)",
+                    "application/x-ndjson": "Action=SendMessage&MessageBody=$util.urlEncode($input.body)",
+                },
+                integration_responses=[
+                    apigateway.IntegrationResponse(
+                        status_code="200",
+                        response_templates={
+                            "application/json": '{"status": "queued", "messageId": "$input.path(\'$.SendMessageResponse.SendMessageResult.MessageId\')"}'
+                        },
+                    )
+                ],
+            ),
+        )
+
     def create_api_gateway(self):
 
         # Create log group for API Gateway
@@ -177,10 +566,25 @@ class FeedbackStack(Stack):
         )
 
         self.feedback = self.api.root.add_resource("feedback")
-        self.post_feedback = self.feedback.add_method(
-            "POST",
-            authorization_type=apigateway.AuthorizationType.IAM,
-        )
+        if self.ingestion_mode == "queue":
+            self.post_feedback = self.feedback.add_method(
+                "POST",
+                integration=self.create_queue_integration(),
+                authorization_type=apigateway.AuthorizationType.IAM,
+                method_responses=[apigateway.MethodResponse(status_code="200")],
+            )
+        elif self.ingestion_mode == "firehose":
+            self.post_feedback = self.feedback.add_method(
+                "POST",
+                integration=self.create_firehose_integration(),
+                authorization_type=apigateway.AuthorizationType.IAM,
+                method_responses=[apigateway.MethodResponse(status_code="200")],
+            )
+        else:
+            self.post_feedback = self.feedback.add_method(
+                "POST",
+                authorization_type=apigateway.AuthorizationType.IAM,
+            )
 
         # Outputting the name of the bucket created
         CfnOutput(self, "feedback-data-bucket-name", value=self.data_bucket.bucket_name)
@@ -188,38 +592,7 @@ class FeedbackStack(Stack):
         # Outputting the API Gateway URL
         CfnOutput(self, "API Gateway URL", value=self.api.url)
 
-    def create_glue_crawler(self):
-        # Create Glue crawler's IAM role
-        self.glue_crawler_role = iam.Role(
-            self,
-            "GlueCrawlerRole",
-            assumed_by=iam.ServicePrincipal("glue.amazonaws.com"),
-        )
-        self.glue_crawler_role.attach_inline_policy(
-            iam.Policy(
-                self,
-                "glue_crawler_role_policy",
-                statements=[
-                    iam.PolicyStatement(
-                        actions=[
-                            "s3:GetBucketLocation",
-                            "s3:ListBucket",
-                            "s3:GetBucketAcl",
-                            "s3:GetObject",
-                        ],
-                        resources=[f"{self.data_bucket.bucket_arn}/*"],
-                    )
-                ],
-            )
-        )
-
-        # Add managed policies to Glue crawler role
-        self.glue_crawler_role.add_managed_policy(
-            iam.ManagedPolicy.from_aws_managed_policy_name(
-                "service-role/AWSGlueServiceRole"
-            )
-        )
-
+    def create_glue_catalog(self):
         # Create Glue Database
         glue_database = glue_alpha.Database(
             self, id=self.glue_database_name, database_name=self.glue_database_name
@@ -228,41 +601,25 @@ class FeedbackStack(Stack):
         # Delete the database when deleting the stack
         glue_database.apply_removal_policy(policy=RemovalPolicy.DESTROY)
 
-        self.audit_policy = glue.CfnCrawler.SchemaChangePolicyProperty(
-            update_behavior="UPDATE_IN_DATABASE", delete_behavior="LOG"
-        )
+        # The feedback tables are defined by the stack instead of being discovered by a crawler.
+        # Partitions are either projected by Athena from the S3 layout ("projection"), or
+        # registered in the catalog as soon as an object lands in a new one ("events").
+        self.feedback_tables = {"feedback": "json"}
+        if self.output_format == "parquet":
+            self.feedback_tables["feedback_parquet"] = "parquet"
 
-        self.glue_crawler_security_configuration_name = "FeedbackCrawlerSecurityConfiguration"
-                
-        glue_crawler_security_configuration = glue.CfnSecurityConfiguration(self, "MyCfnSecurityConfiguration",
-            encryption_configuration=glue.CfnSecurityConfiguration.EncryptionConfigurationProperty(
-                s3_encryptions=[glue.CfnSecurityConfiguration.S3EncryptionProperty(
-                    s3_encryption_mode="SSE-S3"
-                )]
-            ),
-            name=self.glue_crawler_security_configuration_name
-        )
+        crawler_table = self.drop_crawler_table(glue_database)
+        for table_name, data_format in self.feedback_tables.items():
+            table = self.create_feedback_table(table_name, data_format)
+            table.add_dependency(glue_database.node.default_child)
+            table.node.add_dependency(crawler_table)
 
-        self.glue_crawler = glue.CfnCrawler(
-            self,
-            f"{self.glue_database_name}-crawler",
-            name=f"{self.glue_database_name}-crawler",
-            role=self.glue_crawler_role.role_arn,
-            database_name=self.glue_database_name,
-            schedule=glue.CfnCrawler.ScheduleProperty(
-                schedule_expression="cron(0 * * * ? *)"
-            ),
-            targets=glue.CfnCrawler.TargetsProperty(
-                s3_targets=[
-                    glue.CfnCrawler.S3TargetProperty(
-                        path=f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback/",
-                        exclusions=["Unsaved", "athena_query_result/**"],
-                        sample_size=100,
-                    )
-                ]
-            ),
-            crawler_security_configuration=self.glue_crawler_security_configuration_name
-        )
+        if self.content_dedup:
+            content_table = self.create_content_table()
+            content_table.add_dependency(glue_database.node.default_child)
+
+        if self.partition_registration == "events":
+            self.create_partition_registrar()
 
         # Create an Athena work group CloudFormation resource
         athena_work_group = athena.CfnWorkGroup(
@@ -273,6 +630,10 @@ class FeedbackStack(Stack):
             recursive_delete_option=True,
             state="ENABLED",
             work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+                # engine version 3 is required for query result reuse and zstd compressed JSON
+                engine_version=athena.CfnWorkGroup.EngineVersionProperty(
+                    selected_engine_version="Athena engine version 3"
+                ),
                 # Publish metrics to CloudWatch
                 publish_cloud_watch_metrics_enabled=True,
                 result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
@@ -286,6 +647,609 @@ class FeedbackStack(Stack):
             ),
         )
 
+        if self.content_dedup:
+            self.create_resolved_views(athena_work_group)
+
+        summary_table = self.create_summary_table()
+        summary_table.add_dependency(glue_database.node.default_child)
+        self.create_report_queries(athena_work_group)
+        self.create_summary_job(athena_work_group)
+
+    def drop_crawler_table(self, glue_database):
+        # Deployments from before the tables were defined by the stack have a "feedback" table
+        # created by the hourly crawler, and creating the table would fail with AlreadyExists.
+        # The schedule of the crawler is stopped first, so it can't create the table again
+        # before the update deletes it, then the crawler's table is dropped. Only the catalog
+        # entry is deleted, the objects stay in the bucket. Both calls run once, when the
+        # resources are created, and do nothing in a new deployment.
+        crawler_name = f"{self.glue_database_name}-crawler"
+        stop_schedule = AwsCustomResource(
+            self,
+            id="StopFeedbackCrawlerSchedule",
+            on_create={
+                "service": "Glue",
+                "action": "stopCrawlerSchedule",
+                "parameters": {"CrawlerName": crawler_name},
+                "physical_resource_id": PhysicalResourceId.of(f"{crawler_name}-schedule-stopped"),
+                "ignore_error_codes_matching": "EntityNotFoundException|SchedulerNotRunningException",
+            },
+            policy=AwsCustomResourcePolicy.from_sdk_calls(
+                resources=[f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:crawler/{crawler_name}"]
+            ),
+            install_latest_aws_sdk=False,
+        )
+        drop_table = AwsCustomResource(
+            self,
+            id="DropFeedbackCrawlerTable",
+            on_create={
+                "service": "Glue",
+                "action": "deleteTable",
+                "parameters": {"DatabaseName": self.glue_database_name, "Name": "feedback"},
+                "physical_resource_id": PhysicalResourceId.of(f"{self.glue_database_name}-crawler-table-dropped"),
+                "ignore_error_codes_matching": "EntityNotFoundException",
+            },
+            policy=AwsCustomResourcePolicy.from_sdk_calls(
+                resources=[
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:catalog",
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:database/{self.glue_database_name}",
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:table/{self.glue_database_name}/feedback",
+                ]
+            ),
+            install_latest_aws_sdk=False,
+        )
+        drop_table.node.add_dependency(stop_schedule)
+        drop_table.node.add_dependency(glue_database)
+        return drop_table
+
+    def storage_format(self, data_format):
+        if data_format == "json":
+            storage_format = dict(
+                input_format="org.apache.hadoop.mapred.TextInputFormat",
+                output_format="org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+                serde_info=glue.CfnTable.SerdeInfoProperty(
+                    serialization_library="org.openx.data.jsonserde.JsonSerDe",
+                    parameters={"ignore.malformed.json": "true"},
+                ),
+            )
+        else:
+            storage_format = dict(
+                input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                serde_info=glue.CfnTable.SerdeInfoProperty(
+                    serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe",
+                ),
+            )
+        return storage_format
+
+    def create_feedback_table(self, table_name, data_format):
+        location = f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/{table_name}"
+        parameters = {"classification": data_format}
+        storage_format = self.storage_format(data_format)
+
+        if self.partition_registration == "projection":
+            parameters.update(self.partition_projection(location))
+
+        return glue.CfnTable(
+            self,
+            f"{table_name}-table",
+            catalog_id=Aws.ACCOUNT_ID,
+            database_name=self.glue_database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=table_name,
+                table_type="EXTERNAL_TABLE",
+                parameters=parameters,
+                partition_keys=[
+                    glue.CfnTable.ColumnProperty(name=name, type="string")
+                    for name in self.partition_scheme
+                ],
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=location,
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name=name, type=column_type)
+                        for name, column_type in FEEDBACK_COLUMNS
+                    ],
+                    **storage_format,
+                ),
+            ),
+        )
+
+    def create_content_table(self):
+        # texts of the content store, one {"digest", "content"} JSON object per file
+        return glue.CfnTable(
+            self,
+            "feedback_content-table",
+            catalog_id=Aws.ACCOUNT_ID,
+            database_name=self.glue_database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name="feedback_content",
+                table_type="EXTERNAL_TABLE",
+                parameters={"classification": "json"},
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/feedback_content",
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name="digest", type="string"),
+                        glue.CfnTable.ColumnProperty(name="content", type="string"),
+                    ],
+                    **self.storage_format("json"),
+                ),
+            ),
+        )
+
+    def create_resolved_views(self, athena_work_group):
+        # Saved queries creating a <table>_resolved view per feedback table, which joins the
+        # full text of externalized attributes back from the content table
+        for table_name in self.feedback_tables:
+            columns = []
+            joins = []
+            for name, _ in FEEDBACK_COLUMNS:
+                content_column = dict(CONTENT_COLUMNS).get(name)
+                if content_column:
+                    alias = f"c_{name}"
+                    columns.append(f"COALESCE({alias}.content, f.{name}) AS {name}")
+                    joins.append(f"LEFT JOIN feedback_content {alias} ON {alias}.digest = f.{content_column}")
+                elif name not in dict(CONTENT_COLUMNS).values():
+                    columns.append(f"f.{name}")
+            columns += [f"f.{name}" for name in self.partition_scheme]
+            query = athena.CfnNamedQuery(
+                self,
+                f"{table_name}-resolved-view",
+                name=f"Create {table_name}_resolved view",
+                description=f"Creates the {table_name}_resolved view, {table_name} with the full text of deduplicated attributes",
+                database=self.glue_database_name,
+                work_group=athena_work_group.name,
+                query_string=(
+                    f"CREATE OR REPLACE VIEW {table_name}_resolved AS\n"
+                    f"SELECT {', '.join(columns)}\n"
+                    f"FROM {table_name} f\n" + "\n".join(joins)
+                ),
+            )
+            query.add_dependency(athena_work_group)
+
+    def create_summary_table(self):
+        # Daily feedback counts materialized by the feedback_summary function. Each run of a day
+        # is written to its own location and the partition is switched to it, so the table has
+        # no partition projection.
+        return glue.CfnTable(
+            self,
+            f"{SUMMARY_TABLE}-table",
+            catalog_id=Aws.ACCOUNT_ID,
+            database_name=self.glue_database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=SUMMARY_TABLE,
+                table_type="EXTERNAL_TABLE",
+                parameters={"classification": "parquet", "parquet.compression": "SNAPPY"},
+                partition_keys=[glue.CfnTable.ColumnProperty(name="dt", type="string")],
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=f"s3://{self.data_bucket.bucket_name}/{self.glue_database_name}/{SUMMARY_TABLE}",
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name=name, type=column_type)
+                        for name, column_type in SUMMARY_COLUMNS
+                    ],
+                    **self.storage_format("parquet"),
+                ),
+            ),
+        )
+
+    def report_source(self, columns, days):
+        # Subquery over every feedback table, limited to the partitions of the last days.
+        # An injected app partition has to be filtered on, the query then takes the app as
+        # its execution parameter.
+        partition_filter = (
+            "year || '-' || month || '-' || day >= "
+            f"date_format(current_date - interval '{days}' day, '%Y-%m-%d')"
+        )
+        if self.injected_app():
+            partition_filter += " AND app = ?"
+        selects = [
+            f"  SELECT {', '.join(columns)} FROM {table_name} WHERE {partition_filter}"
+            for table_name in self.feedback_tables
+        ]
+        return "(\n" + "\n  UNION ALL\n".join(selects) + "\n) f"
+
+    def injected_app(self):
+        return (
+            "app" in self.partition_scheme
+            and self.partition_registration == "projection"
+            and not self.node.try_get_context("app_identifiers")
+        )
+
+    def report_prompt(self):
+        # prompt column of the reports and its join; with content_dedup long prompts are
+        # stored once in the content table and only referenced by their digest
+        if self.content_dedup:
+            return (
+                "COALESCE(c.content, f.prompt)",
+                ["prompt", "promptdigest"],
+                "\nLEFT JOIN feedback_content c ON c.digest = f.promptdigest",
+            )
+        return "f.prompt", ["prompt"], ""
+
+    def feedback_values(self, values):
+        return ", ".join(f"'{value}'" for value in values)
+
+    def create_report_queries(self, athena_work_group):
+        # Saved queries of the standard feedback reports, see REPORT_QUERY_IDS of the summary job
+        positive = f"lower(feedback) IN ({self.feedback_values(self.positive_feedback)})"
+        negative = f"lower(feedback) IN ({self.feedback_values(self.negative_feedback)})"
+        satisfaction = (
+            f"round(100.0 * count_if({positive}) / "
+            f"nullif(count_if({positive}) + count_if({negative}), 0), 1) AS satisfaction_pct"
+        )
+        prompt, prompt_columns, prompt_join = self.report_prompt()
+        reports = {
+            "satisfaction_per_app": (
+                "Satisfaction per app",
+                "Positive share of the rated answers per application, last 30 days",
+                "SELECT appidentifier, count(*) AS ratings,\n"
+                f"  count_if({positive}) AS positive, count_if({negative}) AS negative,\n"
+                f"  {satisfaction}\n"
+                f"FROM {self.report_source(['appidentifier', 'feedback'], 30)}\n"
+                "GROUP BY appidentifier\n"
+                "ORDER BY ratings DESC",
+            ),
+            "worst_rated_prompts": (
+                "Worst rated prompts",
+                "Prompts with the most negative ratings, last 30 days",
+                f"SELECT appidentifier, {prompt} AS prompt, count(*) AS ratings,\n"
+                f"  count_if({negative}) AS negative,\n"
+                f"  {satisfaction}\n"
+                f"FROM {self.report_source(['appidentifier', 'feedback'] + prompt_columns, 30)}{prompt_join}\n"
+                "GROUP BY 1, 2\n"
+                f"HAVING count_if({negative}) > 0\n"
+                "ORDER BY negative DESC, satisfaction_pct ASC\n"
+                "LIMIT 50",
+            ),
+            "top_negative_comments": (
+                "Top negative comments",
+                "Most recent comments of negative ratings, last 7 days",
+                f"SELECT submittedat, appidentifier, userid, feedback, comment, {prompt} AS prompt\n"
+                f"FROM {self.report_source(['submittedat', 'appidentifier', 'userid', 'feedback', 'comment'] + prompt_columns, 7)}{prompt_join}\n"
+                f"WHERE {negative} AND comment <> ''\n"
+                "ORDER BY submittedat DESC\n"
+                "LIMIT 100",
+            ),
+            "daily_satisfaction": (
+                "Daily satisfaction per app",
+                f"Daily ratings and satisfaction per application from the {SUMMARY_TABLE} table",
+                "SELECT dt, appidentifier, sum(ratings) AS ratings,\n"
+                f"  sum(CASE WHEN {positive} THEN ratings ELSE 0 END) AS positive,\n"
+                f"  sum(CASE WHEN {negative} THEN ratings ELSE 0 END) AS negative,\n"
+                "  sum(comments) AS comments\n"
+                f"FROM {SUMMARY_TABLE}\n"
+                "WHERE dt >= date_format(current_date - interval '90' day, '%Y-%m-%d')\n"
+                "GROUP BY dt, appidentifier\n"
+                "ORDER BY dt DESC, ratings DESC",
+            ),
+        }
+        self.report_queries = {}
+        for report, (name, description, query_string) in reports.items():
+            query = athena.CfnNamedQuery(
+                self,
+                f"{report}-report-query",
+                name=name,
+                description=description,
+                database=self.glue_database_name,
+                work_group=athena_work_group.name,
+                query_string=query_string,
+            )
+            query.add_dependency(athena_work_group)
+            self.report_queries[report] = query
+
+    def create_summary_job(self, athena_work_group):
+        # Materializes the daily feedback counts into the feedback_daily_summary table every
+        # night, after the compaction job, and runs the saved report queries on demand with
+        # Athena query result reuse
+        self.summary_lambda = _lambda.Function(
+            self,
+            "feedback-summary",
+            function_name="feedback_summary",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/feedback_summary"),
+            timeout=Duration.minutes(15),
+            memory_size=256,
+            environment={
+                "S3_DATA_BUCKET": self.data_bucket.bucket_name,
+                "GLUE_DATABASE_NAME": self.glue_database_name,
+                "PARTITION_SCHEME": ",".join(self.partition_scheme),
+                "SOURCE_TABLES": ",".join(self.feedback_tables),
+                "SUMMARY_TABLE": SUMMARY_TABLE,
+                "ATHENA_WORK_GROUP": athena_work_group.name,
+                "APP_IDENTIFIERS": self.node.try_get_context("app_identifiers") or "",
+                "REPORT_QUERY_IDS": ",".join(
+                    f"{report}={query.attr_named_query_id}" for report, query in self.report_queries.items()
+                ),
+            },
+            layers=self.writer_layers,
+        )
+        self.summary_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["athena:StartQueryExecution", "athena:GetQueryExecution", "athena:GetNamedQuery"],
+                resources=[
+                    f"arn:aws:athena:{Aws.REGION}:{Aws.ACCOUNT_ID}:workgroup/{athena_work_group.name}"
+                ],
+            )
+        )
+        self.summary_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "glue:GetDatabase",
+                    "glue:GetTable",
+                    "glue:CreateTable",
+                    "glue:DeleteTable",
+                    "glue:GetPartition",
+                    "glue:GetPartitions",
+                    "glue:CreatePartition",
+                    "glue:BatchCreatePartition",
+                    "glue:UpdatePartition",
+                    "glue:DeletePartition",
+                    "glue:BatchDeletePartition",
+                ],
+                resources=[
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:catalog",
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:database/{self.glue_database_name}",
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:table/{self.glue_database_name}/*",
+                ],
+            )
+        )
+        # Athena reads the feedback tables and writes results and summary files as the caller
+        self.data_bucket.grant_read_write(self.summary_lambda)
+        self.data_bucket.grant_delete(self.summary_lambda)
+
+        events.Rule(
+            self,
+            "FeedbackSummarySchedule",
+            schedule=events.Schedule.cron(minute="0", hour="2"),
+            targets=[targets.LambdaFunction(self.summary_lambda)],
+        )
+
+    def partition_projection(self, location):
+        # year is projected up to the current year, so the table never needs an update
+        projection_start_year = self.node.try_get_context("projection_start_year") or "2024"
+        projections = {
+            "year": {
+                "type": "date",
+                "format": "yyyy",
+                "range": f"{projection_start_year},NOW",
+                "interval": "1",
+                "interval.unit": "YEARS",
+            },
+            "month": {"type": "integer", "range": "1,12", "digits": "2"},
+            "day": {"type": "integer", "range": "1,31", "digits": "2"},
+            "hour": {"type": "integer", "range": "0,23", "digits": "2"},
+        }
+        # Applications can only be projected from a known list. Without app_identifiers the
+        # app column is injected, i.e. queries have to filter on a single app.
+        app_identifiers = self.node.try_get_context("app_identifiers")
+        if app_identifiers:
+            projections["app"] = {"type": "enum", "values": app_identifiers}
+        else:
+            projections["app"] = {"type": "injected"}
+
+        parameters = {"projection.enabled": "true"}
+        for name in self.partition_scheme:
+            for setting, value in projections[name].items():
+                parameters[f"projection.{name}.{setting}"] = value
+        parameters["storage.location.template"] = location + "".join(
+            f"/{name}=${{{name}}}" for name in self.partition_scheme
+        )
+        return parameters
+
+    def feedback_object_topic(self):
+        # S3 does not allow overlapping notification rules, so new feedback objects are
+        # published once to an SNS topic that every consumer subscribes to
+        if getattr(self, "_feedback_object_topic", None) is None:
+            topic_key = kms.Key(
+                self,
+                "FeedbackObjectTopicKey",
+                enable_key_rotation=True,
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            topic_key.grant(
+                iam.ServicePrincipal("s3.amazonaws.com"), "kms:GenerateDataKey*", "kms:Decrypt"
+            )
+            self._feedback_object_topic = sns.Topic(
+                self,
+                "FeedbackObjectCreatedTopic",
+                master_key=topic_key,
+                enforce_ssl=True,
+            )
+            # only the feedback tables, the rollups, indexes, summaries and the content store
+            # are written below the same database prefix
+            for table_name in self.feedback_tables:
+                self.data_bucket.add_event_notification(
+                    s3.EventType.OBJECT_CREATED,
+                    s3n.SnsDestination(self._feedback_object_topic),
+                    s3.NotificationKeyFilter(prefix=f"{self.glue_database_name}/{table_name}/"),
+                )
+        return self._feedback_object_topic
+
+    def create_partition_registrar(self):
+        # Registers the partition of every new feedback object in the Glue catalog
+        self.partition_registrar_lambda = _lambda.Function(
+            self,
+            "feedback-partition-registrar",
+            function_name="feedback_partition_registrar",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/partition_registrar"),
+            timeout=Duration.seconds(60),
+            memory_size=256,
+            environment={
+                "GLUE_DATABASE_NAME": self.glue_database_name,
+                "GLUE_TABLES": ",".join(self.feedback_tables),
+            },
+        )
+        self.partition_registrar_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["glue:GetTable", "glue:BatchCreatePartition"],
+                resources=[
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:catalog",
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:database/{self.glue_database_name}",
+                    f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:table/{self.glue_database_name}/*",
+                ],
+            )
+        )
+        self.feedback_object_topic().add_subscription(
+            sns_subscriptions.LambdaSubscription(self.partition_registrar_lambda)
+        )
+
+    def create_compaction_job(self):
+        # Merges the small per record objects of closed day partitions into large files, written
+        # to a new location that registered Glue partitions are switched to. Projected partitions
+        # are always read from the layout, the files are copied into them instead. With
+        # output_format parquet the days are rewritten into the feedback_parquet table. Originals
+        # are archived below feedback_archive/ instead of deleted when the compaction_archive
+        # context flag is set.
+        environment = self.writer_environment()
+        environment["PARTITION_REGISTRATION"] = self.partition_registration
+        if self.node.try_get_context("compaction_archive"):
+            environment["ARCHIVE_PREFIX"] = f"{self.glue_database_name}/feedback_archive"
+
+        self.compaction_lambda = _lambda.Function(
+            self,
+            "feedback-compactor",
+            function_name="feedback_compactor",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/feedback_compactor"),
+            timeout=Duration.minutes(15),
+            memory_size=2048 if self.output_format == "parquet" else 1024,
+            environment=environment,
+            layers=self.writer_layers,
+        )
+        if self.partition_registration == "events":
+            self.compaction_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["glue:GetTable", "glue:CreatePartition", "glue:UpdatePartition"],
+                    resources=[
+                        f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:catalog",
+                        f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:database/{self.glue_database_name}",
+                        f"arn:aws:glue:{Aws.REGION}:{Aws.ACCOUNT_ID}:table/{self.glue_database_name}/*",
+                    ],
+                )
+            )
+        self.data_bucket.grant_read_write(self.compaction_lambda)
+        self.data_bucket.grant_delete(self.compaction_lambda)
+
+        # run once a day, after the previous day has been closed
+        events.Rule(
+            self,
+            "FeedbackCompactionSchedule",
+            schedule=events.Schedule.cron(minute="30", hour="1"),
+            targets=[targets.LambdaFunction(self.compaction_lambda)],
+        )
+
+    def create_rollup_job(self):
+        # Adds every new feedback object to the counts below feedback_rollups/, the rollups
+        # of a day are rebuilt by invoking the function with {"rebuild": "YYYY-MM-DD"}
+        self.rollup_lambda = _lambda.Function(
+            self,
+            "feedback-rollup",
+            function_name="feedback_rollup",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/feedback_rollup"),
+            timeout=Duration.minutes(5),
+            memory_size=2048 if self.output_format == "parquet" else 512,
+            environment=self.writer_environment(),
+            layers=self.writer_layers,
+        )
+        self.data_bucket.grant_read_write(self.rollup_lambda)
+        self.feedback_object_topic().add_subscription(
+            sns_subscriptions.LambdaSubscription(self.rollup_lambda)
+        )
+
+    def create_comment_index_job(self):
+        # Indexes the comments of new negative feedback below feedback_comment_index/ and
+        # merges the index segments of the last closed days every night
+        self.comment_index_lambda = _lambda.Function(
+            self,
+            "feedback-comment-indexer",
+            function_name="feedback_comment_indexer",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/comment_indexer"),
+            timeout=Duration.minutes(5),
+            memory_size=2048 if self.output_format == "parquet" else 512,
+            environment={
+                **self.writer_environment(),
+                "INDEX_FIELDS": self.comment_index_fields,
+                "NEGATIVE_FEEDBACK": ",".join(self.negative_feedback),
+            },
+            layers=self.writer_layers,
+        )
+        self.data_bucket.grant_read_write(self.comment_index_lambda)
+        self.data_bucket.grant_delete(self.comment_index_lambda)
+        self.feedback_object_topic().add_subscription(
+            sns_subscriptions.LambdaSubscription(self.comment_index_lambda)
+        )
+
+        events.Rule(
+            self,
+            "CommentIndexMergeSchedule",
+            schedule=events.Schedule.cron(minute="45", hour="1"),
+            targets=[
+                targets.LambdaFunction(
+                    self.comment_index_lambda,
+                    event=events.RuleTargetInput.from_object({"merge": True}),
+                )
+            ],
+        )
+
+    def create_read_api(self):
+        # Adds every new feedback object to the per app, day and hour index below
+        # feedback_index/, which the reader function pages through for GET /feedback.
+        # The index of a day is rebuilt by invoking the index function with {"rebuild": "YYYY-MM-DD"}
+        self.index_lambda = _lambda.Function(
+            self,
+            "feedback-index",
+            function_name="feedback_index",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/feedback_index"),
+            timeout=Duration.minutes(5),
+            memory_size=2048 if self.output_format == "parquet" else 512,
+            environment=self.writer_environment(),
+            layers=self.writer_layers,
+        )
+        self.data_bucket.grant_read_write(self.index_lambda)
+        self.feedback_object_topic().add_subscription(
+            sns_subscriptions.LambdaSubscription(self.index_lambda)
+        )
+
+        self.reader_lambda = _lambda.Function(
+            self,
+            "feedback-reader",
+            function_name="feedback_reader",
+            handler="lambda-handler.lambda_handler",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            code=_lambda.Code.from_asset("../../source/feedback_reader"),
+            timeout=Duration.seconds(10),
+            # more memory also means more CPU and network bandwidth for the index reads
+            memory_size=1024,
+            environment=self.writer_environment(),
+            layers=self.writer_layers,
+        )
+        self.data_bucket.grant_read(self.reader_lambda)
+
+        self.get_feedback = self.feedback.add_method(
+            "GET",
+            integration=apigateway.LambdaIntegration(self.reader_lambda),
+            authorization_type=apigateway.AuthorizationType.IAM,
+            request_parameters={
+                "method.request.querystring.appIdentifier": True,
+                "method.request.querystring.start": False,
+                "method.request.querystring.end": False,
+                "method.request.querystring.feedback": False,
+                "method.request.querystring.limit": False,
+                "method.request.querystring.cursor": False,
+            },
+            request_validator_options=apigateway.RequestValidatorOptions(
+                validate_request_parameters=True,
+            ),
+        )
+
     def create_qbusiness_lambda(self):
         # Defining an IAM policy for the Business Q service with necessary permissions
         policy_statement_q = iam.PolicyStatement(
@@ -295,13 +1259,6 @@ class FeedbackStack(Stack):
                 f"arn:aws:qbusiness:{Aws.REGION}:{Aws.ACCOUNT_ID}:application/{self.application_id}"
             ],
         )
-        # Define an IAM policy to invoke the API Gateway
-        policy_statement_api = iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=["execute-api:Invoke"],
-            resources=[self.post_feedback.method_arn],
-        )
-        # Add IAM authentication to API Gateway
 
         # Creating an IAM role for the Lambda
         self.qbusiness_lambda_role = iam.Role(
@@ -319,21 +1276,67 @@ class FeedbackStack(Stack):
             self,
             "businessq-feedback-processor",
             function_name="businessq_feedback_processor",
-            handler="lambda-handler.lambda_handler",
+            handler="lambda-handler.sqs_batch_handler" if self.qbusiness_queue else "lambda-handler.lambda_handler",
             runtime=_lambda.Runtime.PYTHON_3_11,
             code=_lambda.Code.from_asset("../../source/businessq_feedback_processor"),
             timeout=Duration.seconds(240),
             memory_size=256,
             role=self.qbusiness_lambda_role,
-            environment={"API_GATEWAY_URL": self.api.url_for_path(self.feedback.path)},
-            layers=[self.lambda_layer],
+            environment={
+                **self.writer_environment(),
+                "FEEDBACK_SINK": self.qbusiness_sink,
+                "API_GATEWAY_URL": self.api.url_for_path(self.feedback.path),
+            },
+            layers=self.writer_layers,
         )
         self.qbusiness_feedback_processor.add_to_role_policy(policy_statement_q)
-        self.qbusiness_feedback_processor.add_to_role_policy(policy_statement_api)
+
+        if self.qbusiness_sink == "api":
+            # Define an IAM policy to invoke the API Gateway
+            policy_statement_api = iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["execute-api:Invoke"],
+                resources=[self.post_feedback.method_arn],
+            )
+            self.qbusiness_feedback_processor.add_to_role_policy(policy_statement_api)
 
         # Assigning permissions to the created Lambda function for S3 bucket
         self.data_bucket.grant_write(self.qbusiness_feedback_processor)
 
+        if self.qbusiness_queue:
+            self.create_qbusiness_queue()
+
+    def create_qbusiness_queue(self):
+        # PutFeedback events are buffered in a queue and processed in batches, bursts of
+        # ratings are absorbed by the queue instead of one invocation per rating
+        qbusiness_dlq = sqs.Queue(
+            self,
+            "businessq-feedback-dlq",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+        )
+        self.qbusiness_queue_resource = sqs.Queue(
+            self,
+            "businessq-feedback-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            # six times the processor timeout, as recommended for Lambda event sources
+            visibility_timeout=Duration.seconds(1440),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=qbusiness_dlq),
+        )
+        self.qbusiness_feedback_processor.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                self.qbusiness_queue_resource,
+                batch_size=int(self.node.try_get_context("qbusiness_batch_size") or 50),
+                max_batching_window=Duration.seconds(
+                    int(self.node.try_get_context("qbusiness_batching_window_seconds") or 5)
+                ),
+                max_concurrency=int(self.node.try_get_context("qbusiness_max_concurrency") or 5),
+                report_batch_item_failures=True,
+            )
+        )
+
     def create_cloudtrail(self):
         # Setting up a CloudTrail 'trail' and sending its logs to CloudWatch
         self.trail = cloudtrail.Trail(
@@ -346,7 +1349,11 @@ class FeedbackStack(Stack):
         event_rule = cloudtrail.Trail.on_event(
             self,
             "BusinessQCloudWatchEvent",
-            target=targets.LambdaFunction(self.qbusiness_feedback_processor),
+            target=(
+                targets.SqsQueue(self.qbusiness_queue_resource)
+                if self.qbusiness_queue
+                else targets.LambdaFunction(self.qbusiness_feedback_processor)
+            ),
         )
 
         event_rule.add_event_pattern(
@@ -0,0 +1,76 @@
+import gzip
+import io
+import json
+from datetime import timedelta
+
+# Reading of the log files CloudTrail delivers to the trail bucket:
+#   [prefix/]AWSLogs/{account}/CloudTrail/{region}/YYYY/MM/DD/{account}_CloudTrail_{region}_..._.json.gz
+# Each file is one gzip compressed JSON document {"Records": [...]}. Files are streamed
+# and their records decoded one at a time, so a file never has to fit in memory.
+
+READ_SIZE = 256 * 1024
+
+
+def day_prefixes(store, logs_prefix, start, end, accounts=None, regions=None):
+    # Yields the prefixes of the log files of [start, end) for the accounts and regions,
+    # all of the trail's accounts and regions when not given
+    logs_prefix = logs_prefix.rstrip('/') + '/'
+    if accounts:
+        account_prefixes = [f'{logs_prefix}{account}/' for account in accounts]
+    else:
+        account_prefixes = list(store.list_prefixes(logs_prefix))
+    for account_prefix in account_prefixes:
+        trail_prefix = f'{account_prefix}CloudTrail/'
+        if regions:
+            region_prefixes = [f'{trail_prefix}{region}/' for region in regions]
+        else:
+            region_prefixes = list(store.list_prefixes(trail_prefix))
+        for region_prefix in region_prefixes:
+            day = start.date()
+            while day <= (end - timedelta(microseconds=1)).date():
+                yield f'{region_prefix}{day:%Y/%m/%d}/'
+                day += timedelta(days=1)
+
+
+def iter_records(stream):
+    # Yields the records of a log file from a binary stream of the gzip compressed file.
+    # The decompressed text is decoded record by record with raw_decode, keeping only
+    # the undecoded rest of the last read in memory.
+    text = io.TextIOWrapper(gzip.GzipFile(fileobj=stream), encoding='utf-8')
+    decoder = json.JSONDecoder()
+    buffer = ''
+    in_records = False
+    while True:
+        chunk = text.read(READ_SIZE)
+        buffer += chunk
+        if not in_records:
+            start = buffer.find('"Records"')
+            start = buffer.find('[', start) if start >= 0 else -1
+            if start < 0:
+                if not chunk:
+                    return
+                continue
+            buffer = buffer[start + 1:]
+            in_records = True
+        position = 0
+        while True:
+            # skip the separators between records
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the record continues in the next read
+                if not chunk:
+                    raise
+                break
+            yield record
+        buffer = buffer[position:]
+        if not chunk:
+            return
+
+
+def is_put_feedback(record):
+    return record.get('eventSource') == 'qbusiness.amazonaws.com' and record.get('eventName') == 'PutFeedback'
@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import json
+import re
+import sys
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+from common.compression import compress, decompress, extension
+from common.feedback_layout import is_hidden
+from common.feedback_sink import DEFAULT_PARTITION_SCHEME, FeedbackSink
+
+# Inverted index over the comments (and optionally prompts) of negative feedback, sharded
+# by day next to the feedback tables:
+#   {glue_database_name}/feedback_comment_index/day=YYYY-MM-DD/segment-<id>.json[.gz|.zst]
+#   {"day": ..., "docs": [{"interactionId": ..., "recordId": ..., "appIdentifier": ...,
+#                          "feedback": ..., "submittedAt": ..., "time": ...}, ...],
+#    "postings": {"comment": {"outdated": [[doc, position, ...], ...], ...}, ...}}
+# Every indexed feedback object adds one segment, named after the object, so a repeated
+# delivery rewrites the same segment. merge_day combines the segments of a day into one,
+# like the compaction job does with the raw objects. Searches read every segment of the
+# days in range and return each record once, so a merge interrupted after writing the
+# merged segment only leaves duplicates that are not returned.
+#
+#   python -m common.comment_index --root ./data --database chatbot_user_feedback \
+#       --start 2024-05-01 --end 2024-05-07 '"outdated policy" refund'
+
+INDEX_TABLE = 'feedback_comment_index'
+SEGMENT_PREFIX = 'segment-'
+MERGED_PREFIX = 'segment-merged-'
+DEFAULT_FIELDS = ('comment',)
+DEFAULT_NEGATIVE_FEEDBACK = ('thumbsdown', 'thumbs_down', 'not_useful', 'negative')
+DOC_ATTRIBUTES = ('interactionId', 'recordId', 'appIdentifier', 'feedback', 'submittedAt')
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# a query is a list of terms and "quoted phrases", all of which have to match
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    # Lower case word tokens, compatibility normalized so e.g. full width letters match
+    return TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text).casefold())
+
+
+def parse_query(query):
+    # Returns the phrases of a query, a single term being a phrase of one token
+    phrases = []
+    for quoted, term in QUERY_PATTERN.findall(query):
+        tokens = tokenize(quoted or term)
+        if tokens:
+            phrases.append(tokens)
+    return phrases
+
+
+def doc_key(doc):
+    return doc.get('recordId') or doc.get('interactionId')
+
+
+class CommentIndex:
+
+    def __init__(self, store, glue_database_name, partition_scheme=DEFAULT_PARTITION_SCHEME,
+                 fields=DEFAULT_FIELDS, negative_feedback=DEFAULT_NEGATIVE_FEEDBACK,
+                 compression='none', max_lateness_days=7):
+        self.store = store
+        self.glue_database_name = glue_database_name
+        self.fields = list(fields)
+        self.negative_feedback = {value.lower() for value in negative_feedback}
+        self.compression = compression
+        # only used for the partition time of the records, nothing is written
+        self.sink = FeedbackSink(None, glue_database_name, partition_scheme=partition_scheme,
+                                 max_lateness_days=max_lateness_days)
+
+    def day_prefix(self, day):
+        return f"{self.glue_database_name}/{INDEX_TABLE}/day={day:%Y-%m-%d}/"
+
+    def indexed(self, record):
+        # negative feedback with text in one of the indexed fields
+        if str(record.get('feedback')).lower() not in self.negative_feedback:
+            return False
+        return any(isinstance(record.get(field), str) and record[field].strip() for field in self.fields)
+
+    def build_segment(self, day, records):
+        # records: (record, partition time) pairs
+        docs = []
+        postings = {field: {} for field in self.fields}
+        for record, time in records:
+            doc = len(docs)
+            docs.append(dict(
+                {name: record.get(name) for name in DOC_ATTRIBUTES},
+                time=time.isoformat(),
+            ))
+            for field in self.fields:
+                positions = {}
+                for position, token in enumerate(tokenize(record.get(field) or '')):
+                    positions.setdefault(token, []).append(position)
+                for token, token_positions in positions.items():
+                    postings[field].setdefault(token, []).append([doc] + token_positions)
+        return {'day': f'{day:%Y-%m-%d}', 'docs': docs, 'postings': postings}
+
+    def write_segment(self, key, segment):
+        body = json.dumps(segment, separators=(',', ':'), ensure_ascii=False)
+        self.store.put(key, compress(body, self.compression), ContentType='application/json')
+
+    def add_records(self, records, source_key):
+        # Indexes the matching records of a feedback object, one segment per day of their
+        # partition time. Returns the keys of the segments written.
+        by_day = {}
+        for record in records:
+            if self.indexed(record):
+                time = self.sink.partition_time(record, source_key)
+                by_day.setdefault(time.date(), []).append((record, time))
+        name = hashlib.sha256(source_key.encode('utf-8')).hexdigest()[:32]
+        keys = []
+        for day, day_records in sorted(by_day.items()):
+            key = f"{self.day_prefix(day)}{SEGMENT_PREFIX}{name}.json{extension(self.compression)}"
+            self.write_segment(key, self.build_segment(day, day_records))
+            keys.append(key)
+        return keys
+
+    def segment_keys(self, day):
+        prefix = self.day_prefix(day)
+        return sorted(
+            key for key, _ in self.store.list_objects(prefix)
+            if not is_hidden(prefix, key) and key[len(prefix):].startswith(SEGMENT_PREFIX)
+        )
+
+    def read_segment(self, key):
+        return json.loads(decompress(key, self.store.get(key)))
+
+    def merge_day(self, day):
+        # Combines the segments of a day into one, written before the merged segments are
+        # deleted. Segments added while the merge runs are left for the next merge.
+        keys = self.segment_keys(day)
+        if len(keys) < 2:
+            return None
+        docs = []
+        postings = {}
+        positions_of = {}
+        for key in keys:
+            segment = self.read_segment(key)
+            # document numbers of the segment in the merged segment, None for duplicates
+            mapping = []
+            for doc in segment['docs']:
+                if doc_key(doc) in positions_of:
+                    mapping.append(None)
+                    continue
+                positions_of[doc_key(doc)] = len(docs)
+                mapping.append(len(docs))
+                docs.append(doc)
+            for field, terms in segment['postings'].items():
+                merged_terms = postings.setdefault(field, {})
+                for term, entries in terms.items():
+                    merged_entries = merged_terms.setdefault(term, [])
+                    for entry in entries:
+                        if mapping[entry[0]] is not None:
+                            merged_entries.append([mapping[entry[0]]] + entry[1:])
+        name = hashlib.sha256('\n'.join(keys).encode('utf-8')).hexdigest()[:32]
+        merged_key = f"{self.day_prefix(day)}{MERGED_PREFIX}{name}.json{extension(self.compression)}"
+        self.write_segment(merged_key, {'day': f'{day:%Y-%m-%d}', 'docs': docs, 'postings': postings})
+        self.store.delete(keys)
+        return merged_key
+
+    def match(self, segment, phrases, fields):
+        # Returns the document numbers of a segment containing every phrase in one of the fields
+        matched = None
+        for phrase in phrases:
+            phrase_docs = set()
+            for field in fields:
+                terms = segment['postings'].get(field, {})
+                if any(token not in terms for token in phrase):
+                    continue
+                # positions of every token per document, a phrase matches at consecutive positions
+                token_positions = [
+                    {entry[0]: set(entry[1:]) for entry in terms[token]} for token in phrase
+                ]
+                for doc, starts in token_positions[0].items():
+                    for offset, positions in enumerate(token_positions[1:], start=1):
+                        starts = {start for start in starts if start + offset in positions.get(doc, ())}
+                        if not starts:
+                            break
+                    if starts:
+                        phrase_docs.add(doc)
+            matched = phrase_docs if matched is None else matched & phrase_docs
+            if not matched:
+                return set()
+        return matched or set()
+
+    def search(self, query, start, end, apps=None, fields=None):
+        # Returns the indexed records of [start, end) matching every term and phrase of the
+        # query in one of the fields (by default every indexed field), most recent first
+        phrases = parse_query(query)
+        if not phrases:
+            return []
+        app_values = {str(app) for app in apps} if apps else None
+        hits = {}
+        day = start.date()
+        while datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc) < end:
+            for key in self.segment_keys(day):
+                segment = self.read_segment(key)
+                for doc in self.match(segment, phrases, fields or list(segment['postings'])):
+                    hit = segment['docs'][doc]
+                    if app_values is not None and str(hit.get('appIdentifier')) not in app_values:
+                        continue
+                    if start <= datetime.fromisoformat(hit['time']) < end:
+                        hits[doc_key(hit)] = hit
+            day += timedelta(days=1)
+        return sorted(hits.values(), key=lambda hit: (hit['time'], str(hit.get('submittedAt'))), reverse=True)
+
+
+def main(argv=None):
+    from common.feedback_query import parse_time, write_rows
+    from common.object_store import LocalObjectStore, S3ObjectStore
+
+    parser = argparse.ArgumentParser(description='Search the comments of negative feedback.')
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--root', help='local directory that mirrors the data bucket')
+    location.add_argument('--bucket', help='data bucket name')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. a local stand-in')
+    parser.add_argument('--database', required=True, help='glue database name, the top level prefix')
+    parser.add_argument('--start', required=True, help='first day (YYYY-MM-DD) or time (ISO 8601)')
+    parser.add_argument('--end', help='last day (YYYY-MM-DD) or end time (ISO 8601, exclusive), defaults to start')
+    parser.add_argument('--app', action='append', help='only this app identifier, repeatable')
+    parser.add_argument('--field', action='append', help='only search this field, repeatable')
+    parser.add_argument('--merge', action='store_true', help='merge the segments of the days instead of searching')
+    parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table')
+    parser.add_argument('query', nargs='?', help='terms and "quoted phrases", all of which have to match')
+    args = parser.parse_args(argv)
+
+    store = LocalObjectStore(args.root) if args.root else S3ObjectStore(args.bucket, endpoint_url=args.endpoint_url)
+    index = CommentIndex(store, args.database)
+    start = parse_time(args.start)
+    end = parse_time(args.end or args.start, end=True)
+
+    if args.merge:
+        day = start.date()
+        while datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc) < end:
+            merged_key = index.merge_day(day)
+            print(f"{day:%Y-%m-%d}: {merged_key or 'nothing to merge'}")
+            day += timedelta(days=1)
+        return
+    if not args.query:
+        parser.error('a query is required unless --merge is given')
+    hits = index.search(args.query, start, end, apps=args.app, fields=args.field)
+    write_rows([{name: hit.get(name) for name in DOC_ATTRIBUTES} for hit in hits], args.format, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
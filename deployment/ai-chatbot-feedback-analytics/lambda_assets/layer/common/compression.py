@@ -0,0 +1,61 @@
+import gzip
+
+# Compression of the JSON objects of the feedback tables. Athena and the Glue crawlers pick
+# the codec from the file extension (.gz, .zst), so compressed objects are named
+# <name>.json.gz or <name>.json.zst and no Content-Encoding is set, which would make HTTP
+# clients decompress the download. Readers decompress by extension and magic bytes, so
+# compressed and uncompressed objects can be mixed in a table.
+#
+# zstd requires the zstandard package (part of the layer requirements); it is imported on
+# first use so gzip and uncompressed writers never load it.
+
+EXTENSIONS = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+_zstd = None
+
+
+def _zstandard():
+    global _zstd
+    if _zstd is None:
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("zstd compression requires the zstandard package, pip install zstandard") from e
+        _zstd = zstandard
+    return _zstd
+
+
+def extension(codec):
+    if codec not in EXTENSIONS:
+        raise ValueError(f"unsupported compression {codec}, use one of {', '.join(EXTENSIONS)}")
+    return EXTENSIONS[codec]
+
+
+def compress(data, codec, level=None):
+    # Returns the compressed bytes of data (str or bytes). The output only depends on the
+    # input, so an object written twice has the same content.
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if codec == 'gzip':
+        # mtime is part of the gzip header, a fixed value keeps the output deterministic
+        return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+    if codec == 'zstd':
+        return _zstandard().ZstdCompressor(level=3 if level is None else level).compress(data)
+    extension(codec)
+    return data
+
+
+def decompress(key, body):
+    # Returns the uncompressed bytes of an object of any supported codec
+    if key.endswith('.gz') or body[:2] == GZIP_MAGIC:
+        return gzip.decompress(body)
+    if key.endswith('.zst') or body[:4] == ZSTD_MAGIC:
+        return _zstandard().ZstdDecompressor().decompress(body, max_output_size=1024 * 1024 * 1024)
+    return body
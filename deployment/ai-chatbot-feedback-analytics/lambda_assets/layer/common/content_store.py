@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+
+from common.compression import compress, extension as compression_extension
+from common.object_store import put_if_absent
+from common.ttl_cache import TTLCache
+
+# Content addressed store for the large text attributes of feedback records. A text is
+# stored once below {glue_database_name}/feedback_content/, keyed by its SHA-256 digest,
+# and the record keeps the digest and a short preview. The feedback_content table and
+# the <table>_resolved views join the full text back.
+
+CONTENT_TABLE = 'feedback_content'
+
+# record attribute -> attribute holding its digest
+CONTENT_FIELDS = {
+    'prompt': 'promptDigest',
+    'response': 'responseDigest',
+    'sourceAttribution': 'sourceAttributionDigest',
+}
+
+
+def content_text(value):
+    # structured attributions are stored as canonical JSON so equal values share a digest
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def content_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ContentStore:
+
+    def __init__(self, s3_client, bucket, glue_database_name, min_chars=1024, preview_chars=256, cache=None,
+                 compression='none'):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = f'{glue_database_name}/{CONTENT_TABLE}'
+        # shorter texts stay inline, storing them separately would cost more than it saves
+        self.min_chars = min_chars
+        self.preview_chars = preview_chars
+        # digests written by this container, so repeated content doesn't cost a PUT
+        self.written = cache if cache is not None else TTLCache(maxsize=4096, ttl=3600)
+        # compression of the content objects, see common.compression
+        self.compression = compression
+        self.json_extension = '.json' + compression_extension(compression)
+
+    @classmethod
+    def from_environment(cls, s3_client, bucket, glue_database_name, compression='none'):
+        return cls(
+            s3_client, bucket, glue_database_name,
+            min_chars=int(os.environ.get('CONTENT_MIN_CHARS', '1024')),
+            preview_chars=int(os.environ.get('CONTENT_PREVIEW_CHARS', '256')),
+            cache=TTLCache(
+                maxsize=int(os.environ.get('CONTENT_CACHE_SIZE', '4096')),
+                ttl=int(os.environ.get('CONTENT_CACHE_TTL_SECONDS', '3600')),
+            ),
+            compression=compression,
+        )
+
+    def key(self, digest):
+        # the first digest characters spread the objects over S3 prefixes
+        return f'{self.prefix}/{digest[:2]}/{digest}{self.json_extension}'
+
+    def put(self, text):
+        # Stores the text unless it is known to exist and returns its digest
+        digest = content_digest(text)
+        if self.written.get(digest):
+            return digest
+        body = json.dumps({'digest': digest, 'content': text})
+        if self.compression != 'none':
+            body = compress(body, self.compression)
+        # an existing object is left untouched
+        put_if_absent(self.s3, self.bucket, self.key(digest), body)
+        self.written.set(digest, True)
+        return digest
+
+    def externalize(self, record):
+        # Returns a copy of the record with the large attributes replaced by a preview and
+        # their digest. The same text always yields the same digest, so writes are idempotent.
+        externalized = dict(record)
+        for field, digest_field in CONTENT_FIELDS.items():
+            value = record.get(field)
+            if value is None or value == "":
+                continue
+            text = content_text(value)
+            if len(text) < self.min_chars:
+                continue
+            externalized[field] = text[:self.preview_chars]
+            externalized[digest_field] = self.put(text)
+        return externalized
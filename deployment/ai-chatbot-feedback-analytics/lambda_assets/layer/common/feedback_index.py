@@ -0,0 +1,233 @@
+import base64
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from common.feedback_sink import DEFAULT_PARTITION_SCHEME, FeedbackSink, format_timestamp
+from common.ttl_cache import TTLCache
+
+# Read index of the feedback records behind GET /feedback, one directory per day and app:
+#   {glue_database_name}/feedback_index/day=YYYY-MM-DD/app={appIdentifier}/manifest.json
+#   {"app": ..., "day": ..., "hours": {"09": {"records": 3, "feedback": {"thumbs_up": 2, ...}}, ...}}
+#   {glue_database_name}/feedback_index/day=YYYY-MM-DD/app={appIdentifier}/hour=09.json
+#   {"app": ..., "day": ..., "hour": "09", "entries": [{"time": ..., "recordId": ..., ...}, ...]}
+# Entries are ordered newest first by the partition time of the record (see
+# FeedbackSink.partition_time) and the recordId. A page reads the manifests of its days,
+# skips the hours without matching records and reads the hour objects it returns entries
+# from, so its cost does not depend on the number of feedback objects.
+# Updates are conditional writes (S3 If-Match) retried on conflict: the hour object is
+# written first, then the counts of the hour in the manifest. Entries are only added, so
+# the manifest keeps the larger count of two concurrent updates.
+
+INDEX_TABLE = 'feedback_index'
+MANIFEST_NAME = 'manifest.json'
+ENTRY_ATTRIBUTES = ('recordId', 'interactionId', 'feedback', 'comment', 'userId', 'submittedAt')
+# manifests read concurrently while a page is filled
+MANIFEST_FETCH = 8
+
+
+def entry_id(record):
+    # records written before record ids existed are identified by content
+    record_id = record.get('recordId')
+    if not record_id:
+        record_id = hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+    return record_id
+
+
+def sort_key(entry):
+    return entry['time'], entry['recordId']
+
+
+def hour_summary(entries):
+    counts = {}
+    for entry in entries:
+        value = str(entry.get('feedback'))
+        counts[value] = counts.get(value, 0) + 1
+    return {'records': len(entries), 'feedback': counts}
+
+
+def encode_cursor(position):
+    data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Returns the position of a cursor with the range of its query as datetimes, None
+    # when the cursor was not returned by page. Cursors are not signed, a client can
+    # change them, so page checks the range of a cursor like the range of a request.
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        position['s'] = datetime.fromisoformat(position['s'])
+        position['e'] = datetime.fromisoformat(position['e'])
+        times = (position['s'], position['e'], datetime.fromisoformat(position['t']))
+        if any(time.tzinfo is None for time in times) or not isinstance(position['r'], str):
+            return None
+        return position if 'q' in position else None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+class FeedbackIndex:
+
+    def __init__(self, store, glue_database_name, partition_scheme=DEFAULT_PARTITION_SCHEME,
+                 max_lateness_days=7, max_attempts=10, cache_size=1024, cache_ttl=5, closed_cache_ttl=300):
+        self.store = store
+        self.glue_database_name = glue_database_name
+        self.max_attempts = max_attempts
+        # only used for the partition time of the records, nothing is written
+        self.sink = FeedbackSink(None, glue_database_name, partition_scheme=partition_scheme,
+                                 max_lateness_days=max_lateness_days)
+        # index objects read by warm invocations. Days older than the lateness window only
+        # change on a rebuild or backfill and are kept longer.
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.closed_cache = TTLCache(maxsize=cache_size, ttl=closed_cache_ttl)
+        self._executor = None
+
+    def app_prefix(self, app, day):
+        return f"{self.glue_database_name}/{INDEX_TABLE}/day={day}/app={quote(str(app), safe='')}/"
+
+    def manifest_key(self, app, day):
+        return self.app_prefix(app, day) + MANIFEST_NAME
+
+    def hour_key(self, app, day, hour):
+        return f"{self.app_prefix(app, day)}hour={hour}.json"
+
+    def entry(self, record, time):
+        return dict({name: record.get(name) for name in ENTRY_ATTRIBUTES},
+                    recordId=entry_id(record), time=format_timestamp(time))
+
+    def add_records(self, records, replace=False):
+        # Adds (record, object key) pairs to the hours of the records' partition time,
+        # returns the number of entries added. The key places records without timestamps
+        # in the partition of their object. replace discards the stored entries of the
+        # hours written.
+        groups = {}
+        for record, key in records:
+            time = self.sink.partition_time(record, key)
+            group = (str(record['appIdentifier']), f'{time:%Y-%m-%d}', f'{time:%H}')
+            groups.setdefault(group, []).append(self.entry(record, time))
+        added = 0
+        summaries = {}
+        for (app, day, hour), entries in sorted(groups.items()):
+            hour_added, summary = self.update_hour(app, day, hour, entries, replace)
+            if summary is not None:
+                summaries.setdefault((app, day), {})[hour] = summary
+            added += hour_added
+        for (app, day), hours in summaries.items():
+            self.update_manifest(app, day, hours, replace)
+        return added
+
+    def update_hour(self, app, day, hour, entries, replace=False):
+        # Read, merge and conditionally write back; a concurrent update fails the write and
+        # the merge is repeated on the new version. Returns the number of entries added and
+        # the summary of the hour, None when nothing changed.
+        key = self.hour_key(app, day, hour)
+        for _ in range(self.max_attempts):
+            body, etag = self.store.get_with_etag(key)
+            current = [] if body is None or replace else json.loads(body)['entries']
+            known = {entry['recordId'] for entry in current}
+            new = {}
+            for entry in entries:
+                if entry['recordId'] not in known:
+                    new[entry['recordId']] = entry
+            if not new and not replace:
+                return 0, None
+            merged = sorted(current + list(new.values()), key=sort_key, reverse=True)
+            data = json.dumps({'app': app, 'day': day, 'hour': hour, 'entries': merged},
+                              separators=(',', ':'), ensure_ascii=False)
+            if self.store.put_if_match(key, data, etag, ContentType='application/json'):
+                return len(new), hour_summary(merged)
+        raise RuntimeError(f"index {key} changed {self.max_attempts} times during the update")
+
+    def update_manifest(self, app, day, hours, replace=False):
+        key = self.manifest_key(app, day)
+        for _ in range(self.max_attempts):
+            body, etag = self.store.get_with_etag(key)
+            manifest = {'app': app, 'day': day, 'hours': {}} if body is None or replace else json.loads(body)
+            changed = replace
+            for hour, summary in hours.items():
+                # a concurrent update may have written the hour with more entries already
+                if summary['records'] > manifest['hours'].get(hour, {}).get('records', 0):
+                    manifest['hours'][hour] = summary
+                    changed = True
+            if not changed:
+                return False
+            manifest['updatedAt'] = datetime.now(timezone.utc).isoformat()
+            if self.store.put_if_match(key, json.dumps(manifest, separators=(',', ':')), etag,
+                                       ContentType='application/json'):
+                return True
+        raise RuntimeError(f"index manifest {key} changed {self.max_attempts} times during the update")
+
+    def cached_object(self, key, day):
+        closed = day < (datetime.now(timezone.utc) - self.sink.max_lateness).strftime('%Y-%m-%d')
+        cache = self.closed_cache if closed else self.cache
+        value = cache.get(key)
+        if value is None:
+            body, _ = self.store.get_with_etag(key)
+            # missing objects are cached as well, most days of a range have no feedback of an app
+            value = json.loads(body) if body is not None else {}
+            cache.set(key, value)
+        return value
+
+    def manifests(self, app, days):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=MANIFEST_FETCH)
+        return self._executor.map(lambda day: self.cached_object(self.manifest_key(app, day), day), days)
+
+    def page(self, app, start, end, feedback=None, limit=50, cursor=None, max_range=None):
+        # Returns the entries of an app in [start, end), newest first, with one of the
+        # feedback values (case insensitive, all when not given), and the cursor of the
+        # next page or None. A cursor continues the range and filters of its first page,
+        # a range longer than max_range (a timedelta) is rejected like an invalid cursor.
+        values = sorted({str(value).lower() for value in feedback}) if feedback else None
+        query = hashlib.sha256(json.dumps([str(app), values]).encode('utf-8')).hexdigest()[:16]
+        position = None
+        if cursor:
+            position = decode_cursor(cursor)
+            if position is None or position['q'] != query:
+                raise ValueError("Error: cursor is not valid for this query")
+            start, end = position['s'], position['e']
+            if start >= end or (max_range is not None and end - start > max_range):
+                raise ValueError("Error: cursor is not valid for this query")
+        after = (position['t'], position['r']) if position else None
+        first, last = format_timestamp(start), format_timestamp(end)
+
+        days = []
+        day = (end - timedelta(microseconds=1)).date()
+        if after:
+            day = min(day, datetime.fromisoformat(after[0]).date())
+        while day >= start.date():
+            days.append(f'{day:%Y-%m-%d}')
+            day -= timedelta(days=1)
+
+        items = []
+        for chunk in range(0, len(days), MANIFEST_FETCH):
+            chunk_days = days[chunk:chunk + MANIFEST_FETCH]
+            for day, manifest in zip(chunk_days, self.manifests(app, chunk_days)):
+                for hour in sorted(manifest.get('hours', {}), reverse=True):
+                    summary = manifest['hours'][hour]
+                    hour_start = f'{day}T{hour}'
+                    # hours outside the range or after the cursor
+                    if hour_start > last[:13] or hour_start < first[:13]:
+                        continue
+                    if after and hour_start > after[0][:13]:
+                        continue
+                    if values and not any(str(name).lower() in values for name in summary['feedback']):
+                        continue
+                    for entry in self.cached_object(self.hour_key(app, day, hour), day).get('entries', []):
+                        if not first <= entry['time'] < last:
+                            continue
+                        if after and sort_key(entry) >= after:
+                            continue
+                        if values and str(entry.get('feedback')).lower() not in values:
+                            continue
+                        items.append(entry)
+                        if len(items) > limit:
+                            last_entry = items[limit - 1]
+                            return items[:limit], encode_cursor({
+                                't': last_entry['time'], 'r': last_entry['recordId'], 'q': query,
+                                's': start.isoformat(), 'e': end.isoformat(),
+                            })
+        return items, None
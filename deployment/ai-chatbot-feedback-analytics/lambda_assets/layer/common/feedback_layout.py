@@ -0,0 +1,109 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from common.compression import decompress
+
+# Helpers for the S3 layout of the feedback tables:
+# {glue_database_name}/{table}/{partition}=.../{object}, partitions in PARTITION_SCHEME order
+#
+# The compaction job merges the objects of a partition into a generation below the hidden
+# directory {partition}/_compacted/<run id>/ and records the run in {partition}/_manifest.json
+# (see feedback_compactor). Athena reads the generation the catalog points the partition
+# at, readers of the bucket the one the manifest publishes, see partition_objects.
+# Projected partitions can't be pointed elsewhere: their generation is published in place,
+# by copying its parts into the partition as {partition}/compacted-<run id>-part-NNNNN.<ext>.
+
+MANIFEST_NAME = '_manifest.json'
+GENERATIONS_DIR = '_compacted'
+IN_PLACE_PREFIX = 'compacted-'
+
+
+def day_partitions(store, glue_database_name, day, partition_scheme, table='feedback'):
+    # Returns the prefixes of the leaf partitions holding the records of a day, e.g. one per
+    # app and hour for an app,year,month,day,hour scheme
+    dates = {'year': str(day.year), 'month': day.strftime("%m"), 'day': day.strftime("%d")}
+    prefixes = [f'{glue_database_name}/{table}/']
+    for name in partition_scheme:
+        if name in dates:
+            prefixes = [f'{prefix}{name}={dates[name]}/' for prefix in prefixes]
+        else:
+            prefixes = [
+                child for prefix in prefixes for child in store.list_prefixes(prefix)
+                if child[len(prefix):].startswith(f'{name}=')
+            ]
+    return prefixes
+
+
+def partition_values(key):
+    # partition column -> value of a partition prefix or object key
+    return dict(part.split('=', 1) for part in key.rstrip('/').split('/') if '=' in part)
+
+
+def partition_range(key):
+    # The [start, end) time range of the day or hour partition of a prefix or object key,
+    # None when the key is not in one
+    values = partition_values(key)
+    try:
+        start = datetime(int(values['year']), int(values['month']), int(values['day']),
+                         int(values.get('hour', 0)), tzinfo=timezone.utc)
+    except (KeyError, ValueError):
+        return None
+    return start, start + (timedelta(hours=1) if 'hour' in values else timedelta(days=1))
+
+
+def is_hidden(prefix, key):
+    # Athena and Glue skip every path component starting with "_" or "."
+    return any(part.startswith(('_', '.')) for part in key[len(prefix):].split('/'))
+
+
+def is_in_place_part(key):
+    # A part of a generation published in place; it only repeats records of the partition
+    return key.rsplit('/', 1)[-1].startswith(IN_PLACE_PREFIX)
+
+
+def in_place_key(prefix, key):
+    # The key a part of a generation is copied to when the generation is published in place
+    run_id, name = key[len(f'{prefix}{GENERATIONS_DIR}/'):].split('/', 1)
+    return f'{prefix}{IN_PLACE_PREFIX}{run_id}-{name}'
+
+
+def load_manifest(store, prefix):
+    # The compaction manifest of a partition, None when it was never compacted
+    key = prefix + MANIFEST_NAME
+    if not store.exists(key):
+        return None
+    return json.loads(store.get(key))
+
+
+def save_manifest(store, prefix, manifest):
+    store.put(prefix + MANIFEST_NAME, json.dumps(manifest, indent=2), ContentType='application/json')
+
+
+def partition_objects(store, prefix):
+    # The data objects of a partition. Until a compaction run is published its partition is
+    # read from the previous generation and the objects written to the partition; once it
+    # is, from the new generation and the objects written after the run listed them.
+    # Manifests of the earlier in place compaction list no generation, their outputs are
+    # objects of the partition. Parts published in place are read through the manifest.
+    objects = [key for key, _ in store.list_objects(prefix)
+               if not is_hidden(prefix, key) and not is_in_place_part(key)]
+    manifest = load_manifest(store, prefix)
+    if manifest is None:
+        return objects
+    if manifest['state'] == 'staged':
+        return manifest.get('previous', []) + objects
+    sources = set(manifest['sources'])
+    return manifest.get('parts', []) + [key for key in objects if key not in sources]
+
+
+def read_records(key, body):
+    # Returns the records of a feedback object: a single JSON record, NDJSON (both optionally
+    # compressed) or Parquet
+    if key.endswith('.parquet'):
+        from common.parquet_writer import read_parquet_records
+        return read_parquet_records(body)
+    text = decompress(key, body).decode('utf-8') if isinstance(body, bytes) else body
+    try:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError:
+        return [json.loads(text)]
@@ -0,0 +1,246 @@
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta, timezone
+from urllib.parse import quote
+
+from common.compression import decompress
+from common.feedback_layout import day_partitions, partition_objects, partition_values
+from common.feedback_sink import DEFAULT_PARTITION_SCHEME, FeedbackSink, parse_timestamp
+
+# In-process queries over the S3 layout of the feedback tables, for ad hoc looks at a few
+# days of data and for checking reports on sample data without Athena. Reads the JSON
+# objects of the feedback table and the Parquet objects of the feedback_parquet table from
+# a LocalObjectStore or S3ObjectStore, compressed JSON objects included.
+#
+#   python -m common.feedback_query --root ./data --database chatbot_user_feedback \
+#       --start 2024-05-01 --end 2024-05-07 feedback_by_day
+#
+# The time range selects records by the time of their partition (see
+# FeedbackSink.partition_time), like a filter on the partition columns in Athena. Partitions
+# outside the range or of other apps are not listed, Parquet row groups are skipped by their
+# statistics and JSON lines that cannot match the app or feedback filter are not decoded.
+
+SOURCE_TABLES = ('feedback', 'feedback_parquet')
+
+# record attribute of each dimension a report can group by
+DIMENSIONS = {
+    'app': 'appIdentifier',
+    'feedback': 'feedback',
+    'user': 'userId',
+    'day': None,
+    'hour': None,
+}
+
+# name -> dimensions counted by the report
+REPORTS = {
+    'feedback_by_app': ('app', 'feedback'),
+    'feedback_by_day': ('day', 'app', 'feedback'),
+    'feedback_by_hour': ('day', 'hour', 'app', 'feedback'),
+    'feedback_by_user': ('app', 'user', 'feedback'),
+}
+
+# attributes read for counting, comments are read by the comments report only
+COUNT_COLUMNS = ['recordId', 'appIdentifier', 'feedback', 'userId', 'submittedAt', 'ingestedAt']
+COMMENT_COLUMNS = COUNT_COLUMNS + ['interactionId', 'comment']
+
+
+def as_text(value):
+    # filters compare the text of a value, numbers and booleans as written in JSON (and Parquet)
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class FeedbackQuery:
+
+    def __init__(self, store, glue_database_name, partition_scheme=DEFAULT_PARTITION_SCHEME,
+                 max_lateness_days=7, read_concurrency=16):
+        self.store = store
+        self.glue_database_name = glue_database_name
+        self.partition_scheme = list(partition_scheme)
+        # only used for its partition layout, nothing is written
+        self.sink = FeedbackSink(None, glue_database_name, partition_scheme=partition_scheme,
+                                 max_lateness_days=max_lateness_days)
+        self.read_concurrency = read_concurrency
+
+    def partitions(self, start, end, apps=None):
+        # Yields the leaf partition prefixes of both tables that can hold records of
+        # [start, end), restricted to apps when the layout is partitioned by app
+        app_values = {quote(as_text(app), safe='') for app in apps} if apps else None
+        day = start.date()
+        while datetime.combine(day, time(), tzinfo=timezone.utc) < end:
+            for table in SOURCE_TABLES:
+                for prefix in day_partitions(self.store, self.glue_database_name, day, self.partition_scheme, table):
+                    values = partition_values(prefix)
+                    if app_values is not None and 'app' in values and values['app'] not in app_values:
+                        continue
+                    if 'hour' in values:
+                        hour_start = datetime.combine(day, time(int(values['hour'])), tzinfo=timezone.utc)
+                        if hour_start + timedelta(hours=1) <= start or hour_start >= end:
+                            continue
+                    yield prefix
+            day += timedelta(days=1)
+
+    def objects(self, prefix):
+        # The data objects of a partition, the generation a compaction run published
+        # included (see feedback_layout.partition_objects)
+        return partition_objects(self.store, prefix)
+
+    def read(self, key, columns, apps, feedback):
+        # Returns the records of an object that can match the filters
+        body = self.store.get(key)
+        if key.endswith('.parquet'):
+            from common.parquet_writer import read_parquet_records
+            filters = []
+            if apps:
+                filters.append(('appIdentifier', 'in', [as_text(app) for app in apps]))
+            if feedback:
+                filters.append(('feedback', 'in', [as_text(value) for value in feedback]))
+            return read_parquet_records(body, columns=columns, filters=filters or None)
+
+        text = decompress(key, body).decode('utf-8')
+        lines = [line for line in text.splitlines() if line.strip()]
+        # a line without any of the filter values cannot match, it is skipped undecoded. Only
+        # ASCII values are looked for, writers differ in how they escape other characters.
+        needles = [
+            [as_text(value) for value in values] for values in (apps, feedback)
+            if values and all(as_text(value).isascii() and not set('"\\') & set(as_text(value)) for value in values)
+        ]
+        try:
+            return [
+                json.loads(line) for line in lines
+                if all(any(needle in line for needle in group) for group in needles)
+            ]
+        except json.JSONDecodeError:
+            return [json.loads(text)]
+
+    def scan(self, start, end, apps=None, feedback=None, columns=None, distinct=True):
+        # Yields (record, partition time) for the records of [start, end) matching the filters.
+        # Records stored more than once (repeated deliveries, a compaction in progress) are
+        # returned once.
+        keys = [key for prefix in self.partitions(start, end, apps) for key in self.objects(prefix)]
+        app_values = {as_text(app) for app in apps} if apps else None
+        feedback_values = {as_text(value) for value in feedback} if feedback else None
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.read_concurrency) as executor:
+            for key, records in zip(keys, executor.map(lambda key: self.read(key, columns, apps, feedback), keys)):
+                for record in records:
+                    if app_values is not None and as_text(record.get('appIdentifier')) not in app_values:
+                        continue
+                    if feedback_values is not None and as_text(record.get('feedback')) not in feedback_values:
+                        continue
+                    record_time = self.sink.partition_time(record, key)
+                    if not start <= record_time < end:
+                        continue
+                    if distinct and record.get('recordId'):
+                        if record['recordId'] in seen:
+                            continue
+                        seen.add(record['recordId'])
+                    yield record, record_time
+
+    def dimension(self, record, record_time, name):
+        if name == 'day':
+            return record_time.strftime('%Y-%m-%d')
+        if name == 'hour':
+            return record_time.strftime('%H')
+        # JSON keeps the type of a value, Parquet stores its text; both count as the same value
+        value = record.get(DIMENSIONS[name])
+        return value if value is None else as_text(value)
+
+    def count(self, start, end, dimensions, **filters):
+        # Returns one row per distinct combination of the dimensions with its record count
+        counts = {}
+        for record, record_time in self.scan(start, end, columns=COUNT_COLUMNS, **filters):
+            group = tuple(self.dimension(record, record_time, name) for name in dimensions)
+            counts[group] = counts.get(group, 0) + 1
+        return [
+            dict(zip(dimensions, group), records=count)
+            for group, count in sorted(counts.items(), key=lambda item: tuple(map(str, item[0])))
+        ]
+
+    def comments(self, start, end, limit=100, **filters):
+        # Returns the most recent records with a comment
+        records = [
+            (parse_timestamp(record.get('submittedAt')) or record_time, record)
+            for record, record_time in self.scan(start, end, columns=COMMENT_COLUMNS, **filters)
+            if record.get('comment')
+        ]
+        records.sort(key=lambda item: item[0], reverse=True)
+        return [{name: record.get(name) for name in COMMENT_COLUMNS} for _, record in records[:limit]]
+
+    def report(self, name, start, end, **filters):
+        if name == 'comments':
+            return self.comments(start, end, **filters)
+        return self.count(start, end, REPORTS[name], **filters)
+
+
+def parse_time(value, end=False):
+    # YYYY-MM-DD or an ISO 8601 timestamp; a day used as the end of a range includes the day
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def write_rows(rows, output_format, out=sys.stdout):
+    if output_format == 'json':
+        for row in rows:
+            out.write(json.dumps(row) + '\n')
+        return
+    if not rows:
+        return
+    if output_format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    columns = list(rows[0])
+    cells = [[str(row.get(column, '')) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(row[index]) for row in cells)) for index, column in enumerate(columns)]
+    out.write('  '.join(column.ljust(width) for column, width in zip(columns, widths)).rstrip() + '\n')
+    for row in cells:
+        out.write('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run feedback reports over the bucket layout without Athena.')
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--root', help='local directory that mirrors the data bucket')
+    location.add_argument('--bucket', help='data bucket name')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. a local stand-in')
+    parser.add_argument('--database', required=True, help='glue database name, the top level prefix')
+    parser.add_argument('--partition-scheme', default=','.join(DEFAULT_PARTITION_SCHEME),
+                        help='partition columns of the feedback layout')
+    parser.add_argument('--start', required=True, help='first day (YYYY-MM-DD) or time (ISO 8601)')
+    parser.add_argument('--end', help='last day (YYYY-MM-DD) or end time (ISO 8601, exclusive), defaults to start')
+    parser.add_argument('--app', action='append', help='only this app identifier, repeatable')
+    parser.add_argument('--feedback', action='append', help='only this feedback value, repeatable')
+    parser.add_argument('--group-by', help='comma separated dimensions to count by instead of a report: '
+                                           + ', '.join(DIMENSIONS))
+    parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table')
+    parser.add_argument('report', nargs='?', choices=sorted(REPORTS) + ['comments'], default='feedback_by_app')
+    args = parser.parse_args(argv)
+
+    from common.object_store import LocalObjectStore, S3ObjectStore
+    store = LocalObjectStore(args.root) if args.root else S3ObjectStore(args.bucket, endpoint_url=args.endpoint_url)
+    query = FeedbackQuery(store, args.database, args.partition_scheme.split(','))
+    start = parse_time(args.start)
+    end = parse_time(args.end or args.start, end=True)
+    filters = {'apps': args.app, 'feedback': args.feedback}
+
+    if args.group_by:
+        dimensions = args.group_by.split(',')
+        unknown = [name for name in dimensions if name not in DIMENSIONS]
+        if unknown:
+            parser.error(f"unknown dimensions {', '.join(unknown)}")
+        rows = query.count(start, end, dimensions, **filters)
+    else:
+        rows = query.report(args.report, start, end, **filters)
+    write_rows(rows, args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import os
+
+# Declarative description of a feedback request body. validate checks a body against it in
+# a single pass without per field exception handling, and reports every problem of a body
+# at once.
+
+# size caps of the free text fields, in characters
+max_prompt_chars = int(os.environ.get('MAX_PROMPT_CHARS', '32768'))
+max_response_chars = int(os.environ.get('MAX_RESPONSE_CHARS', '32768'))
+max_comment_chars = int(os.environ.get('MAX_COMMENT_CHARS', '4096'))
+max_identifier_chars = 256
+max_source_urls = 100
+max_url_chars = 2048
+
+MISSING = object()
+
+
+TYPE_NAMES = {str: 'a string', int: 'a number', float: 'a number', bool: 'a boolean', list: 'a list', dict: 'an object'}
+ITEM_TYPE_NAMES = {str: 'strings', int: 'numbers', float: 'numbers', bool: 'booleans', list: 'lists', dict: 'objects'}
+
+
+def describe_types(types, names=TYPE_NAMES):
+    described = []
+    for type_ in types:
+        if names[type_] not in described:
+            described.append(names[type_])
+    return ' or '.join(described)
+
+
+class Field:
+    # name: attribute of the request body, target: name in the record (defaults to name)
+    # required: missing or null values are an error, otherwise default is used
+    # default: value or callable returning the value for missing or null attributes
+    # types: accepted Python types, max_length: cap for strings (characters) and lists (items)
+    # item_types, item_max_length: accepted types and cap of list items
+
+    def __init__(self, name, types, target=None, required=False, default=None,
+                 max_length=None, item_types=None, item_max_length=None):
+        self.name = name
+        self.target = target or name
+        self.types = types
+        self.required = required
+        self.default = default
+        self.max_length = max_length
+        self.item_types = item_types
+        self.item_max_length = item_max_length
+        # bool is a subclass of int, it is only accepted where listed
+        self.rejects_bool = bool not in types and (int in types or float in types)
+        # the types max_length applies to
+        self.sized_types = tuple(type_ for type_ in types if type_ in (str, list)) if max_length is not None else ()
+        # error messages, built once
+        self.required_error = f"Error: parameter {name} is a required parameter"
+        self.type_error = f"Error: parameter {name} must be {describe_types(types)}"
+        unit = 'items' if list in types else 'characters'
+        self.size_error = f"Error: parameter {name} exceeds {max_length} {unit}"
+        if item_types is not None:
+            item_description = describe_types(item_types, ITEM_TYPE_NAMES)
+            if item_max_length is not None:
+                item_description += f' of up to {item_max_length} characters'
+            self.item_error = f"Error: parameter {name} must only contain {item_description}"
+
+    def default_value(self):
+        return self.default() if callable(self.default) else self.default
+
+
+# in the order the attributes were checked before, so the first error reported stays the same
+FEEDBACK_SCHEMA = (
+    Field('prompt', (str,), default="N.A.", max_length=max_prompt_chars),
+    Field('response', (str,), default="N.A.", max_length=max_response_chars),
+    Field('feedback', (str, int, float, bool), required=True, max_length=max_identifier_chars),
+    Field('userId', (str, int), required=True, max_length=max_identifier_chars),
+    Field('appIdentifier', (str, int), required=True, max_length=max_identifier_chars),
+    # a missing interactionId is derived from the record identity (see feedback_sink.record_identity)
+    Field('interactionId', (str, int), default=None, max_length=max_identifier_chars),
+    Field('comment', (str,), default="", max_length=max_comment_chars),
+    Field('sourceAttribution', (str, list, dict), default=""),
+    Field('sourceUrls', (list,), target='source_attribution_urls', default=list, max_length=max_source_urls,
+          item_types=(str,), item_max_length=max_url_chars),
+    Field('submittedAt', (str, int, float), default=None, max_length=max_identifier_chars),
+)
+
+
+def validate(body, schema):
+    # Checks every field of the schema in order. Returns (values, errors), where values maps
+    # the target names to the validated or default values and errors lists (param, message)
+    # tuples.
+    errors = []
+    values = {}
+    get = body.get
+    for field in schema:
+        value = get(field.name, MISSING)
+        if value is MISSING or value is None:
+            if field.required:
+                errors.append((field.name, field.required_error))
+            else:
+                values[field.target] = field.default_value()
+        elif not isinstance(value, field.types) or (field.rejects_bool and value.__class__ is bool):
+            errors.append((field.name, field.type_error))
+        elif field.sized_types and isinstance(value, field.sized_types) and len(value) > field.max_length:
+            errors.append((field.name, field.size_error))
+        elif field.item_types is not None and any(
+            not isinstance(item, field.item_types)
+            or (field.item_max_length is not None and len(item) > field.item_max_length)
+            for item in value
+        ):
+            errors.append((field.name, field.item_error))
+        else:
+            values[field.target] = value
+    return values, errors
+
+
+def validate_feedback(body):
+    return validate(body, FEEDBACK_SCHEMA)
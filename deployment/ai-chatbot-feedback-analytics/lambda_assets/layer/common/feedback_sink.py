@@ -0,0 +1,305 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from common import json_codec, metrics
+from common.compression import compress, extension as compression_extension
+from common.feedback_layout import partition_range
+from common.feedback_schema import validate_feedback
+from common.object_store import put_if_absent
+from common.ttl_cache import TTLCache
+
+# Shared by every path that stores feedback (API processor, queue consumer, Q Business
+# processor and batch tools), so all of them validate, normalize and lay out the
+# records the same way and produce byte-identical objects for the same input.
+
+logger = logging.getLogger(__name__)
+
+# client clocks ahead of the server by more than this are not trusted
+max_clock_skew = timedelta(minutes=5)
+
+LEGACY_TIMESTAMP_FORMAT = "%b %d, %Y, %I:%M:%S %p"
+
+DEFAULT_PARTITION_SCHEME = ('year', 'month', 'day')
+
+
+class FeedbackValidationError(Exception):
+    # param is the first invalid attribute, errors lists (param, message) for all of them
+    def __init__(self, param, message=None, errors=None):
+        message = message or f"Error: parameter {param} is a required parameter"
+        self.errors = errors or [(param, message)]
+        super().__init__("; ".join(error_message for _, error_message in self.errors))
+        self.param = param
+
+
+def parse_timestamp(value):
+    # Parses ISO 8601 strings, epoch seconds or milliseconds and the legacy
+    # "%b %d, %Y, %I:%M:%S %p" format. Values without a timezone are taken as UTC.
+    # Returns None when the value is not a timestamp.
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, (int, float)) or (isinstance(value, str) and value.strip().isdigit()):
+            seconds = float(value)
+            if seconds > 1e11:
+                seconds /= 1000
+            return datetime.fromtimestamp(seconds, timezone.utc)
+        if not isinstance(value, str):
+            return None
+        text = value.strip()
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            parsed = datetime.strptime(text, LEGACY_TIMESTAMP_FORMAT)
+    except (ValueError, OverflowError, OSError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def format_timestamp(value):
+    # canonical UTC form, fixed width so it sorts and compares as a string
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+
+
+def record_identity(values, submitted_at):
+    # Deterministic id of a feedback submission: the same feedback delivered again, by a
+    # client, EventBridge or queue retry, gets the same id and is stored only once.
+    # The message is the interactionId, or the exchange itself when there is none.
+    identity = [values['appIdentifier'], values['userId'], values['interactionId'],
+                values['feedback'], values['comment'], submitted_at]
+    if values['interactionId'] is None:
+        identity += [values['prompt'], values['response']]
+    data = json.dumps(identity, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def build_feedback_record(body, ingested_at=None):
+    # Maps a single request body onto the feedback data model.
+    # Raises FeedbackValidationError listing every missing, mistyped or oversized attribute
+    # (see common.feedback_schema).
+    # submittedAt holds the event time in canonical UTC form and submittedAtRaw the value
+    # sent by the client. Missing, unparseable or future timestamps fall back to the ingest time.
+    if not isinstance(body, dict):
+        raise FeedbackValidationError("body", "Error: feedback record must be a JSON object")
+
+    values, errors = validate_feedback(body)
+    if errors:
+        raise FeedbackValidationError(errors[0][0], errors[0][1], errors)
+
+    ingested_at = ingested_at or datetime.now(timezone.utc)
+    submittedAtRaw = values['submittedAt']
+    submitted_at = parse_timestamp(submittedAtRaw)
+    # the identity uses the time sent by the client, never the ingest time
+    recordId = record_identity(values, format_timestamp(submitted_at) if submitted_at else submittedAtRaw)
+    if submitted_at is None or submitted_at > ingested_at + max_clock_skew:
+        if submittedAtRaw is not None:
+            logger.warning("submittedAt %s is not a valid timestamp, using the ingest time", submittedAtRaw)
+        submitted_at = ingested_at
+
+    return {
+        'recordId': recordId,
+        'interactionId': values['interactionId'] if values['interactionId'] is not None else recordId,
+        'prompt': values['prompt'],
+        'response': values['response'],
+        'source_attribution_urls': values['source_attribution_urls'],
+        'sourceAttribution': values['sourceAttribution'],
+        'appIdentifier': values['appIdentifier'],
+        'feedback': values['feedback'],
+        'comment': values['comment'],
+        'userId': values['userId'],
+        'submittedAt': format_timestamp(submitted_at),
+        'submittedAtRaw': submittedAtRaw,
+        'ingestedAt': format_timestamp(ingested_at)
+    }
+
+
+class FeedbackSink:
+    # Writes feedback records to the data bucket using the partition layout of the feedback tables
+
+    def __init__(self, bucket, glue_database_name, output_format='json',
+                 partition_scheme=DEFAULT_PARTITION_SCHEME, max_lateness_days=7,
+                 parquet_compression='snappy', content_dedup=False, recent_ids_size=10000,
+                 recent_ids_ttl=900, compression='none', key_shards=0, s3_client=None):
+        self._s3 = s3_client
+        self.bucket = bucket
+        self.glue_database_name = glue_database_name
+        # "parquet" writes batches as Parquet objects into the feedback_parquet table,
+        # single records are always stored as JSON in the feedback table
+        self.output_format = output_format
+        # partition columns of the S3 layout, any of app, year, month, day and hour, in key order
+        self.partition_scheme = list(partition_scheme)
+        # records submitted earlier than this are stored in the partition of their ingest time,
+        # so partitions that have already been compacted are not reopened
+        self.max_lateness = timedelta(days=max_lateness_days)
+        self.parquet_compression = parquet_compression
+        # "gzip" or "zstd" compresses the JSON objects, named <name>.json.gz or .json.zst
+        self.compression = compression
+        self.json_extension = '.json' + compression_extension(compression)
+        # objects are spread over this many hash named sub-prefixes of their partition, e.g.
+        # .../day=14/3f/<recordId>.json, so bursts of writes to one partition are not limited
+        # to the PUT rate of a single prefix. Readers list partitions recursively and the
+        # sub-prefixes are not partition columns, so tables and queries are unchanged.
+        self.key_shards = key_shards
+        self.shard_digits = len(f'{key_shards - 1:x}') if key_shards > 1 else 0
+        # large prompts, responses and source attributions are stored once in the content store
+        # and the records keep a digest and a preview (see common.content_store)
+        self.content_dedup = content_dedup
+        self._content_store = None
+        # ids of the records written by this container, repeated deliveries are skipped
+        # without any request
+        self.recent_ids = TTLCache(maxsize=recent_ids_size, ttl=recent_ids_ttl)
+
+    @property
+    def s3(self):
+        # created on the first write, so importing a handler doesn't load botocore
+        if self._s3 is None:
+            from common.aws_clients import aws_client, retry_config
+            self._s3 = aws_client('s3', config=retry_config())
+        return self._s3
+
+    @classmethod
+    def from_environment(cls, s3_client=None):
+        return cls(
+            bucket=os.environ['S3_DATA_BUCKET'],
+            glue_database_name=os.environ['GLUE_DATABASE_NAME'],
+            output_format=os.environ.get('OUTPUT_FORMAT', 'json'),
+            partition_scheme=os.environ.get('PARTITION_SCHEME', ','.join(DEFAULT_PARTITION_SCHEME)).split(','),
+            max_lateness_days=int(os.environ.get('MAX_LATENESS_DAYS', '7')),
+            parquet_compression=os.environ.get('PARQUET_COMPRESSION', 'snappy'),
+            content_dedup=os.environ.get('CONTENT_DEDUP', 'false').lower() == 'true',
+            recent_ids_size=int(os.environ.get('RECENT_ID_CACHE_SIZE', '10000')),
+            recent_ids_ttl=int(os.environ.get('RECENT_ID_CACHE_TTL_SECONDS', '900')),
+            compression=os.environ.get('OUTPUT_COMPRESSION', 'none'),
+            key_shards=int(os.environ.get('KEY_SHARDS', '0')),
+            s3_client=s3_client,
+        )
+
+    @property
+    def content_store(self):
+        if self._content_store is None:
+            from common.content_store import ContentStore
+            self._content_store = ContentStore.from_environment(self.s3, self.bucket, self.glue_database_name,
+                                                                compression=self.compression)
+        return self._content_store
+
+    def prepare(self, record):
+        if not self.content_dedup:
+            return record
+        with metrics.stage('content_store'):
+            return self.content_store.externalize(record)
+
+    def partition_time(self, record, key=None):
+        # Records are partitioned by event time, except for late arrivals older than max_lateness.
+        # Records stored before the timestamps were normalized have a submittedAt in the display
+        # format or none at all and no ingestedAt. Read back from the object key, such a record
+        # is placed in the partition of its object, at its submittedAt when that falls inside.
+        submitted_at = parse_timestamp(record.get('submittedAt'))
+        ingested_at = parse_timestamp(record.get('ingestedAt'))
+        if submitted_at is not None and ingested_at is not None:
+            if submitted_at < ingested_at - self.max_lateness:
+                return ingested_at
+            return submitted_at
+        partition = partition_range(key) if key else None
+        if partition is not None:
+            start, end = partition
+            return submitted_at if submitted_at is not None and start <= submitted_at < end else start
+        if submitted_at is None and ingested_at is None:
+            raise ValueError(f"record {record.get('recordId')} has no valid submittedAt or ingestedAt")
+        return submitted_at or ingested_at
+
+    def partition_values(self, record):
+        # partition column -> value of the record, in PARTITION_SCHEME order
+        current_date = self.partition_time(record)
+        values = {
+            'app': quote(str(record['appIdentifier']), safe=''),
+            'year': str(current_date.year),
+            'month': current_date.strftime("%m"),
+            'day': current_date.strftime("%d"),
+            'hour': current_date.strftime("%H"),
+        }
+        return {name: values[name] for name in self.partition_scheme}
+
+    def partition_prefix(self, record, table='feedback'):
+        partitions = '/'.join(f'{name}={value}' for name, value in self.partition_values(record).items())
+        return f'{self.glue_database_name}/{table}/{partitions}'
+
+    def object_prefix(self, partition_prefix, name):
+        # The prefix of an object in its partition, a sub-prefix derived from the object name
+        # when the writes are sharded
+        if not self.shard_digits:
+            return partition_prefix
+        shard = int(hashlib.sha256(name.encode('utf-8')).hexdigest()[:8], 16) % self.key_shards
+        return f'{partition_prefix}/{shard:0{self.shard_digits}x}'
+
+    def record_key(self, record):
+        prefix = self.object_prefix(self.partition_prefix(record), record['recordId'])
+        return f'{prefix}/{record["recordId"]}{self.json_extension}'
+
+    def write_record(self, record):
+        # Stores a single record as its own JSON object and returns the serialized record.
+        # The key is the record id and the write conditional, so a repeated delivery is a no-op.
+        if self.recent_ids.get(record['recordId']):
+            logger.info("record %s was already written", record['recordId'])
+            return json_codec.dumps(record)
+        record = self.prepare(record)
+        with metrics.stage('serialize'):
+            data = json_codec.dumps(record)
+            body = compress(data, self.compression) if self.compression != 'none' else data
+        with metrics.stage('s3_put'):
+            written = put_if_absent(self.s3, self.bucket, self.record_key(record), body)
+        if not written:
+            logger.info("record %s already exists", record['recordId'])
+        self.recent_ids.set(record['recordId'], True)
+        return data
+
+    def write_batch(self, records, overwrite=False):
+        # The records of one request or queue batch are written as a single newline delimited
+        # JSON or Parquet object per partition.
+        # Records written recently or repeated within the batch are skipped. The object key is
+        # derived from the record ids, so a retried batch maps to the existing object. A record
+        # stored again in another object (a retry batched differently or after midnight) is
+        # counted once by the readers, which dedupe on recordId, and dropped by compaction.
+        # overwrite replaces an existing object of the same records, e.g. when they are
+        # rebuilt after a bug in their mapping was fixed.
+        table = 'feedback_parquet' if self.output_format == 'parquet' else 'feedback'
+        partitions = {}
+        seen = set()
+        for record in records:
+            if record['recordId'] in seen or self.recent_ids.get(record['recordId']):
+                continue
+            seen.add(record['recordId'])
+            partitions.setdefault(self.partition_prefix(record, table), []).append(self.prepare(record))
+
+        metrics.count('records', len(seen))
+        keys = []
+        for prefix, partition_records in partitions.items():
+            batch_id = hashlib.sha256(
+                ','.join(sorted(record['recordId'] for record in partition_records)).encode('utf-8')
+            ).hexdigest()[:32]
+            with metrics.stage('serialize'):
+                if self.output_format == 'parquet':
+                    from common.parquet_writer import to_parquet_bytes
+                    data = to_parquet_bytes(partition_records, compression=self.parquet_compression)
+                    key = f'{self.object_prefix(prefix, batch_id)}/batch-{batch_id}.parquet'
+                else:
+                    data = "\n".join(json_codec.dumps(record) for record in partition_records)
+                    if self.compression != 'none':
+                        data = compress(data, self.compression)
+                    key = f'{self.object_prefix(prefix, batch_id)}/batch-{batch_id}{self.json_extension}'
+            with metrics.stage('s3_put'):
+                if overwrite:
+                    self.s3.put_object(Bucket=self.bucket, Key=key, Body=data)
+                    written = True
+                else:
+                    written = put_if_absent(self.s3, self.bucket, key, data)
+            if not written:
+                logger.info("batch %s already exists", key)
+            for record in partition_records:
+                self.recent_ids.set(record['recordId'], True)
+            keys.append(key)
+        return keys
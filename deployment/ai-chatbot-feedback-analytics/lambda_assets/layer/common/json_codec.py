@@ -0,0 +1,45 @@
+import json
+import os
+
+# JSON encoding and decoding for the feedback hot paths. orjson is used when it is
+# installed (add it to the layer requirements) unless JSON_CODEC=json. orjson writes
+# compact JSON without spaces after separators; readers of the feedback objects,
+# Athena included, don't depend on the spacing.
+_orjson = None
+name = 'json'
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def use(codec):
+    # Selects the codec: "orjson", "json" or "auto" (orjson when it is installed)
+    global _orjson, name
+    _orjson = None
+    if codec != 'json':
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            if codec == 'orjson':
+                raise
+    name = 'orjson' if _orjson is not None else 'json'
+
+
+def loads(data):
+    if _orjson is not None:
+        try:
+            return _orjson.loads(data)
+        except _orjson.JSONDecodeError:
+            # fall back for the exact error (callers tell NDJSON streams apart by the
+            # "Extra data" message) and for input orjson rejects, e.g. NaN
+            pass
+    return json.loads(data)
+
+
+def dumps(value):
+    if _orjson is not None:
+        return _orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
+
+
+use(os.environ.get('JSON_CODEC', 'auto'))
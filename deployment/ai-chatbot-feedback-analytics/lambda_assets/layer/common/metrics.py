@@ -0,0 +1,121 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+# Per stage timing of the handlers, written as CloudWatch embedded metric format (EMF)
+# lines to stdout, which CloudWatch Logs turns into metrics without any API call.
+#
+#   with metrics.invocation('llm_app_feedback_processor'):
+#       with metrics.stage('parse'):
+#           ...
+#
+# Invocations are sampled with METRICS_SAMPLE_RATE (0 disables the metrics, 1 times every
+# invocation). Outside of a sampled invocation stage() returns a shared no-op context
+# manager, so instrumented code costs a function call and a global lookup. Stages running
+# more than once in an invocation, or in several threads, add up; a nested stage is also
+# part of the enclosing one.
+sample_rate = float(os.environ.get('METRICS_SAMPLE_RATE', '0'))
+namespace = os.environ.get('METRICS_NAMESPACE', 'ChatbotFeedback')
+
+# timer of the sampled invocation in progress
+_current = None
+
+
+class _NullContext:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_CONTEXT = _NullContext()
+
+
+class _Stage:
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class InvocationTimer:
+
+    def __init__(self, function_name, out=None):
+        self.function_name = function_name
+        self.out = out or sys.stdout
+        self.stages = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, milliseconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + milliseconds
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def __enter__(self):
+        global _current
+        _current = self
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _current
+        _current = None
+        self.add('total', (time.perf_counter() - self.started) * 1000)
+        self.out.write(self.emf_line() + '\n')
+        return False
+
+    def emf_line(self):
+        metric_definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in self.stages]
+        metric_definitions += [{'Name': name, 'Unit': 'Count'} for name in self.counts]
+        line = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': metric_definitions,
+                }],
+            },
+            'FunctionName': self.function_name,
+        }
+        line.update({name: round(value, 3) for name, value in self.stages.items()})
+        line.update(self.counts)
+        return json.dumps(line)
+
+
+def invocation(function_name):
+    # Times the invocation when it is sampled and emits its metrics when it ends
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        return NULL_CONTEXT
+    return InvocationTimer(function_name)
+
+
+def stage(name):
+    # Times the enclosed block as a stage of the sampled invocation in progress
+    timer = _current
+    if timer is None:
+        return NULL_CONTEXT
+    return _Stage(timer, name)
+
+
+def count(name, value=1):
+    timer = _current
+    if timer is not None:
+        timer.count(name, value)
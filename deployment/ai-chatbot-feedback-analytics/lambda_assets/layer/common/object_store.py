@@ -0,0 +1,222 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+# error codes of requests rejected because of the request rate
+THROTTLING_ERRORS = ('SlowDown', 'ServiceUnavailable', '503', 'Throttling', 'ThrottlingException',
+                     'RequestLimitExceeded', 'TooManyRequestsException')
+
+
+def is_throttled(error):
+    # True for a botocore ClientError that is still throttled after the client retries
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+
+def put_if_absent(client, bucket, key, body, **kwargs):
+    # Writes the object unless the key exists, returns False when it did. Used for objects
+    # whose key identifies their content, where a second write would only repeat the first.
+    from botocore.exceptions import ParamValidationError
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch='*', **kwargs)
+        return True
+    except client.exceptions.ClientError as e:
+        # ConditionalRequestConflict: a concurrent write of the same key is in progress
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            return False
+        raise
+    except ParamValidationError as e:
+        raise conditional_writes_unsupported(e) from e
+
+
+def put_if_match(client, bucket, key, body, etag, **kwargs):
+    # Writes the object if it is unchanged since it was read with the given ETag, or if it
+    # doesn't exist when etag is None. Returns False when another writer got there first.
+    from botocore.exceptions import ParamValidationError
+    condition = {'IfNoneMatch': '*'} if etag is None else {'IfMatch': etag}
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=body, **condition, **kwargs)
+        return True
+    except client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey'):
+            return False
+        raise
+    except ParamValidationError as e:
+        raise conditional_writes_unsupported(e) from e
+
+
+def conditional_writes_unsupported(error):
+    # Without the conditions concurrent rollup and index updates would silently overwrite
+    # each other, so an old botocore fails the write instead of falling back to a plain PUT
+    import botocore
+    return RuntimeError(f"botocore {botocore.__version__} does not support S3 conditional writes, "
+                        f"botocore>=1.35.76 is required: {error}")
+
+
+class S3ObjectStore:
+    # Thin wrapper around the S3 calls used by the feedback jobs. Pass endpoint_url to
+    # run against an S3 compatible stand-in (MinIO, moto server, LocalStack).
+
+    def __init__(self, bucket, client=None, endpoint_url=None):
+        if client is None:
+            from common.aws_clients import aws_client
+            client = aws_client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.client = client
+
+    def list_objects(self, prefix):
+        # Yields (key, size) for every object below prefix
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['Size']
+
+    def list_prefixes(self, prefix):
+        # Yields the "sub directories" directly below prefix, e.g. the year= partitions
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            for item in page.get('CommonPrefixes', []):
+                yield item['Prefix']
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def open(self, key):
+        # Returns a binary file object streaming the object, for objects too large to read at once
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def get_with_etag(self, key):
+        # Returns (body, etag), or (None, None) when the object doesn't exist
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None, None
+        return response['Body'].read(), response['ETag']
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def put(self, key, body, **kwargs):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, **kwargs)
+
+    def put_if_absent(self, key, body, **kwargs):
+        return put_if_absent(self.client, self.bucket, key, body, **kwargs)
+
+    def put_if_match(self, key, body, etag, **kwargs):
+        return put_if_match(self.client, self.bucket, key, body, etag, **kwargs)
+
+    def copy(self, source_key, target_key):
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=target_key,
+            CopySource={'Bucket': self.bucket, 'Key': source_key},
+        )
+
+    def delete(self, keys):
+        # DeleteObjects accepts at most 1000 keys per call
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True},
+            )
+            if response.get('Errors'):
+                raise RuntimeError(f"failed to delete {len(response['Errors'])} objects: {response['Errors'][0]}")
+
+
+class LocalObjectStore:
+    # Directory backed stand-in for the data bucket, the key is the path relative to root.
+    # Used to run the jobs locally and in benchmarks without an AWS account.
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def list_objects(self, prefix):
+        base = self._path(prefix.rstrip('/')) if prefix.endswith('/') else os.path.dirname(self._path(prefix))
+        if not os.path.isdir(base):
+            return
+        for directory, _, files in sorted(os.walk(base)):
+            for name in sorted(files):
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key, os.path.getsize(path)
+
+    def list_prefixes(self, prefix):
+        base = self._path(prefix.rstrip('/'))
+        if not os.path.isdir(base):
+            return
+        for name in sorted(os.listdir(base)):
+            if os.path.isdir(os.path.join(base, name)):
+                yield f'{prefix}{name}/'
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def get_with_etag(self, key):
+        try:
+            body = self.get(key)
+        except FileNotFoundError:
+            return None, None
+        return body, self._etag(body)
+
+    @staticmethod
+    def _etag(body):
+        return '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def put(self, key, body, **kwargs):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        # write to a temporary file first so readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def put_if_absent(self, key, body, **kwargs):
+        if self.exists(key):
+            return False
+        self.put(key, body, **kwargs)
+        return True
+
+    def put_if_match(self, key, body, etag, **kwargs):
+        # compare and write are not atomic, local runs have a single writer
+        _, current = self.get_with_etag(key)
+        if current != etag:
+            return False
+        self.put(key, body, **kwargs)
+        return True
+
+    def copy(self, source_key, target_key):
+        target = self._path(target_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(self._path(source_key), target)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,91 @@
+import io
+import json
+
+# pyarrow is not part of the Lambda runtime, functions writing Parquet get it from the
+# AWS SDK for pandas layer. It is imported on first use so JSON writers never load it.
+_pa = None
+_pq = None
+
+# name and Arrow type of the fields emitted by the llm_app feedback processor
+FEEDBACK_FIELDS = [
+    ('recordId', 'string'),
+    ('interactionId', 'string'),
+    ('prompt', 'string'),
+    ('response', 'string'),
+    ('source_attribution_urls', 'list<string>'),
+    ('sourceAttribution', 'string'),
+    ('appIdentifier', 'string'),
+    ('feedback', 'string'),
+    ('comment', 'string'),
+    ('userId', 'string'),
+    ('submittedAt', 'string'),
+    ('submittedAtRaw', 'string'),
+    ('ingestedAt', 'string'),
+    ('promptDigest', 'string'),
+    ('responseDigest', 'string'),
+    ('sourceAttributionDigest', 'string'),
+]
+
+DEFAULT_COMPRESSION = 'snappy'
+
+
+def _arrow():
+    global _pa, _pq
+    if _pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError(
+                "Parquet output requires pyarrow, attach the AWS SDK for pandas layer or pip install pyarrow"
+            ) from e
+        _pa, _pq = pyarrow, pyarrow.parquet
+    return _pa, _pq
+
+
+def feedback_schema():
+    pa, _ = _arrow()
+    types = {
+        'string': pa.string(),
+        'list<string>': pa.list_(pa.string()),
+    }
+    return pa.schema([pa.field(name, types[type_name]) for name, type_name in FEEDBACK_FIELDS])
+
+
+def _as_string(value):
+    # free form attributes (e.g. a structured sourceAttribution) are stored as JSON text
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _as_string_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [_as_string(item) for item in value]
+    return [_as_string(value)]
+
+
+def records_to_table(records):
+    pa, _ = _arrow()
+    columns = {}
+    for name, type_name in FEEDBACK_FIELDS:
+        convert = _as_string_list if type_name == 'list<string>' else _as_string
+        columns[name] = [convert(record.get(name)) for record in records]
+    return pa.Table.from_pydict(columns, schema=feedback_schema())
+
+
+def to_parquet_bytes(records, compression=DEFAULT_COMPRESSION):
+    # Serializes feedback records into a single Parquet object with the fixed schema
+    _, pq = _arrow()
+    buffer = io.BytesIO()
+    pq.write_table(records_to_table(records), buffer, compression=compression)
+    return buffer.getvalue()
+
+
+def read_parquet_records(body, columns=None, filters=None):
+    # Returns the rows of a Parquet object as dictionaries, optionally only some columns.
+    # filters (pyarrow DNF, e.g. [('feedback', 'in', ['up'])]) skip row groups by their statistics.
+    _, pq = _arrow()
+    return pq.read_table(io.BytesIO(body), columns=columns, filters=filters).to_pylist()
@@ -0,0 +1,94 @@
+import requests
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common import metrics
+from common.aws_clients import session
+
+# SigV4 signed HTTP client for the feedback API. Kept out of the handlers so functions
+# that store feedback directly never import requests.
+
+# responses retried by the session and, when they persist, raised so the event is retried
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class CachedSigV4Auth(SigV4Auth):
+    # botocore derives the SigV4 signing key from the secret key for every request.
+    # The key only depends on the credentials, the day, the region and the service,
+    # so it is derived once and reused until the day or the credentials change.
+
+    def __init__(self, credentials, service_name, region_name):
+        super().__init__(credentials, service_name, region_name)
+        self._signing_key = None
+        self._signing_key_scope = None
+
+    def signature(self, string_to_sign, request):
+        scope = (self.credentials.secret_key, request.context['timestamp'][0:8])
+        if scope != self._signing_key_scope:
+            k_date = self._sign(f"AWS4{scope[0]}".encode('utf-8'), scope[1])
+            k_region = self._sign(k_date, self._region_name)
+            k_service = self._sign(k_region, self._service_name)
+            self._signing_key = self._sign(k_service, 'aws4_request')
+            self._signing_key_scope = scope
+        return self._sign(self._signing_key, string_to_sign, hex=True)
+
+
+class SignedRequestsAuth(requests.auth.AuthBase):
+    # Signs requests made through a requests session with the Lambda role credentials
+
+    def __init__(self, region, service='execute-api'):
+        self.region = region
+        self.service = service
+        self._credentials = session().get_credentials()
+        self._frozen_credentials = None
+        self._signer = None
+
+    def signer(self):
+        # get_frozen_credentials() returns the cached credentials and only refreshes
+        # them when they are about to expire, the signer is rebuilt when that happens
+        frozen_credentials = self._credentials.get_frozen_credentials()
+        if frozen_credentials != self._frozen_credentials:
+            self._signer = CachedSigV4Auth(frozen_credentials, self.service, self.region)
+            self._frozen_credentials = frozen_credentials
+        return self._signer
+
+    def __call__(self, r):
+        with metrics.stage('sign'):
+            aws_request = AWSRequest(method=r.method, url=r.url, data=r.body,
+                                     headers={'Content-Type': r.headers.get('Content-Type', 'application/json')})
+            self.signer().add_auth(aws_request)
+            r.headers.update(dict(aws_request.headers.items()))
+        return r
+
+
+class FeedbackApiClient:
+    # Posts feedback to the API Gateway endpoint over a pooled keep-alive session.
+    # Timeouts (408), throttling (429) and 5xx responses are retried with exponential backoff and jitter.
+
+    def __init__(self, url, region, connect_timeout=3.05, read_timeout=10, max_retries=3, pool_size=10):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.2,
+            backoff_jitter=0.2,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+        self.session.auth = SignedRequestsAuth(region)
+
+    def post(self, data):
+        response = self.session.post(self.url, data=data, timeout=self.timeout,
+                                     headers={'Content-Type': 'application/json'})
+        # A retryable status that persists fails the invocation, so the event is retried
+        # instead of silently dropped. Other 4xx responses, e.g. a 400 for an invalid body,
+        # would fail the same way on every retry and are returned for the caller to log.
+        if response.status_code in RETRY_STATUSES or response.status_code >= 500:
+            response.raise_for_status()
+        return response
@@ -0,0 +1,30 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(os.path.dirname(APP_DIR))
+LAYER_PATH = os.path.join(APP_DIR, 'lambda_assets', 'layer')
+
+# the shared layer package is imported as common.<module>, like in the functions
+sys.path.insert(0, LAYER_PATH)
+
+# The stack refers to its assets relative to the CDK app directory, where cdk synth runs
+# the app. The jsii runtime keeps the working directory it was started in, so it is
+# changed before aws_cdk is imported by the stack tests.
+os.chdir(APP_DIR)
+
+
+@pytest.fixture
+def load_source():
+    # Loads a module of the source directory by path, e.g. a function's lambda-handler.py
+    # whose name is not importable
+    def load(path):
+        name = path.replace('/', '_').replace('-', '_').removesuffix('.py')
+        spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, 'source', path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
@@ -0,0 +1,156 @@
+import json
+
+import boto3
+import pytest
+import requests
+from moto import mock_aws
+
+API_URL = 'https://api.example.com/prod/feedback'
+BUCKET = 'feedback-data'
+DATABASE = 'chatbot_user_feedback'
+
+
+def put_feedback_event(message_id, conversation_id='conversation-1', usefulness='THUMBS_DOWN'):
+    # PutFeedback CloudTrail event as EventBridge delivers it
+    return {
+        'detail': {
+            'eventSource': 'qbusiness.amazonaws.com',
+            'eventName': 'PutFeedback',
+            'userIdentity': {'onBehalfOf': {'userId': 'user-1'}},
+            'requestParameters': {
+                'applicationId': 'support-app',
+                'conversationId': conversation_id,
+                'messageId': message_id,
+                'messageUsefulness': {
+                    'usefulness': usefulness,
+                    'submittedAt': '2024-03-14T10:00:00Z',
+                    'comment': 'Outdated console steps',
+                },
+            },
+        },
+    }
+
+
+def sqs_event(*bodies):
+    return {'Records': [{'messageId': f'message-{index}', 'body': body} for index, body in enumerate(bodies)]}
+
+
+def api_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = API_URL
+    response.reason = 'reason'
+    response._content = b'{}'
+    return response
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def direct_processor(s3, load_source, monkeypatch):
+    monkeypatch.setenv('FEEDBACK_SINK', 'direct')
+    monkeypatch.setenv('S3_DATA_BUCKET', BUCKET)
+    monkeypatch.setenv('GLUE_DATABASE_NAME', DATABASE)
+    monkeypatch.setenv('ENRICH_MESSAGES', 'false')
+    return load_source('businessq_feedback_processor/lambda-handler.py')
+
+
+def stored_interactions(s3):
+    interactions = []
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=f'{DATABASE}/feedback/')
+    for item in response.get('Contents', []):
+        body = s3.get_object(Bucket=BUCKET, Key=item['Key'])['Body'].read().decode('utf-8')
+        interactions.extend(json.loads(line)['interactionId'] for line in body.splitlines())
+    return sorted(interactions)
+
+
+def failed_messages(result):
+    return sorted(failure['itemIdentifier'] for failure in result['batchItemFailures'])
+
+
+@pytest.fixture
+def api_processor(load_source, monkeypatch):
+    # Posts the feedback to a stand-in of the feedback API, which answers with the status of
+    # the interaction in statuses (200 when not given). Returns the handler, the statuses and
+    # the interactions posted.
+    monkeypatch.setenv('FEEDBACK_SINK', 'api')
+    monkeypatch.setenv('API_GATEWAY_URL', API_URL)
+    monkeypatch.setenv('AWS_REGION', 'us-east-1')
+    monkeypatch.setenv('ENRICH_MESSAGES', 'false')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    handler = load_source('businessq_feedback_processor/lambda-handler.py')
+    client = handler.get_feedback_api_client()
+    statuses = {}
+    posted = []
+
+    def post(url, data=None, **kwargs):
+        body = json.loads(data)
+        posted.append(body['interactionId'])
+        return api_response(statuses.get(body['interactionId'], 200))
+    monkeypatch.setattr(client.session, 'post', post)
+    return handler, statuses, posted
+
+
+def test_rejected_feedback_is_dropped_and_unavailable_api_retried(api_processor):
+    handler, statuses, posted = api_processor
+    statuses.update({'rejected': 400, 'throttled': 429, 'failing': 503})
+    result = handler.handle_sqs_batch(sqs_event(
+        json.dumps(put_feedback_event('stored')),
+        json.dumps(put_feedback_event('rejected', conversation_id='conversation-2')),
+        json.dumps(put_feedback_event('throttled', conversation_id='conversation-3')),
+        json.dumps(put_feedback_event('failing', conversation_id='conversation-4')),
+    ))
+
+    assert sorted(posted) == ['failing', 'rejected', 'stored', 'throttled']
+    # a 400 fails the same way on every retry, the event is not sent to the dead letter queue
+    assert failed_messages(result) == ['message-2', 'message-3']
+
+    # a single event is answered with the status of the API
+    assert handler.handle_feedback_event(put_feedback_event('rejected'))['statusCode'] == 400
+    with pytest.raises(requests.HTTPError):
+        handler.handle_feedback_event(put_feedback_event('failing'))
+
+
+def test_sqs_batch_stores_the_events_of_every_conversation_together(direct_processor, s3):
+    without_user = put_feedback_event('message-4')
+    del without_user['detail']['userIdentity']['onBehalfOf']
+    result = direct_processor.handle_sqs_batch(sqs_event(
+        json.dumps(put_feedback_event('rated-1')),
+        json.dumps(put_feedback_event('rated-2', conversation_id='conversation-2')),
+        'not an event',
+        json.dumps({'detail': {'requestParameters': {}}}),
+        json.dumps(without_user),
+        json.dumps(put_feedback_event('rated-3')),
+    ))
+    # messages without a PutFeedback event and events that fail while they are mapped are
+    # retried, the records of the other messages are stored in a single object
+    assert failed_messages(result) == ['message-2', 'message-3', 'message-4']
+    assert stored_interactions(s3) == ['rated-1', 'rated-2', 'rated-3']
+    assert len(s3.list_objects_v2(Bucket=BUCKET, Prefix=f'{DATABASE}/feedback/')['Contents']) == 1
+
+
+def test_sqs_batch_drops_invalid_events_and_fails_the_batch_write(direct_processor, s3, monkeypatch):
+    invalid = put_feedback_event('rated-2')
+    invalid['detail']['requestParameters']['messageUsefulness']['usefulness'] = None
+    events = sqs_event(json.dumps(put_feedback_event('rated-1')), json.dumps(invalid))
+    # an invalid event is dropped, retrying it doesn't make it valid
+    assert direct_processor.handle_sqs_batch(events) == {'batchItemFailures': []}
+    assert stored_interactions(s3) == ['rated-1']
+
+    def fail(records):
+        raise RuntimeError('the feedback store is unavailable')
+    monkeypatch.setattr(direct_processor.get_sink(), 'write_batch', fail)
+    result = direct_processor.handle_sqs_batch(sqs_event(
+        json.dumps(put_feedback_event('rated-3')),
+        json.dumps(put_feedback_event('rated-4', conversation_id='conversation-2')),
+        json.dumps(invalid),
+    ))
+    assert failed_messages(result) == ['message-0', 'message-1']
@@ -0,0 +1,150 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from common.object_store import LocalObjectStore
+
+BUCKET = 'feedback-data'
+DATABASE = 'chatbot_user_feedback'
+LOG_KEY = ('AWSLogs/111122223333/CloudTrail/us-east-1/2024/03/14/'
+           '111122223333_CloudTrail_us-east-1_20240314T1005Z_a1b2c3.json.gz')
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def put_feedback_event(message_id, event_time, usefulness='THUMBS_DOWN'):
+    return {
+        'eventSource': 'qbusiness.amazonaws.com',
+        'eventName': 'PutFeedback',
+        'eventID': f'event-{message_id}',
+        'eventTime': event_time,
+        'userIdentity': {'onBehalfOf': {'userId': 'user-1'}},
+        'requestParameters': {
+            'applicationId': 'support-app',
+            'conversationId': 'conversation-1',
+            'messageId': message_id,
+            'messageUsefulness': {
+                'usefulness': usefulness,
+                'submittedAt': event_time,
+                'comment': 'Outdated console steps',
+            },
+        },
+    }
+
+
+@pytest.fixture
+def backfill(load_source, monkeypatch):
+    # the script loads the function's handler, which reads its configuration from the environment
+    monkeypatch.setenv('FEEDBACK_SINK', 'api')
+    return load_source('tools/cloudtrail_backfill.py')
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def write_log_file(root, records):
+    data = gzip.compress(json.dumps({'Records': records}).encode('utf-8'))
+    LocalObjectStore(root).put(LOG_KEY, data)
+
+
+def options(trail_root, **overrides):
+    return {
+        'trail_root': str(trail_root),
+        'trail_bucket': None,
+        'logs_prefix': 'AWSLogs/',
+        'endpoint_url': None,
+        'bucket': BUCKET,
+        'database': DATABASE,
+        'partition_scheme': ['year', 'month', 'day'],
+        'output_format': 'json',
+        'compression': 'none',
+        'key_shards': 0,
+        'batch_size': 2,
+        'enrich': False,
+        'dry_run': False,
+        'force': False,
+        'start': utc(2024, 3, 14),
+        'end': utc(2024, 3, 15),
+        **overrides,
+    }
+
+
+def test_backfill_file_stores_the_feedback_events_of_the_range(backfill, s3, monkeypatch, tmp_path):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    invalid = put_feedback_event('message-4', '2024-03-14T12:00:00Z')
+    del invalid['userIdentity']['onBehalfOf']
+    write_log_file(tmp_path, [
+        put_feedback_event('message-1', '2024-03-14T10:00:00Z'),
+        {'eventSource': 'qbusiness.amazonaws.com', 'eventName': 'ListMessages', 'eventTime': '2024-03-14T10:00:01Z'},
+        put_feedback_event('message-2', '2024-03-14T11:00:00Z', usefulness='THUMBS_UP'),
+        # outside of the backfill range
+        put_feedback_event('message-3', '2024-03-15T00:00:00Z'),
+        invalid,
+        put_feedback_event('message-5', '2024-03-14T23:59:59Z'),
+    ])
+
+    backfill.init_backfill_worker(options(tmp_path))
+    assert list(backfill.backfill_keys(backfill.backfill_trail, backfill.backfill_options)) == [LOG_KEY]
+    counts = backfill.backfill_file(LOG_KEY)
+    assert counts == {'key': LOG_KEY, 'events': 4, 'records': 3, 'invalid': 1}
+
+    # three records in objects of up to two records, in the partition of their event day
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=f'{DATABASE}/feedback/')
+    keys = [item['Key'] for item in response['Contents']]
+    assert len(keys) == 2
+    assert all(key.startswith(f'{DATABASE}/feedback/year=2024/month=03/day=14/') for key in keys)
+    records = []
+    for key in keys:
+        body = s3.get_object(Bucket=BUCKET, Key=key)['Body'].read().decode('utf-8')
+        records.extend(json.loads(line) for line in body.splitlines())
+    assert sorted(record['interactionId'] for record in records) == ['message-1', 'message-2', 'message-5']
+
+
+def test_dry_run_only_counts(backfill, tmp_path):
+    write_log_file(tmp_path, [put_feedback_event(f'message-{n}', '2024-03-14T10:00:00Z') for n in range(3)])
+    backfill.init_backfill_worker(options(tmp_path, dry_run=True, bucket=None))
+    assert backfill.sink is None
+    assert backfill.backfill_file(LOG_KEY) == {'key': LOG_KEY, 'events': 3, 'records': 3, 'invalid': 0}
+
+
+def test_read_checkpoint_skips_a_cut_off_line(backfill, tmp_path):
+    checkpoint = tmp_path / 'backfill.checkpoint'
+    assert backfill.read_checkpoint(str(checkpoint)) == set()
+
+    checkpoint.write_text(json.dumps({'key': 'a.json.gz', 'records': 3}) + '\n'
+                          + json.dumps({'key': 'b.json.gz', 'records': 1}) + '\n'
+                          + '{"key": "c.js')
+    assert backfill.read_checkpoint(str(checkpoint)) == {'a.json.gz', 'b.json.gz'}
+    # the lines of the next run start on a line of their own
+    with open(checkpoint, 'a') as f:
+        f.write(json.dumps({'key': 'c.json.gz', 'records': 2}) + '\n')
+    assert backfill.read_checkpoint(str(checkpoint)) == {'a.json.gz', 'b.json.gz', 'c.json.gz'}
+
+
+def test_force_replaces_the_records_of_an_earlier_backfill(backfill, s3, monkeypatch, tmp_path):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    write_log_file(tmp_path, [put_feedback_event('message-1', '2024-03-14T10:00:00Z')])
+    backfill.init_backfill_worker(options(tmp_path))
+    backfill.backfill_file(LOG_KEY)
+    key, = [item['Key'] for item in s3.list_objects_v2(Bucket=BUCKET)['Contents']]
+    # an earlier release stored the record with a broken mapping
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b'{"interactionId": "broken"}')
+
+    backfill.init_backfill_worker(options(tmp_path))
+    backfill.backfill_file(LOG_KEY)
+    assert json.loads(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())['interactionId'] == 'broken'
+
+    backfill.init_backfill_worker(options(tmp_path, force=True))
+    backfill.backfill_file(LOG_KEY)
+    assert json.loads(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())['interactionId'] == 'message-1'
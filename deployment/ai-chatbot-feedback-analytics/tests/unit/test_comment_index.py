@@ -0,0 +1,23 @@
+from datetime import datetime, timezone
+
+from common.comment_index import CommentIndex
+from common.object_store import LocalObjectStore
+
+from .test_feedback_query import BASELINE_KEY, BASELINE_RECORD
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_index_baseline_records(tmp_path):
+    index = CommentIndex(LocalObjectStore(tmp_path), 'chatbot_user_feedback')
+    unrated = dict(BASELINE_RECORD, interactionId='interaction-2', feedback='thumbs_up')
+    keys = index.add_records([BASELINE_RECORD, unrated], BASELINE_KEY)
+    # the record has neither recordId nor ingestedAt, the object key places it on its day
+    assert len(keys) == 1
+    assert keys[0].startswith('chatbot_user_feedback/feedback_comment_index/day=2024-03-14/segment-')
+
+    hits = index.search('outdated console', utc(2024, 3, 14), utc(2024, 3, 15))
+    assert [(hit['interactionId'], hit['time']) for hit in hits] == [('interaction-1', '2024-03-14T23:30:00+00:00')]
+    assert index.search('outdated', utc(2024, 3, 15), utc(2024, 3, 16)) == []
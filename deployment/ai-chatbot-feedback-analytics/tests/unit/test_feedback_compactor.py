@@ -0,0 +1,180 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from common.feedback_layout import load_manifest, partition_objects, read_records
+from common.feedback_sink import FeedbackSink, build_feedback_record
+from common.object_store import S3ObjectStore
+
+BUCKET = 'feedback-data'
+DATABASE = 'chatbot_user_feedback'
+PARTITION = f'{DATABASE}/feedback/year=2024/month=03/day=14/'
+VALUES = ['2024', '03', '14']
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def feedback(n):
+    body = {'interactionId': f'interaction-{n}', 'appIdentifier': 'support-bot', 'feedback': 'thumbs_up',
+            'userId': 'user-1', 'submittedAt': f'2024-03-14T10:00:0{n}Z'}
+    return build_feedback_record(body, utc(2024, 3, 14, 10, 1))
+
+
+@pytest.fixture
+def aws():
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        glue = boto3.client('glue', region_name='us-east-1')
+        glue.create_database(DatabaseInput={'Name': DATABASE})
+        storage = {'Location': f's3://{BUCKET}/{DATABASE}/feedback', 'Columns': [{'Name': 'recordId', 'Type': 'string'}]}
+        for table in ('feedback', 'feedback_parquet'):
+            glue.create_table(DatabaseName=DATABASE, TableInput={
+                'Name': table,
+                'PartitionKeys': [{'Name': name, 'Type': 'string'} for name in ('year', 'month', 'day')],
+                'StorageDescriptor': dict(storage, Location=f's3://{BUCKET}/{DATABASE}/{table}'),
+            })
+        # registered by the partition registrar when the first object arrived
+        glue.create_partition(DatabaseName=DATABASE, TableName='feedback', PartitionInput={
+            'Values': VALUES, 'StorageDescriptor': dict(storage, Location=f's3://{BUCKET}/{PARTITION}'.rstrip('/')),
+        })
+        yield s3, glue
+
+
+@pytest.fixture
+def compactor(load_source):
+    return load_source('feedback_compactor/lambda-handler.py')
+
+
+def location(glue, table='feedback'):
+    partition = glue.get_partition(DatabaseName=DATABASE, TableName=table, PartitionValues=VALUES)
+    return partition['Partition']['StorageDescriptor']['Location']
+
+
+def stored_ids(store, prefix=PARTITION):
+    return sorted(
+        record['recordId'] for key in partition_objects(store, prefix)
+        for record in read_records(key, store.get(key))
+    )
+
+
+def test_compaction_switches_the_partition_location(aws, compactor):
+    s3, glue = aws
+    sink = FeedbackSink(BUCKET, DATABASE, s3_client=s3)
+    records = [feedback(n) for n in range(3)]
+    for record in records:
+        sink.write_record(record)
+    # a duplicate that reached the partition through the Firehose path
+    s3.put_object(Bucket=BUCKET, Key=f'{PARTITION}firehose-1.json', Body=json.dumps(records[0]))
+    store = S3ObjectStore(BUCKET, client=s3)
+    catalog = compactor.GlueCatalog(glue, BUCKET, DATABASE)
+    sources = partition_objects(store, PARTITION)
+
+    manifest = compactor.compact_partition(store, catalog, PARTITION)
+    assert (manifest['state'], manifest['records'], manifest['duplicates']) == ('published', 3, 1)
+    assert manifest['location'].startswith(f'{PARTITION}_compacted/')
+    assert location(glue) == f"s3://{BUCKET}/{manifest['location']}"
+    # the replaced objects are kept for queries that started before the switch
+    assert all(store.exists(key) for key in sources)
+    assert partition_objects(store, PARTITION) == manifest['parts']
+    assert stored_ids(store) == sorted(record['recordId'] for record in records)
+
+    compactor.retire_after = timedelta(0)
+    # nothing new to compact, the run retires the replaced objects
+    assert compactor.compact_partition(store, catalog, PARTITION) is None
+    assert load_manifest(store, PARTITION)['state'] == 'committed'
+    assert not any(store.exists(key) for key in sources)
+
+    # an object written after the switch is merged into the next generation
+    late = feedback(3)
+    FeedbackSink(BUCKET, DATABASE, s3_client=s3).write_record(late)
+    assert stored_ids(store) == sorted(record['recordId'] for record in records + [late])
+    next_manifest = compactor.compact_partition(store, catalog, PARTITION)
+    assert (next_manifest['state'], next_manifest['records']) == ('committed', 4)
+    assert location(glue) == f"s3://{BUCKET}/{next_manifest['location']}"
+    assert [key for key, _ in store.list_objects(PARTITION) if not key.endswith('_manifest.json')] == next_manifest['parts']
+
+
+def test_interrupted_run_is_published_by_the_next_one(aws, compactor):
+    s3, glue = aws
+    sink = FeedbackSink(BUCKET, DATABASE, s3_client=s3)
+    for n in range(2):
+        sink.write_record(feedback(n))
+    store = S3ObjectStore(BUCKET, client=s3)
+    catalog = compactor.GlueCatalog(glue, BUCKET, DATABASE)
+
+    class Interrupted(Exception):
+        pass
+
+    def fail(prefix, location):
+        raise Interrupted()
+
+    switch_location = catalog.switch_location
+    catalog.switch_location = fail
+    with pytest.raises(Interrupted):
+        compactor.compact_partition(store, catalog, PARTITION)
+    staged = load_manifest(store, PARTITION)
+    assert staged['state'] == 'staged'
+    # readers keep reading the objects of the partition
+    assert location(glue) == f's3://{BUCKET}/{PARTITION}'.rstrip('/')
+    assert partition_objects(store, PARTITION) == staged['sources']
+
+    catalog.switch_location = switch_location
+    assert compactor.compact_partition(store, catalog, PARTITION) is None
+    assert load_manifest(store, PARTITION)['state'] == 'published'
+    assert location(glue) == f"s3://{BUCKET}/{staged['location']}"
+
+
+def test_parquet_compaction_moves_the_day_into_the_parquet_table(aws, compactor):
+    pytest.importorskip('pyarrow')
+    s3, glue = aws
+    records = [feedback(n) for n in range(3)]
+    FeedbackSink(BUCKET, DATABASE, s3_client=s3).write_record(records[0])
+    # batches of the parquet writers are stored in the feedback_parquet table
+    FeedbackSink(BUCKET, DATABASE, output_format='parquet', s3_client=s3).write_batch(records[1:])
+    store = S3ObjectStore(BUCKET, client=s3)
+    catalog = compactor.GlueCatalog(glue, BUCKET, DATABASE)
+    parquet_partition = PARTITION.replace('/feedback/', '/feedback_parquet/')
+
+    manifest = compactor.compact_partition(store, catalog, PARTITION, output_format='parquet')
+    assert manifest['records'] == 3
+    assert location(glue, 'feedback_parquet') == f"s3://{BUCKET}/{manifest['location']}"
+    assert stored_ids(store, parquet_partition) == sorted(record['recordId'] for record in records)
+    # the JSON partition is switched to an empty generation
+    json_manifest = load_manifest(store, PARTITION)
+    assert json_manifest['parts'] == []
+    assert location(glue) == f"s3://{BUCKET}/{json_manifest['location']}"
+    assert stored_ids(store) == []
+
+
+def test_projected_partition_is_compacted_in_place(aws, compactor):
+    s3, glue = aws
+    sink = FeedbackSink(BUCKET, DATABASE, s3_client=s3)
+    records = [feedback(n) for n in range(3)]
+    for record in records:
+        sink.write_record(record)
+    store = S3ObjectStore(BUCKET, client=s3)
+
+    def athena_objects():
+        # Athena reads the visible objects of a projected partition
+        return [key for key, _ in store.list_objects(PARTITION) if '/_' not in key[len(PARTITION) - 1:]]
+
+    manifest = compactor.compact_partition(store, None, PARTITION, in_place=True)
+    # published and retired in the same run, Athena reads each record once
+    assert (manifest['state'], manifest['records']) == ('committed', 3)
+    assert athena_objects() == manifest['parts']
+    assert manifest['parts'][0].startswith(f"{PARTITION}compacted-{manifest['runId']}-part-")
+    assert stored_ids(store) == sorted(record['recordId'] for record in records)
+
+    late = feedback(3)
+    sink.write_record(late)
+    assert stored_ids(store) == sorted(record['recordId'] for record in records + [late])
+    next_manifest = compactor.compact_partition(store, None, PARTITION, in_place=True)
+    assert next_manifest['records'] == 4
+    assert athena_objects() == next_manifest['parts']
+    assert not list(store.list_objects(f'{PARTITION}_compacted/'))
@@ -0,0 +1,62 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from common.feedback_index import FeedbackIndex, decode_cursor, encode_cursor
+from common.feedback_sink import FeedbackSink, build_feedback_record
+from common.object_store import LocalObjectStore
+
+from .test_feedback_query import BASELINE_KEY, BASELINE_RECORD
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_rebuild_day_with_baseline_records(tmp_path, load_source):
+    handler = load_source('feedback_index/lambda-handler.py')
+    store = LocalObjectStore(tmp_path)
+    store.put(BASELINE_KEY, json.dumps(BASELINE_RECORD))
+    sink = FeedbackSink(None, 'chatbot_user_feedback')
+    record = build_feedback_record(
+        dict(BASELINE_RECORD, interactionId='interaction-2', submittedAt='2024-03-14T09:00:00.000Z'),
+        utc(2024, 3, 14, 9, 1),
+    )
+    store.put(sink.record_key(record), json.dumps(record))
+
+    feedback_index = FeedbackIndex(store, 'chatbot_user_feedback')
+    assert handler.rebuild_day(feedback_index, date(2024, 3, 14)) == 2
+    entries, cursor = feedback_index.page('support-bot', utc(2024, 3, 14), utc(2024, 3, 15))
+    assert cursor is None
+    # the baseline record has no ingestedAt, the key of its object bounds its partition time
+    assert [(entry['interactionId'], entry['time']) for entry in entries] == [
+        ('interaction-1', '2024-03-14T23:30:00.000Z'),
+        ('interaction-2', '2024-03-14T09:00:00.000Z'),
+    ]
+
+
+def test_cursor_range_is_checked(tmp_path):
+    store = LocalObjectStore(tmp_path)
+    feedback_index = FeedbackIndex(store, 'chatbot_user_feedback')
+    records = [build_feedback_record(dict(BASELINE_RECORD, interactionId=f'interaction-{n}',
+                                          submittedAt=f'2024-03-14T0{n}:00:00.000Z'), utc(2024, 3, 14, 9))
+               for n in range(3)]
+    feedback_index.add_records([(record, None) for record in records])
+
+    max_range = timedelta(days=31)
+    entries, cursor = feedback_index.page('support-bot', utc(2024, 3, 1), utc(2024, 3, 31), limit=2,
+                                          max_range=max_range)
+    assert [entry['interactionId'] for entry in entries] == ['interaction-2', 'interaction-1']
+    entries, _ = feedback_index.page('support-bot', utc(2024, 3, 1), utc(2024, 3, 31), limit=2,
+                                     cursor=cursor, max_range=max_range)
+    assert [entry['interactionId'] for entry in entries] == ['interaction-0']
+
+    # a cursor changed to cover years of days is rejected instead of reading their manifests
+    position = decode_cursor(cursor)
+    crafted = encode_cursor(dict(position, s='2000-01-01T00:00:00+00:00', e=position['e'].isoformat()))
+    with pytest.raises(ValueError):
+        feedback_index.page('support-bot', utc(2024, 3, 1), utc(2024, 3, 31), cursor=crafted, max_range=max_range)
+    naive = encode_cursor(dict(position, s='2024-03-01T00:00:00', e=position['e'].isoformat()))
+    with pytest.raises(ValueError):
+        feedback_index.page('support-bot', utc(2024, 3, 1), utc(2024, 3, 31), cursor=naive, max_range=max_range)
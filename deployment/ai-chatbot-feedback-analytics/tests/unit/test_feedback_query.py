@@ -0,0 +1,65 @@
+import json
+from datetime import datetime, timezone
+
+from common.feedback_query import FeedbackQuery
+from common.feedback_sink import FeedbackSink, build_feedback_record
+from common.object_store import LocalObjectStore
+
+# a record as the processor stored it before the timestamps were normalized: no recordId,
+# submittedAt in the display format and no ingestedAt, in the partition of its ingest day
+BASELINE_KEY = 'chatbot_user_feedback/feedback/year=2024/month=03/day=14/interaction-1.json'
+BASELINE_RECORD = {
+    'interactionId': 'interaction-1',
+    'prompt': 'How do I rotate access keys?',
+    'response': 'Create a second key first.',
+    'source_attribution_urls': [],
+    'sourceAttribution': '',
+    'appIdentifier': 'support-bot',
+    'feedback': 'thumbs_down',
+    'comment': 'Outdated console steps',
+    'userId': 'user-1',
+    'submittedAt': 'Mar 14, 2024, 11:30:00 PM',
+}
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_partition_time_of_baseline_records():
+    sink = FeedbackSink(None, 'chatbot_user_feedback')
+    assert sink.partition_time(BASELINE_RECORD, BASELINE_KEY) == utc(2024, 3, 14, 23, 30)
+    # a submittedAt outside the partition of the object, or none the parser understands,
+    # places the record at the start of the partition
+    for submitted_at in ('Mar 20, 2024, 10:00:00 AM', 'yesterday', None):
+        record = dict(BASELINE_RECORD, submittedAt=submitted_at)
+        assert sink.partition_time(record, BASELINE_KEY) == utc(2024, 3, 14)
+
+
+def test_partition_time_of_current_records():
+    sink = FeedbackSink(None, 'chatbot_user_feedback', max_lateness_days=7)
+    body = dict(BASELINE_RECORD, submittedAt='2024-03-14T10:00:00Z')
+    assert sink.partition_time(build_feedback_record(body, utc(2024, 3, 14, 10, 1))) == utc(2024, 3, 14, 10)
+    # late arrivals are kept in the partition of their ingest time
+    late = build_feedback_record(body, utc(2024, 3, 30, 8))
+    assert sink.partition_time(late) == utc(2024, 3, 30, 8)
+
+
+def test_query_reads_baseline_and_current_records(tmp_path):
+    store = LocalObjectStore(tmp_path)
+    store.put(BASELINE_KEY, json.dumps(BASELINE_RECORD))
+    sink = FeedbackSink(None, 'chatbot_user_feedback')
+    record = build_feedback_record(
+        dict(BASELINE_RECORD, interactionId='interaction-2', feedback='thumbs_up', submittedAt='2024-03-15T09:00:00Z'),
+        utc(2024, 3, 15, 9, 1),
+    )
+    store.put(sink.record_key(record), json.dumps(record))
+
+    query = FeedbackQuery(store, 'chatbot_user_feedback')
+    rows = query.count(utc(2024, 3, 14), utc(2024, 3, 16), ('day', 'hour', 'feedback'))
+    assert rows == [
+        {'day': '2024-03-14', 'hour': '23', 'feedback': 'thumbs_down', 'records': 1},
+        {'day': '2024-03-15', 'hour': '09', 'feedback': 'thumbs_up', 'records': 1},
+    ]
+    comments = query.comments(utc(2024, 3, 14), utc(2024, 3, 16))
+    assert [comment['interactionId'] for comment in comments] == ['interaction-2', 'interaction-1']
@@ -0,0 +1,102 @@
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from common.feedback_sink import FeedbackSink, build_feedback_record
+
+from .test_feedback_query import BASELINE_KEY, BASELINE_RECORD
+
+BUCKET = 'feedback-data'
+DATABASE = 'chatbot_user_feedback'
+ROLLUP_KEY = f'{DATABASE}/feedback_rollups/day=2024-03-14/app=support-bot.json'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('S3_DATA_BUCKET', BUCKET)
+    monkeypatch.setenv('GLUE_DATABASE_NAME', DATABASE)
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def notification(*keys):
+    message = {'Records': [{'s3': {'object': {'key': key}}} for key in keys]}
+    return {'Records': [{'Sns': {'Message': json.dumps(message)}}]}
+
+
+def test_objects_are_counted_once(s3, load_source):
+    handler = load_source('feedback_rollup/lambda-handler.py')
+    s3.put_object(Bucket=BUCKET, Key=BASELINE_KEY, Body=json.dumps(BASELINE_RECORD))
+    sink = FeedbackSink(BUCKET, DATABASE, s3_client=s3)
+    body = dict(BASELINE_RECORD, interactionId='interaction-2', feedback='thumbs_up', comment='',
+                submittedAt='2024-03-14T09:00:00Z')
+    record = build_feedback_record(body, datetime(2024, 3, 14, 9, 1, tzinfo=timezone.utc))
+    key, = sink.write_batch([record])
+
+    event = notification(BASELINE_KEY, key)
+    assert json.loads(handler.lambda_handler(event, None)['body']) == {'records': 2, 'added': 2}
+    # S3 and SNS deliver notifications at least once
+    assert json.loads(handler.lambda_handler(event, None)['body']) == {'records': 2, 'added': 0}
+
+    rollup = json.loads(s3.get_object(Bucket=BUCKET, Key=ROLLUP_KEY)['Body'].read())
+    ids = sorted(handler.record_token(record) for record in [BASELINE_RECORD, record])
+    assert sorted(rollup.pop('ids')) == ids
+    expected = {
+        'app': 'support-bot',
+        'day': '2024-03-14',
+        'records': 2,
+        'totals': {'thumbs_down': 1, 'thumbs_up': 1},
+        'comments': {'thumbs_down': 1},
+        'hours': {
+            '09': {'totals': {'thumbs_up': 1}, 'comments': {}},
+            # the baseline record has no ingestedAt, the key of its object bounds its partition time
+            '23': {'totals': {'thumbs_down': 1}, 'comments': {'thumbs_down': 1}},
+        },
+    }
+    assert {name: value for name, value in rollup.items() if name != 'updatedAt'} == expected
+
+    response = handler.lambda_handler({'rebuild': '2024-03-14'}, None)
+    assert json.loads(response['body']) == {'rebuilt': 1}
+    rebuilt = json.loads(s3.get_object(Bucket=BUCKET, Key=ROLLUP_KEY)['Body'].read())
+    assert sorted(rebuilt.pop('ids')) == ids
+    assert {name: value for name, value in rebuilt.items() if name != 'updatedAt'} == expected
+    # the records the rebuild counted are not counted again
+    assert json.loads(handler.lambda_handler(event, None)['body']) == {'records': 2, 'added': 0}
+
+
+def test_a_record_in_two_objects_is_counted_once(s3, load_source):
+    handler = load_source('feedback_rollup/lambda-handler.py')
+    records = [
+        build_feedback_record(dict(BASELINE_RECORD, interactionId=f'interaction-{n}', submittedAt='2024-03-14T09:00:00Z'),
+                              datetime(2024, 3, 14, 9, 1, tzinfo=timezone.utc))
+        for n in range(2)
+    ]
+    live, = FeedbackSink(BUCKET, DATABASE, s3_client=s3).write_batch(records[:1])
+    # a backfill or a retried Firehose delivery stores the record again, in another object
+    backfill, = FeedbackSink(BUCKET, DATABASE, s3_client=s3).write_batch(records)
+    assert live != backfill
+
+    assert json.loads(handler.lambda_handler(notification(live), None)['body']) == {'records': 1, 'added': 1}
+    assert json.loads(handler.lambda_handler(notification(backfill), None)['body']) == {'records': 2, 'added': 1}
+    rollup = json.loads(s3.get_object(Bucket=BUCKET, Key=ROLLUP_KEY)['Body'].read())
+    assert (rollup['records'], rollup['totals']) == (2, {'thumbs_down': 2})
+
+
+def test_rollups_without_ids_are_upgraded(load_source):
+    handler = load_source('feedback_rollup/lambda-handler.py')
+    # written while the counted objects were claimed by markers
+    rollup = handler.upgrade_rollup({'app': 'support-bot', 'day': '2024-03-14', 'records': 1,
+                                     'totals': {'thumbs_up': 1}, 'comments': {}, 'hours': {}})
+    assert rollup['ids'] == []
+    # written before the comment counters, with the full record ids
+    rollup = handler.upgrade_rollup({'app': 'support-bot', 'day': '2024-03-14', 'records': 1,
+                                     'totals': {'thumbs_up': 1}, 'hours': {'09': {'thumbs_up': 1}},
+                                     'recordIds': ['0123456789abcdef0123456789abcdef']})
+    assert rollup['ids'] == ['0123456789abcdef']
+    assert rollup['hours'] == {'09': {'totals': {'thumbs_up': 1}, 'comments': {}}}
@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from common.feedback_sink import FeedbackSink, build_feedback_record
+
+BUCKET = 'feedback-data'
+DATABASE = 'chatbot_user_feedback'
+BODY = {
+    'interactionId': 'interaction-1',
+    'prompt': 'How do I rotate access keys?',
+    'response': 'Create a second key first.',
+    'appIdentifier': 'support-bot',
+    'feedback': 'thumbs_down',
+    'comment': 'Outdated console steps',
+    'userId': 'user-1',
+}
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def new_sink(s3, **kwargs):
+    # a sink of a new container, nothing in its recent ids
+    return FeedbackSink(BUCKET, DATABASE, s3_client=s3, **kwargs)
+
+
+def feedback_keys(s3):
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=f'{DATABASE}/feedback/')
+    return sorted(item['Key'] for item in response.get('Contents', []))
+
+
+def count_requests(s3):
+    # S3 operation name -> number of calls made with the client
+    calls = {}
+
+    def count(model, **kwargs):
+        calls[model.name] = calls.get(model.name, 0) + 1
+    s3.meta.events.register('before-call.s3', count)
+    return calls
+
+
+def test_a_record_costs_one_put(s3):
+    record = build_feedback_record(BODY, utc(2024, 3, 14, 10))
+    calls = count_requests(s3)
+    sink = new_sink(s3)
+    sink.write_record(record)
+    assert calls == {'PutObject': 1}
+
+    # a repeated delivery to the same container is skipped without any request, one to
+    # another container is a conditional write of the same key
+    sink.write_record(record)
+    new_sink(s3).write_record(record)
+    assert calls == {'PutObject': 2}
+    assert feedback_keys(s3) == [sink.record_key(record)]
+
+
+def test_a_batch_costs_one_put_per_partition(s3):
+    ingested_at = utc(2024, 3, 14, 10)
+    records = [build_feedback_record(dict(BODY, interactionId=f'interaction-{n}'), ingested_at) for n in range(50)]
+    calls = count_requests(s3)
+    # records repeated within the batch are stored once
+    keys = new_sink(s3).write_batch(records + records[:5])
+    assert calls == {'PutObject': 1}
+    assert len(keys) == 1
+    body = s3.get_object(Bucket=BUCKET, Key=keys[0])['Body'].read().decode('utf-8')
+    assert len(body.splitlines()) == 50
+
+    # a retried batch maps to the existing object
+    assert new_sink(s3).write_batch(records) == keys
+    assert feedback_keys(s3) == keys
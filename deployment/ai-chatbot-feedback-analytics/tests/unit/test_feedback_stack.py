@@ -0,0 +1,172 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from ai_chatbot_feedback_analytics.feedback_stack import SUMMARY_COLUMNS, SUMMARY_TABLE, FeedbackStack
+
+PANDAS_LAYER_ARN = "arn:aws:lambda:us-east-1:336392948345:layer:AWSSDKPandas-Python311:12"
+
+
+def synth(**context):
+    # Synthesizes the stack without bundling the layer, so no container runtime is needed
+    app = core.App(context={
+        "glue_database": "chatbot_user_feedback",
+        "classification": "confidential",
+        "aws:cdk:bundling-stacks": [],
+        **context,
+    })
+    stack = FeedbackStack(app, "feedback-stack")
+    return assertions.Template.from_stack(stack)
+
+
+@pytest.fixture(scope="module")
+def template():
+    return synth()
+
+
+def function_id(template, function_name):
+    functions = template.find_resources("AWS::Lambda::Function", {"Properties": {"FunctionName": function_name}})
+    assert len(functions) == 1
+    return next(iter(functions))
+
+
+def test_work_group_uses_engine_version_3(template):
+    template.has_resource_properties("AWS::Athena::WorkGroup", {
+        "Name": "AI-ChatbotFeedback-WorkGroup",
+        "WorkGroupConfiguration": assertions.Match.object_like({
+            "EngineVersion": {"SelectedEngineVersion": "Athena engine version 3"},
+        }),
+    })
+
+
+def test_report_queries(template):
+    template.resource_count_is("AWS::Athena::NamedQuery", 4)
+    for name in ("Satisfaction per app", "Worst rated prompts", "Top negative comments"):
+        template.has_resource_properties("AWS::Athena::NamedQuery", {
+            "Name": name,
+            "Database": "chatbot_user_feedback",
+            "WorkGroup": "AI-ChatbotFeedback-WorkGroup",
+            "QueryString": assertions.Match.string_like_regexp("FROM \\(\n  SELECT .* FROM feedback WHERE"),
+        })
+    template.has_resource_properties("AWS::Athena::NamedQuery", {
+        "Name": "Daily satisfaction per app",
+        "QueryString": assertions.Match.string_like_regexp(f"FROM {SUMMARY_TABLE}\n"),
+    })
+
+
+def test_summary_table(template):
+    template.has_resource_properties("AWS::Glue::Table", {
+        "DatabaseName": "chatbot_user_feedback",
+        "TableInput": {
+            "Name": SUMMARY_TABLE,
+            "TableType": "EXTERNAL_TABLE",
+            "Parameters": {"classification": "parquet", "parquet.compression": "SNAPPY"},
+            "PartitionKeys": [{"Name": "dt", "Type": "string"}],
+            "StorageDescriptor": assertions.Match.object_like({
+                "Columns": [{"Name": name, "Type": column_type} for name, column_type in SUMMARY_COLUMNS],
+                "SerdeInfo": {
+                    "SerializationLibrary": "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe",
+                },
+            }),
+        },
+    })
+
+
+def test_summary_function(template):
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "FunctionName": "feedback_summary",
+        "Handler": "lambda-handler.lambda_handler",
+        "Runtime": "python3.11",
+        "Timeout": 900,
+        "Environment": {
+            "Variables": assertions.Match.object_like({
+                "GLUE_DATABASE_NAME": "chatbot_user_feedback",
+                "SOURCE_TABLES": "feedback",
+                "SUMMARY_TABLE": SUMMARY_TABLE,
+                "ATHENA_WORK_GROUP": "AI-ChatbotFeedback-WorkGroup",
+                # the named query id of every report
+                "REPORT_QUERY_IDS": {"Fn::Join": ["", [
+                    "satisfaction_per_app=", {"Fn::GetAtt": ["satisfactionperappreportquery", "NamedQueryId"]},
+                    ",worst_rated_prompts=", {"Fn::GetAtt": ["worstratedpromptsreportquery", "NamedQueryId"]},
+                    ",top_negative_comments=", {"Fn::GetAtt": ["topnegativecommentsreportquery", "NamedQueryId"]},
+                    ",daily_satisfaction=", {"Fn::GetAtt": ["dailysatisfactionreportquery", "NamedQueryId"]},
+                ]]},
+            }),
+        },
+    })
+    # the partitions of the summary table are switched through Athena DDL and CTAS queries
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": assertions.Match.array_with([
+                assertions.Match.object_like({
+                    "Action": assertions.Match.array_with([
+                        "glue:CreateTable", "glue:DeleteTable", "glue:GetPartition", "glue:UpdatePartition",
+                    ]),
+                }),
+            ]),
+        },
+        "Roles": [{"Ref": assertions.Match.string_like_regexp("feedbacksummaryServiceRole")}],
+    })
+
+
+def test_summary_schedule(template):
+    summary_function = function_id(template, "feedback_summary")
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "cron(0 2 * * ? *)",
+        "State": "ENABLED",
+        "Targets": [assertions.Match.object_like({"Arn": {"Fn::GetAtt": [summary_function, "Arn"]}})],
+    })
+
+
+def test_summary_reads_both_tables_with_parquet_output():
+    template = synth(output_format="parquet", pandas_layer_arn=PANDAS_LAYER_ARN)
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "FunctionName": "feedback_summary",
+        "Environment": {
+            "Variables": assertions.Match.object_like({"SOURCE_TABLES": "feedback,feedback_parquet"}),
+        },
+    })
+    template.has_resource_properties("AWS::Athena::NamedQuery", {
+        "Name": "Satisfaction per app",
+        "QueryString": assertions.Match.string_like_regexp("UNION ALL\n  SELECT .* FROM feedback_parquet WHERE"),
+    })
+
+
+def test_compaction_runs_with_both_partition_registrations(template):
+    # projected partitions can't be switched to a compacted location, the files are copied into them
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "FunctionName": "feedback_compactor",
+        "Environment": {"Variables": assertions.Match.object_like({"PARTITION_REGISTRATION": "projection"})},
+    })
+    compactor = function_id(template, "feedback_compactor")
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "cron(30 1 * * ? *)",
+        "Targets": [assertions.Match.object_like({"Arn": {"Fn::GetAtt": [compactor, "Arn"]}})],
+    })
+
+    template = synth(partition_registration="events")
+    compactor = function_id(template, "feedback_compactor")
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": assertions.Match.array_with([
+                assertions.Match.object_like({
+                    "Action": ["glue:GetTable", "glue:CreatePartition", "glue:UpdatePartition"],
+                }),
+            ]),
+        },
+        "Roles": [{"Ref": assertions.Match.string_like_regexp("feedbackcompactorServiceRole")}],
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "cron(30 1 * * ? *)",
+        "Targets": [assertions.Match.object_like({"Arn": {"Fn::GetAtt": [compactor, "Arn"]}})],
+    })
+
+
+def test_crawler_table_is_dropped_before_the_feedback_table_is_created(template):
+    # the hourly crawler of earlier deployments created a table of the same name
+    custom_resources = template.find_resources("Custom::AWS")
+    drop_table = next(logical_id for logical_id in custom_resources if logical_id.startswith("DropFeedbackCrawlerTable"))
+    stop_schedule = next(logical_id for logical_id in custom_resources if logical_id.startswith("StopFeedbackCrawlerSchedule"))
+    assert stop_schedule in custom_resources[drop_table]["DependsOn"]
+    feedback_table = template.find_resources("AWS::Glue::Table", {"Properties": {"TableInput": {"Name": "feedback"}}})
+    assert [drop_table in resource["DependsOn"] for resource in feedback_table.values()] == [True]
@@ -0,0 +1,29 @@
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def summary(load_source, monkeypatch):
+    monkeypatch.setenv('S3_DATA_BUCKET', 'feedback-data')
+    monkeypatch.setenv('GLUE_DATABASE_NAME', 'chatbot_user_feedback')
+    monkeypatch.setenv('SOURCE_TABLES', 'feedback,feedback_parquet')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    return load_source('feedback_summary/lambda-handler.py')
+
+
+def test_records_without_a_record_id_are_grouped_by_their_identity(summary, monkeypatch):
+    queries = []
+    monkeypatch.setattr(summary, 'run_query', lambda query_string, *args, **kwargs: queries.append(query_string))
+    monkeypatch.setattr(summary, 'partition_location', lambda dt: None)
+    monkeypatch.setattr(summary, 'delete_replaced_runs', lambda dt, current: None)
+    summary.materialize_day(date(2024, 3, 14))
+
+    ctas = queries[0]
+    assert "FROM feedback WHERE year = '2024' AND month = '03' AND day = '14'" in ctas
+    assert "FROM feedback_parquet WHERE" in ctas
+    # two ratings of a user with the same value and comment are different records unless
+    # they rate the same interaction at the same time
+    assert ("GROUP BY coalesce(recordid, concat_ws('|', appidentifier, userid, interactionid, "
+            "feedback, comment, submittedat))") in ctas
+    assert queries[-1].startswith('ALTER TABLE feedback_daily_summary ADD IF NOT EXISTS PARTITION')
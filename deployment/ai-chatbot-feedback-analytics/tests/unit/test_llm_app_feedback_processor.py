@@ -0,0 +1,169 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+BUCKET = 'feedback-data'
+DATABASE = 'chatbot_user_feedback'
+BODY = {
+    'interactionId': 'interaction-1',
+    'prompt': 'How do I rotate access keys?',
+    'response': 'Create a second key first.',
+    'appIdentifier': 'support-bot',
+    'feedback': 'thumbs_down',
+    'comment': 'Outdated console steps',
+    'userId': 'user-1',
+}
+ARRIVAL = datetime(2024, 3, 15, 0, 2, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def processor(s3, load_source, monkeypatch):
+    monkeypatch.setenv('S3_DATA_BUCKET', BUCKET)
+    monkeypatch.setenv('GLUE_DATABASE_NAME', DATABASE)
+    return load_source('llm_app_feedback_processor/lambda-handler.py')
+
+
+def stored_interactions(s3):
+    interactions = []
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=f'{DATABASE}/feedback/')
+    for item in response.get('Contents', []):
+        body = s3.get_object(Bucket=BUCKET, Key=item['Key'])['Body'].read().decode('utf-8')
+        interactions.extend(json.loads(line)['interactionId'] for line in body.splitlines())
+    return sorted(interactions)
+
+
+def sqs_event(*bodies):
+    return {'Records': [{'messageId': f'message-{index}', 'body': body} for index, body in enumerate(bodies)]}
+
+
+def failed_messages(result):
+    return sorted(failure['itemIdentifier'] for failure in result['batchItemFailures'])
+
+
+def firehose_event(*raw_bodies):
+    # Firehose record transformation event, one Firehose record per request body
+    arrival_ms = int(ARRIVAL.timestamp() * 1000)
+    return {
+        'invocationId': 'invocation-1',
+        'deliveryStreamArn': 'arn:aws:firehose:us-east-1:123456789012:deliverystream/feedback',
+        'region': 'us-east-1',
+        'records': [
+            {
+                'recordId': f'record-{index}',
+                'approximateArrivalTimestamp': arrival_ms,
+                'data': base64.b64encode(raw_body.encode('utf-8')).decode('ascii'),
+            }
+            for index, raw_body in enumerate(raw_bodies)
+        ],
+    }
+
+
+def output_records(result):
+    return [json.loads(line) for line in base64.b64decode(result['data']).decode('utf-8').splitlines()]
+
+
+def test_firehose_transform(processor):
+    batch = [dict(BODY, interactionId=f'interaction-{n}', submittedAt='2024-03-14T10:00:00Z') for n in range(2)]
+    event = firehose_event(
+        json.dumps(dict(BODY, submittedAt='2024-03-14T09:00:00Z')),
+        '\n'.join(json.dumps(body) for body in batch),
+        json.dumps(dict(BODY, feedback=None)),
+        '{"interactionId": ',
+    )
+    results = processor.firehose_transform_handler(event, None)['records']
+
+    assert [result['recordId'] for result in results] == ['record-0', 'record-1', 'record-2', 'record-3']
+    assert [result['result'] for result in results] == ['Ok', 'Ok', 'ProcessingFailed', 'ProcessingFailed']
+    assert results[0]['metadata'] == {'partitionKeys': {'year': '2024', 'month': '03', 'day': '14'}}
+    record, = output_records(results[0])
+    assert record['submittedAt'] == '2024-03-14T09:00:00.000Z'
+    # the arrival time is the ingest time, so a retried Firehose batch yields the same records
+    assert record['ingestedAt'] == '2024-03-15T00:02:00.000Z'
+    assert [record['interactionId'] for record in output_records(results[1])] == ['interaction-0', 'interaction-1']
+    # failed requests keep their data for the error output prefix
+    assert results[3]['data'] == event['records'][3]['data']
+
+
+def test_firehose_request_around_midnight_is_stored_in_the_partition_of_its_first_record(processor):
+    batch = [
+        dict(BODY, interactionId='interaction-1', submittedAt='2024-03-14T23:59:00Z'),
+        dict(BODY, interactionId='interaction-2', submittedAt='2024-03-15T00:01:00Z'),
+    ]
+    result, = processor.firehose_transform_handler(firehose_event(json.dumps(batch)), None)['records']
+
+    assert result['result'] == 'Ok'
+    assert result['metadata'] == {'partitionKeys': {'year': '2024', 'month': '03', 'day': '14'}}
+    assert [record['interactionId'] for record in output_records(result)] == ['interaction-1', 'interaction-2']
+
+
+def test_parse_request_body(processor):
+    assert processor.parse_request_body(json.dumps(BODY), None) == (BODY, False)
+    assert processor.parse_request_body(json.dumps([BODY, BODY]), {}) == ([BODY, BODY], True)
+    ndjson = json.dumps(BODY) + '\n\n{"interactionId": \n' + json.dumps(BODY) + '\n'
+    # NDJSON by content type, with the position of a line that is not JSON kept
+    assert processor.parse_request_body(ndjson, {'Content-Type': 'application/x-ndjson'}) == ([BODY, None, BODY], True)
+    # or by a JSON document followed by more data
+    assert processor.parse_request_body(json.dumps(BODY) + '\n' + json.dumps(BODY), None) == ([BODY, BODY], True)
+    with pytest.raises(processor.json_codec.JSONDecodeError):
+        processor.parse_request_body('{"interactionId": ', None)
+
+
+def test_batch_request_reports_every_item(processor, s3):
+    items = [BODY, dict(BODY, interactionId='interaction-2'), dict(BODY, feedback=None), None]
+    response = processor.handle_request({'body': json.dumps(items), 'headers': {}})
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert (body['accepted'], body['rejected']) == (2, 2)
+    assert [result['status'] for result in body['results']] == ['ok', 'ok', 'error', 'error']
+    assert [result['index'] for result in body['results']] == [0, 1, 2, 3]
+    assert stored_interactions(s3) == ['interaction-1', 'interaction-2']
+
+    # a batch without any valid record is rejected
+    response = processor.handle_request({'body': json.dumps([dict(BODY, feedback=None)]), 'headers': {}})
+    assert response['statusCode'] == 400
+
+
+def test_batch_request_over_the_limit_is_rejected(processor, s3, monkeypatch):
+    monkeypatch.setattr(processor, 'max_batch_records', 2)
+    ndjson = '\n'.join(json.dumps(dict(BODY, interactionId=f'interaction-{n}')) for n in range(3))
+    response = processor.handle_request({'body': ndjson, 'headers': {'content-type': 'application/x-ndjson'}})
+    assert response['statusCode'] == 413
+    assert stored_interactions(s3) == []
+
+
+def test_sqs_batch_fails_only_the_messages_that_cannot_be_stored(processor, s3):
+    result = processor.handle_sqs_batch(sqs_event(
+        json.dumps(BODY),
+        '{"interactionId": ',
+        json.dumps([dict(BODY, feedback=None), dict(BODY, userId=None)]),
+        json.dumps([dict(BODY, interactionId='interaction-2'), dict(BODY, feedback=None)]),
+    ))
+    # a malformed message and a message without any valid record are retried, the valid
+    # records of the other messages are stored together
+    assert failed_messages(result) == ['message-1', 'message-2']
+    assert stored_interactions(s3) == ['interaction-1', 'interaction-2']
+
+
+def test_sqs_batch_write_failure_fails_every_written_message(processor, s3, monkeypatch):
+    def fail(records):
+        raise RuntimeError('the feedback store is unavailable')
+    monkeypatch.setattr(processor.sink, 'write_batch', fail)
+    result = processor.handle_sqs_batch(sqs_event(
+        json.dumps(BODY),
+        json.dumps(dict(BODY, feedback=None)),
+        json.dumps([dict(BODY, interactionId='interaction-2'), dict(BODY, interactionId='interaction-3')]),
+    ))
+    assert failed_messages(result) == ['message-0', 'message-1', 'message-2']
@@ -0,0 +1,237 @@
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Measures the cold start cost of the feedback handlers: the time to import and initialize
+# the handler module, the latency of the first invocation (which creates the clients) and
+# of warm invocations. Every cold start runs in a fresh interpreter.
+#
+# AWS calls go to a local stand-in endpoint (AWS_ENDPOINT_URL) answering with canned
+# responses, so the numbers include client creation, serialization and signing but
+# no network or service latency. Run it on two commits and compare:
+#
+#   python source/benchmarks/cold_start.py --output before.json
+#   python source/benchmarks/cold_start.py --compare before.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER_PATH = os.path.join(REPO_ROOT, 'deployment', 'ai-chatbot-feedback-analytics', 'lambda_assets', 'layer')
+
+LLM_APP_BODY = {
+    'interactionId': 'bench-interaction',
+    'appIdentifier': 'bench-app',
+    'feedback': 'thumbs_up',
+    'userId': 'bench-user',
+    'prompt': 'How do I rotate my access keys?',
+    'response': 'Open the IAM console and create a new access key.',
+    'submittedAt': '2024-03-14T10:00:00Z',
+}
+
+QBUSINESS_EVENT = {
+    'detail': {
+        'requestParameters': {
+            'messageId': 'bench-answer',
+            'applicationId': '00000000-0000-4000-8000-00000000a001',
+            'conversationId': '00000000-0000-4000-8000-00000000c001',
+            'messageUsefulness': {'usefulness': 'USEFUL', 'submittedAt': '2024-03-14T10:00:00Z'},
+        },
+        'userIdentity': {'onBehalfOf': {'userId': 'bench-user'}},
+    }
+}
+
+LIST_MESSAGES_RESPONSE = {
+    'messages': [
+        {'messageId': 'bench-answer', 'type': 'SYSTEM', 'body': 'Open the IAM console.',
+         'time': 1710410460, 'sourceAttribution': [{'title': 'IAM', 'url': 'https://docs.aws.amazon.com/iam/'}]},
+        {'messageId': 'bench-question', 'type': 'USER', 'body': 'How do I rotate my access keys?',
+         'time': 1710410400},
+    ]
+}
+
+# scenario -> handler file, environment and event
+SCENARIOS = {
+    'llm_app': (
+        'llm_app_feedback_processor',
+        {},
+        {'body': json.dumps(LLM_APP_BODY)},
+    ),
+    'llm_app_batch': (
+        'llm_app_feedback_processor',
+        {},
+        {'body': json.dumps([LLM_APP_BODY] * 50)},
+    ),
+    'businessq_direct': (
+        'businessq_feedback_processor',
+        {'FEEDBACK_SINK': 'direct'},
+        QBUSINESS_EVENT,
+    ),
+    'businessq_api': (
+        'businessq_feedback_processor',
+        {'FEEDBACK_SINK': 'api'},
+        QBUSINESS_EVENT,
+    ),
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, with Nagle's algorithm the body waits
+    # for the delayed ACK of the client (40 ms on Linux)
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = b''
+        if '/conversations/' in self.path:
+            body = json.dumps(LIST_MESSAGES_RESPONSE).encode('utf-8')
+        elif self.command == 'POST' and self.path.startswith('/prod/'):
+            body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"bench"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_HEAD = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def run_child(scenario, warm_invocations):
+    # Runs in the fresh interpreter, reports one cold start as a JSON line
+    handler_dir, _, event = SCENARIOS[scenario]
+    started = time.perf_counter()
+    started_cpu = time.process_time()
+    modules_before = len(sys.modules)
+    spec = importlib.util.spec_from_file_location(
+        'lambda_handler', os.path.join(REPO_ROOT, 'source', handler_dir, 'lambda-handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+
+    response = module.lambda_handler(json.loads(json.dumps(event)), None)
+    first = time.perf_counter()
+    first_cpu = time.process_time()
+    if response.get('statusCode') != 200:
+        raise SystemExit(f"{scenario}: unexpected response {response}")
+
+    warm = []
+    for _ in range(warm_invocations):
+        start = time.perf_counter()
+        module.lambda_handler(json.loads(json.dumps(event)), None)
+        warm.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        'init_ms': (imported - started) * 1000,
+        'first_invoke_ms': (first - imported) * 1000,
+        'cold_total_ms': (first - started) * 1000,
+        # CPU time is less sensitive to noisy neighbours than wall clock time
+        'cold_total_cpu_ms': (first_cpu - started_cpu) * 1000,
+        'warm_invoke_ms': statistics.median(warm) * 1000 if warm else None,
+        'modules_loaded': len(sys.modules) - modules_before,
+    }))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_scenario(scenario, endpoint, runs, warm_invocations):
+    _, scenario_environment, _ = SCENARIOS[scenario]
+    environment = dict(
+        os.environ,
+        AWS_ENDPOINT_URL=endpoint,
+        AWS_REGION='us-east-1',
+        AWS_DEFAULT_REGION='us-east-1',
+        AWS_ACCESS_KEY_ID='benchmark',
+        AWS_SECRET_ACCESS_KEY='benchmark',
+        S3_DATA_BUCKET='benchmark-bucket',
+        GLUE_DATABASE_NAME='benchmark',
+        API_GATEWAY_URL=f'{endpoint}/prod/feedback',
+        PYTHONPATH=os.pathsep.join(filter(None, [LAYER_PATH, os.environ.get('PYTHONPATH')])),
+        **scenario_environment,
+    )
+    environment.pop('AWS_SESSION_TOKEN', None)
+    environment.pop('AWS_PROFILE', None)
+
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', scenario, '--warm', str(warm_invocations)],
+            env=environment, capture_output=True, text=True,
+        )
+        if output.returncode != 0:
+            raise SystemExit(f"{scenario} failed:\n{output.stderr}")
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    summary = {}
+    for metric in ('init_ms', 'first_invoke_ms', 'cold_total_ms', 'cold_total_cpu_ms', 'warm_invoke_ms', 'modules_loaded'):
+        values = [sample[metric] for sample in samples if sample[metric] is not None]
+        if values:
+            summary[metric] = {'p50': statistics.median(values), 'p90': percentile(values, 90)}
+    return summary
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<18} {'metric':<18} {'p50':>10} {'p90':>10}" + (f" {'base p50':>10} {'change':>8}" if baseline else ''))
+    for scenario, summary in results.items():
+        for metric, values in summary.items():
+            line = f"{scenario:<18} {metric:<18} {values['p50']:>10.1f} {values['p90']:>10.1f}"
+            base = (baseline or {}).get(scenario, {}).get(metric)
+            if base:
+                change = (values['p50'] - base['p50']) / base['p50'] * 100 if base['p50'] else 0.0
+                line += f" {base['p50']:>10.1f} {change:>+7.1f}%"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start and first invocation latency of the feedback handlers.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, repeatable (default all)')
+    parser.add_argument('--runs', type=int, default=10, help='cold starts per scenario')
+    parser.add_argument('--warm', type=int, default=20, help='warm invocations after each cold start')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.warm)
+        return
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_port}'
+
+    results = {}
+    try:
+        for scenario in args.scenario or list(SCENARIOS):
+            results[scenario] = run_scenario(scenario, endpoint, args.runs, args.warm)
+    finally:
+        server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Load and latency benchmark of the ingestion handlers. Synthetic events are generated
+# for the entry points, API Gateway proxy events for llm_app_feedback_processor, Firehose
+# record transformation batches for its firehose_transform_handler and CloudTrail
+# PutFeedback events delivered by EventBridge for businessq_feedback_processor, and replayed
+# against a warm handler in a fresh interpreter per scenario.
+#
+# S3, Q Business and the signed feedback API are answered by a local stand-in endpoint
+# (AWS_ENDPOINT_URL), so the numbers cover validation, serialization, signing and the
+# HTTP round trip to localhost but no service latency. Per scenario it reports the
+# p50/p95/p99 invocation latency, records per second and the peak Python heap
+# (tracemalloc, measured in a separate pass) and resident set size. Compare two commits:
+#
+#   python source/benchmarks/load.py --output before.json
+#   git checkout <other commit>
+#   python source/benchmarks/load.py --compare before.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER_PATH = os.path.join(REPO_ROOT, 'deployment', 'ai-chatbot-feedback-analytics', 'lambda_assets', 'layer')
+
+APPLICATION_ID = '00000000-0000-4000-8000-00000000a001'
+FEEDBACK_VALUES = ['thumbs_up', 'thumbs_down']
+USEFULNESS_VALUES = ['USEFUL', 'NOT_USEFUL']
+BASE_TIME = datetime(2024, 3, 14, 10, 0, tzinfo=timezone.utc)
+
+# scenario -> handler directory, environment and records per event
+SCENARIOS = {
+    'llm_app': ('llm_app_feedback_processor', {}, 1),
+    'llm_app_batch': ('llm_app_feedback_processor', {}, None),
+    'llm_app_firehose': ('llm_app_feedback_processor', {}, None),
+    'businessq_direct': ('businessq_feedback_processor', {'FEEDBACK_SINK': 'direct'}, 1),
+    'businessq_api': ('businessq_feedback_processor', {'FEEDBACK_SINK': 'api'}, 1),
+}
+
+# entry point of the scenarios that don't use lambda_handler
+HANDLERS = {
+    'llm_app_firehose': 'firehose_transform_handler',
+}
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'records_per_second', 'peak_heap_kb', 'max_rss_mb')
+# metrics where a higher value is better
+HIGHER_IS_BETTER = ('records_per_second',)
+
+
+def text(rng, chars):
+    # printable filler of the given length, not trivially compressible
+    words = []
+    length = 0
+    while length < chars:
+        word = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9)))
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:chars]
+
+
+def feedback_body(rng, index, sizes):
+    return {
+        'interactionId': str(uuid.UUID(int=rng.getrandbits(128))),
+        'appIdentifier': f'bench-app-{index % 5}',
+        'feedback': rng.choice(FEEDBACK_VALUES),
+        'comment': text(rng, sizes['comment']),
+        'userId': f'bench-user-{index % 97}',
+        'prompt': text(rng, sizes['prompt']),
+        'response': text(rng, sizes['response']),
+        'sourceAttribution': 'benchmark',
+        'sourceUrls': [f'https://example.com/docs/{index}/{n}' for n in range(3)],
+        'submittedAt': (BASE_TIME + timedelta(seconds=index)).isoformat(),
+    }
+
+
+def api_gateway_event(body):
+    # API Gateway REST API proxy integration event
+    return {
+        'resource': '/feedback',
+        'path': '/feedback',
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/json', 'Host': 'example.execute-api.us-east-1.amazonaws.com'},
+        'multiValueHeaders': {},
+        'queryStringParameters': None,
+        'pathParameters': None,
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': '/feedback',
+            'httpMethod': 'POST',
+            'stage': 'prod',
+            'requestId': str(uuid.uuid4()),
+            'identity': {'sourceIp': '127.0.0.1', 'userAgent': 'feedback-load-benchmark'},
+        },
+        'body': json.dumps(body),
+        'isBase64Encoded': False,
+    }
+
+
+def firehose_event(bodies, arrival=BASE_TIME):
+    # Firehose record transformation event, one Firehose record per request body
+    arrival_ms = int(arrival.timestamp() * 1000)
+    return {
+        'invocationId': str(uuid.uuid4()),
+        'deliveryStreamArn': 'arn:aws:firehose:us-east-1:123456789012:deliverystream/feedback',
+        'region': 'us-east-1',
+        'records': [
+            {
+                'recordId': f'{index:056d}',
+                'approximateArrivalTimestamp': arrival_ms + index,
+                'data': base64.b64encode(json.dumps(body).encode('utf-8')).decode('ascii'),
+            }
+            for index, body in enumerate(bodies)
+        ],
+    }
+
+
+def put_feedback_event(rng, index, sizes):
+    # CloudTrail PutFeedback call delivered by EventBridge. The conversation is generated by
+    # the stand-in from its id, the rated message is its answer.
+    conversation_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    usefulness = {
+        'usefulness': rng.choice(USEFULNESS_VALUES),
+        'submittedAt': (BASE_TIME + timedelta(seconds=index)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    if sizes['comment']:
+        usefulness['comment'] = text(rng, sizes['comment'])
+    return {
+        'version': '0',
+        'id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'detail-type': 'AWS API Call via CloudTrail',
+        'source': 'aws.qbusiness',
+        'account': '123456789012',
+        'time': usefulness['submittedAt'],
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': {
+            'eventVersion': '1.09',
+            'eventSource': 'qbusiness.amazonaws.com',
+            'eventName': 'PutFeedback',
+            'awsRegion': 'us-east-1',
+            'userIdentity': {'type': 'AssumedRole', 'onBehalfOf': {'userId': f'bench-user-{index % 97}'}},
+            'requestParameters': {
+                'applicationId': APPLICATION_ID,
+                'conversationId': conversation_id,
+                'messageId': f'{conversation_id}-answer',
+                'messageUsefulness': usefulness,
+            },
+        },
+    }
+
+
+def generate_events(scenario, count, sizes, batch_size, seed):
+    rng = random.Random(seed)
+    if scenario.startswith('businessq'):
+        return [put_feedback_event(rng, index, sizes) for index in range(count)]
+    if scenario == 'llm_app_firehose':
+        return [
+            firehose_event([feedback_body(rng, index * batch_size + n, sizes) for n in range(batch_size)])
+            for index in range(count)
+        ]
+    if SCENARIOS[scenario][2] is None:
+        return [
+            api_gateway_event([feedback_body(rng, index * batch_size + n, sizes) for n in range(batch_size)])
+            for index in range(count)
+        ]
+    return [api_gateway_event(feedback_body(rng, index, sizes)) for index in range(count)]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Answers S3 PUTs, ListMessages and the feedback API. ListMessages returns a two message
+    # conversation (question and answer) of the configured sizes for any conversation id.
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, with Nagle's algorithm the body waits
+    # for the delayed ACK of the client (40 ms on Linux)
+    disable_nagle_algorithm = True
+    sizes = {'prompt': 0, 'response': 0}
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = b''
+        if '/conversations/' in self.path:
+            conversation_id = self.path.split('/conversations/', 1)[1].split('/')[0].split('?')[0]
+            body = json.dumps({'messages': [
+                {'messageId': f'{conversation_id}-answer', 'type': 'SYSTEM', 'body': 'a' * self.sizes['response'],
+                 'time': 1710410460, 'sourceAttribution': [{'title': 'docs', 'url': 'https://example.com/docs'}]},
+                {'messageId': f'{conversation_id}-question', 'type': 'USER', 'body': 'q' * self.sizes['prompt'],
+                 'time': 1710410400},
+            ]}).encode('utf-8')
+        elif self.command == 'POST' and self.path.startswith('/prod/'):
+            body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"bench"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_HEAD = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def succeeded(response):
+    if 'records' in response:
+        return all(record['result'] == 'Ok' for record in response['records'])
+    return response.get('statusCode') == 200
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_child(scenario, options):
+    # Runs in the fresh interpreter and prints the results of the scenario as a JSON line
+    handler_dir, _, records_per_event = SCENARIOS[scenario]
+    records_per_event = records_per_event or options['batch_size']
+    spec = importlib.util.spec_from_file_location(
+        'lambda_handler', os.path.join(REPO_ROOT, 'source', handler_dir, 'lambda-handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    events = generate_events(scenario, options['events'] + options['memory_events'] + 1,
+                             options['sizes'], options['batch_size'], options['seed'])
+    # the first invocation creates the clients, it is measured by cold_start.py
+    handler = getattr(module, HANDLERS.get(scenario, 'lambda_handler'))
+    handler(events[0], None)
+
+    latencies = []
+    started = time.perf_counter()
+    for event in events[1:options['events'] + 1]:
+        start = time.perf_counter()
+        response = handler(event, None)
+        latencies.append(time.perf_counter() - start)
+        if not succeeded(response):
+            raise SystemExit(f"{scenario}: unexpected response {response}")
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc slows allocations down, the heap is measured after the latency pass
+    tracemalloc.start()
+    for event in events[options['events'] + 1:]:
+        handler(event, None)
+    _, peak_heap = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'records_per_second': len(latencies) * records_per_event / elapsed,
+        'peak_heap_kb': peak_heap / 1024,
+        # ru_maxrss is in kilobytes on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def run_scenario(scenario, endpoint, options):
+    _, scenario_environment, _ = SCENARIOS[scenario]
+    environment = dict(
+        os.environ,
+        AWS_ENDPOINT_URL=endpoint,
+        AWS_REGION='us-east-1',
+        AWS_DEFAULT_REGION='us-east-1',
+        AWS_ACCESS_KEY_ID='benchmark',
+        AWS_SECRET_ACCESS_KEY='benchmark',
+        S3_DATA_BUCKET='benchmark-bucket',
+        GLUE_DATABASE_NAME='benchmark',
+        API_GATEWAY_URL=f'{endpoint}/prod/feedback',
+        PYTHONPATH=os.pathsep.join(filter(None, [LAYER_PATH, os.environ.get('PYTHONPATH')])),
+        **scenario_environment,
+    )
+    environment.pop('AWS_SESSION_TOKEN', None)
+    environment.pop('AWS_PROFILE', None)
+
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', scenario, '--child-options', json.dumps(options)],
+        env=environment, capture_output=True, text=True,
+    )
+    if output.returncode != 0:
+        raise SystemExit(f"{scenario} failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<18} {'metric':<20} {'value':>12}" + (f" {'baseline':>12} {'change':>8}" if baseline else ''))
+    for scenario, summary in results.items():
+        for metric in METRICS:
+            value = summary[metric]
+            line = f"{scenario:<18} {metric:<20} {value:>12.2f}"
+            base = (baseline or {}).get(scenario, {}).get(metric)
+            if base:
+                change = (value - base) / base * 100
+                # positive changes are improvements
+                if metric not in HIGHER_IS_BETTER:
+                    change = -change
+                line += f" {base:>12.2f} {change:>+7.1f}%"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure latency, throughput and memory of the feedback handlers under load.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, repeatable (default all)')
+    parser.add_argument('--events', type=int, default=500, help='measured invocations per scenario')
+    parser.add_argument('--memory-events', type=int, default=50, help='invocations of the heap measurement pass')
+    parser.add_argument('--batch-size', type=int, default=50, help='records per request of llm_app_batch and per Firehose batch of llm_app_firehose')
+    parser.add_argument('--prompt-chars', type=int, default=500, help='prompt size of the generated records')
+    parser.add_argument('--response-chars', type=int, default=2000, help='response size of the generated records')
+    parser.add_argument('--comment-chars', type=int, default=100, help='comment size of the generated records')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the event generators')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, json.loads(args.child_options))
+        return
+
+    options = {
+        'events': args.events,
+        'memory_events': args.memory_events,
+        'batch_size': args.batch_size,
+        'sizes': {'prompt': args.prompt_chars, 'response': args.response_chars, 'comment': args.comment_chars},
+        'seed': args.seed,
+    }
+    StandInHandler.sizes = options['sizes']
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_port}'
+
+    results = {}
+    try:
+        for scenario in args.scenario or list(SCENARIOS):
+            results[scenario] = run_scenario(scenario, endpoint, options)
+    finally:
+        server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({scenario: dict(summary, options=options) for scenario, summary in results.items()}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
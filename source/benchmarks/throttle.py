@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# PUT ceiling of the feedback writers against a stand-in S3 endpoint that throttles every
+# key prefix (the key up to its last "/") to a fixed PUT rate, answering requests above it
+# with 503 SlowDown like S3 does during a burst. All records fall into one day partition,
+# as on launch day. Each scenario writes the same records with a number of concurrent
+# writers (one S3 client each, like separate Lambda containers) and reports the stored
+# records per second, the SlowDown responses and the records lost after the retries.
+#
+#   python source/benchmarks/throttle.py --prefix-rate 50 --writers 32 --records 3000
+#
+# The stand-in rate is scaled down from the 3,500 PUT/s per prefix of S3 so that a single
+# machine can saturate it; the ratio between the scenarios is what carries over.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER_PATH = os.path.join(REPO_ROOT, 'deployment', 'ai-chatbot-feedback-analytics', 'lambda_assets', 'layer')
+sys.path.insert(0, LAYER_PATH)
+
+BASE_TIME = datetime(2024, 3, 14, 10, 0, tzinfo=timezone.utc)
+
+# scenario -> key shards, client retry attempts (1 disables retries)
+SCENARIOS = {
+    'single_prefix_no_retries': (0, 1),
+    'single_prefix': (0, 10),
+    'sharded_16': (16, 10),
+    'sharded_64': (64, 10),
+}
+
+SLOW_DOWN = (b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>SlowDown</Code>'
+             b'<Message>Please reduce your request rate.</Message></Error>')
+
+
+class PrefixLimiter:
+    # token bucket per key prefix, refilled at rate tokens per second up to one second of burst
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+            self.stored = set()
+            self.throttled = 0
+
+    def allow(self, key):
+        prefix = key.rsplit('/', 1)[0]
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(prefix, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[prefix] = (tokens, now)
+                self.throttled += 1
+                return False
+            self.buckets[prefix] = (tokens - 1, now)
+            self.stored.add(key)
+            return True
+
+
+class StandInS3(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    limiter = None
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        # path style requests, /<bucket>/<key>
+        key = self.path.split('?')[0].split('/', 2)[2]
+        if self.limiter.allow(key):
+            self.send_response(200)
+            self.send_header('ETag', '"stand-in"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(503)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(SLOW_DOWN)))
+        self.end_headers()
+        self.wfile.write(SLOW_DOWN)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_record(index):
+    submitted_at = (BASE_TIME + timedelta(milliseconds=index)).isoformat()
+    return {
+        'recordId': uuid.UUID(int=index).hex,
+        'interactionId': str(uuid.UUID(int=index)),
+        'appIdentifier': 'launch-app',
+        'feedback': 'thumbs_up',
+        'comment': '',
+        'userId': f'user-{index % 997}',
+        'prompt': 'p' * 200,
+        'response': 'r' * 800,
+        'sourceAttribution': '',
+        'submittedAt': submitted_at,
+        'ingestedAt': submitted_at,
+    }
+
+
+def run_scenario(scenario, endpoint, limiter, options):
+    import botocore.session
+    from botocore.config import Config
+    from common.feedback_sink import FeedbackSink
+
+    key_shards, max_attempts = SCENARIOS[scenario]
+    config = Config(retries={'mode': 'adaptive', 'max_attempts': max_attempts},
+                    s3={'addressing_style': 'path'}, max_pool_connections=4)
+    session = botocore.session.get_session()
+    sinks = [
+        FeedbackSink('benchmark-bucket', 'benchmark', key_shards=key_shards,
+                     s3_client=session.create_client(
+                         's3', region_name='us-east-1', endpoint_url=endpoint, config=config,
+                         aws_access_key_id='benchmark', aws_secret_access_key='benchmark'))
+        for _ in range(options['writers'])
+    ]
+    records = [make_record(index) for index in range(options['records'])]
+    limiter.reset()
+
+    latencies = []
+    lost = []
+
+    def write(index):
+        start = time.perf_counter()
+        try:
+            sinks[index % len(sinks)].write_record(records[index])
+        except sinks[0].s3.exceptions.ClientError as e:
+            lost.append(e.response['Error']['Code'])
+        latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options['writers']) as executor:
+        list(executor.map(write, range(len(records))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'stored_per_second': len(limiter.stored) / elapsed,
+        'stored': len(limiter.stored),
+        'lost': len(lost),
+        'slow_down_responses': limiter.throttled,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'seconds': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the PUT ceiling of the feedback writers under S3 prefix throttling.')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='scenario to run, repeatable (default all)')
+    parser.add_argument('--records', type=int, default=3000, help='records written per scenario')
+    parser.add_argument('--writers', type=int, default=32, help='concurrent writers, one S3 client each')
+    parser.add_argument('--prefix-rate', type=float, default=50, help='PUTs per second the stand-in accepts per prefix')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    limiter = PrefixLimiter(args.prefix_rate)
+    StandInS3.limiter = limiter
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInS3)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_port}'
+    options = {'records': args.records, 'writers': args.writers, 'prefix_rate': args.prefix_rate}
+
+    results = {}
+    try:
+        for scenario in args.scenario or list(SCENARIOS):
+            results[scenario] = run_scenario(scenario, endpoint, limiter, options)
+    finally:
+        server.shutdown()
+
+    columns = ('stored_per_second', 'stored', 'lost', 'slow_down_responses', 'p50_ms', 'p99_ms')
+    print(f"{'scenario':<26}" + ''.join(f"{column:>20}" for column in columns))
+    for scenario, summary in results.items():
+        print(f"{scenario:<26}" + ''.join(f"{summary[column]:>20.1f}" for column in columns))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({scenario: dict(summary, options=options) for scenario, summary in results.items()}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+# Micro-benchmark of the request validation of the llm_app processor: decoding the body,
+# validating it and serializing the record or the error response, without any I/O.
+# "legacy" is the try/except KeyError chain with the re-parsed error template the
+# processor used before the schema; "schema" is common.feedback_schema with the stdlib
+# codec and, when it is installed, orjson. The schema path also derives the record id and
+# the canonical timestamps, which the legacy path didn't; the check of the fields alone
+# is reported as "fields only".
+#
+#   python source/benchmarks/validation.py
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'deployment', 'ai-chatbot-feedback-analytics', 'lambda_assets', 'layer'))
+
+from common import json_codec  # noqa: E402
+from common.feedback_schema import validate_feedback  # noqa: E402
+from common.feedback_sink import (  # noqa: E402
+    FeedbackValidationError, build_feedback_record, format_timestamp, max_clock_skew, parse_timestamp,
+)
+
+INGESTED_AT = datetime(2024, 3, 14, 10, 5, tzinfo=timezone.utc)
+
+REALISTIC = {
+    'interactionId': str(uuid.UUID(int=1)),
+    'appIdentifier': 'customer-support-bot',
+    'feedback': 'thumbs_down',
+    'comment': 'The answer refers to the old console layout.',
+    'userId': 'user-4711',
+    'prompt': 'How do I rotate the access keys of an IAM user without downtime? ' * 8,
+    'response': 'Create a second access key, update the applications, then deactivate the first key. ' * 20,
+    'sourceAttribution': 'IAM user guide',
+    'sourceUrls': ['https://docs.aws.amazon.com/IAM/latest/UserGuide/id_credentials_access-keys.html'] * 3,
+    'submittedAt': '2024-03-14T10:00:00Z',
+}
+
+CASES = {
+    'realistic': REALISTIC,
+    # a client pasting a whole document, 1 MB of prompt
+    'oversized': dict(REALISTIC, prompt='x' * (1024 * 1024)),
+    'missing_fields': {key: value for key, value in REALISTIC.items() if key not in ('feedback', 'userId')},
+}
+
+LEGACY_ERROR_TEMPLATE = """{{
+    "statusCode": 400,
+    "headers": {{
+        "Content-Type": "*/*"
+        }},
+    "body": "Error: parameter {param} is a required parameter"
+}}"""
+
+
+def legacy_process(raw_body):
+    # request handling of the processor before the schema
+    body = json.loads(raw_body)
+    try:
+        prompt = body['prompt']
+    except KeyError:
+        prompt = "N.A."
+    try:
+        response = body['response']
+    except KeyError:
+        response = "N.A."
+    try:
+        feedback = body['feedback']
+    except KeyError:
+        return json.loads(LEGACY_ERROR_TEMPLATE.format(param="feedback"))
+    try:
+        userId = body['userId']
+    except KeyError:
+        return json.loads(LEGACY_ERROR_TEMPLATE.format(param="userId"))
+    try:
+        appIdentifier = body['appIdentifier']
+    except KeyError:
+        return json.loads(LEGACY_ERROR_TEMPLATE.format(param="appIdentifier"))
+    try:
+        interactionId = body['interactionId']
+    except KeyError:
+        interactionId = str(uuid.uuid4())
+    try:
+        comment = body['comment']
+    except KeyError:
+        comment = ""
+    try:
+        sourceAttribution = body['sourceAttribution']
+    except KeyError:
+        sourceAttribution = ""
+    try:
+        source_attribution_urls = body['sourceUrls']
+    except KeyError:
+        source_attribution_urls = []
+    submittedAtRaw = body.get('submittedAt')
+    submitted_at = parse_timestamp(submittedAtRaw)
+    if submitted_at is None or submitted_at > INGESTED_AT + max_clock_skew:
+        submitted_at = INGESTED_AT
+    return {'statusCode': 200, 'body': json.dumps({
+        'interactionId': interactionId,
+        'prompt': prompt,
+        'response': response,
+        'source_attribution_urls': source_attribution_urls,
+        'sourceAttribution': sourceAttribution,
+        'appIdentifier': appIdentifier,
+        'feedback': feedback,
+        'comment': comment,
+        'userId': userId,
+        'submittedAt': format_timestamp(submitted_at),
+        'submittedAtRaw': submittedAtRaw,
+        'ingestedAt': format_timestamp(INGESTED_AT),
+    })}
+
+
+def schema_process(raw_body):
+    # request handling of the processor with the schema and the selected codec
+    try:
+        record = build_feedback_record(json_codec.loads(raw_body), INGESTED_AT)
+    except FeedbackValidationError as e:
+        return {'statusCode': 400, 'headers': {'Content-Type': '*/*'},
+                'body': '\n'.join(message for _, message in e.errors)}
+    return {'statusCode': 200, 'body': json_codec.dumps(record)}
+
+
+def measure(process, raw_body, number, repeat):
+    # best of repeat, in microseconds per request
+    return min(timeit.repeat(lambda: process(raw_body), number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the legacy and the schema based feedback validation.')
+    parser.add_argument('--number', type=int, default=2000, help='requests per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements, the best is reported')
+    args = parser.parse_args()
+
+    variants = [('legacy', legacy_process, 'json'), ('schema', schema_process, 'json')]
+    try:
+        import orjson  # noqa: F401
+        variants.append(('schema', schema_process, 'orjson'))
+    except ImportError:
+        print("orjson is not installed, skipping the orjson codec")
+
+    print(f"{'case':<16} {'variant':<18} {'us/request':>12} {'status':>7}")
+    for case, body in CASES.items():
+        raw_body = json.dumps(body)
+        number = max(1, args.number // 100) if len(raw_body) > 100000 else args.number
+        for variant, process, codec in variants:
+            json_codec.use(codec)
+            status = process(raw_body)['statusCode']
+            elapsed = measure(process, raw_body, number, args.repeat)
+            print(f"{case:<16} {variant + '/' + codec:<18} {elapsed:>12.1f} {status:>7}")
+        status = 400 if validate_feedback(body)[1] else 200
+        elapsed = min(timeit.repeat(lambda: validate_feedback(body), number=number, repeat=args.repeat)) / number * 1e6
+        print(f"{case:<16} {'fields only':<18} {elapsed:>12.1f} {status:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,180 @@
-import boto3
 import json
 import logging
-from urllib.parse import urlparse
 import os
-from datetime import datetime, timezone
-from typing import Dict, List, Optional
-from botocore.exceptions import ClientError
-import requests
-from aws_requests_auth.boto_utils import BotoAWSRequestsAuth
+from concurrent.futures import ThreadPoolExecutor
+
+from common import metrics
+from common.aws_clients import aws_client, retry_config
+from common.feedback_schema import max_prompt_chars, max_response_chars
+from common.feedback_sink import FeedbackSink, FeedbackValidationError, build_feedback_record
+from common.ttl_cache import TTLCache
 
 
 logger = logging.getLogger()
-logger.setLevel(logging.ERROR)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+# dimension of the stage timing metrics (see common.metrics)
+function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'businessq_feedback_processor')
+
+# "direct" stores the feedback through the shared feedback sink, "api" posts it to the feedback API
+feedback_sink = os.environ.get('FEEDBACK_SINK', 'direct')
+api_gateway_url = os.environ.get('API_GATEWAY_URL')
+
+# connect and read timeouts of the feedback API call, in seconds
+http_connect_timeout = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3.05'))
+http_read_timeout = float(os.environ.get('HTTP_READ_TIMEOUT', '10'))
+http_max_retries = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+
+# conversations of a queue batch enriched and forwarded in parallel
+batch_concurrency = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+
+# prompt, response and sources of the rated message are looked up with ListMessages
+enrich_messages = os.environ.get('ENRICH_MESSAGES', 'true').lower() == 'true'
+list_messages_page_size = int(os.environ.get('LIST_MESSAGES_PAGE_SIZE', '100'))
+list_messages_max_pages = int(os.environ.get('LIST_MESSAGES_MAX_PAGES', '20'))
+
+# Business Q client, created on first use by invocations that read a conversation
+client = None
+
+# messages of recently rated conversations, so ratings of several messages of a
+# conversation page through it once
+conversation_cache = TTLCache(
+    maxsize=int(os.environ.get('CONVERSATION_CACHE_SIZE', '256')),
+    ttl=int(os.environ.get('CONVERSATION_CACHE_TTL_SECONDS', '300')),
+)
+
+
+# created on first use and shared by the invocations of a warm container
+feedback_api_client = None
+
+
+def get_feedback_api_client():
+    global feedback_api_client
+    if feedback_api_client is None:
+        from common.signed_http import FeedbackApiClient
+        feedback_api_client = FeedbackApiClient(api_gateway_url, os.environ['AWS_REGION'],
+                                                connect_timeout=http_connect_timeout,
+                                                read_timeout=http_read_timeout,
+                                                max_retries=http_max_retries,
+                                                pool_size=batch_concurrency)
+    return feedback_api_client
+
+
+def get_qbusiness_client():
+    global client
+    if client is None:
+        client = aws_client('qbusiness')
+    return client
+
+
+# created on first use and shared by the invocations of a warm container
+sink = None
+
+
+def get_sink():
+    global sink
+    if sink is None:
+        sink = FeedbackSink.from_environment(s3_client=aws_client('s3', config=retry_config()))
+    return sink
+
+
+# in direct mode every invocation writes, so the S3 client is created during init
+if feedback_sink == 'direct':
+    get_sink()
+
+
+class ConversationMessages:
+    # The pages of a conversation read so far, resumed from next_token when a rated
+    # message is not among them yet
+
+    def __init__(self):
+        self.messages = []
+        self.by_id = {}
+        self.next_token = None
+        self.exhausted = False
+        self.pages = 0
+
+    def add_page(self, response):
+        for message in response.get('messages', []):
+            self.messages.append(message)
+            self.by_id[message['messageId']] = message
+        self.next_token = response.get('nextToken')
+        self.exhausted = not self.next_token
+        self.pages += 1
+
+    def prompt_of(self, target):
+        # the latest user message sent before the rated message
+        prompt = None
+        for message in self.messages:
+            if message.get('type') != 'USER' or message['messageId'] == target['messageId']:
+                continue
+            if message.get('time') and target.get('time') and message['time'] > target['time']:
+                continue
+            if prompt is None or (message.get('time') and prompt.get('time') and message['time'] > prompt['time']):
+                prompt = message
+        return prompt
+
+    def resolved(self, message_id):
+        # Pages hold the messages in a fixed order, the prompt can only be on a later page
+        # when none of the user messages read so far precedes the rated one
+        target = self.by_id.get(message_id)
+        return target is not None and (self.exhausted or self.prompt_of(target) is not None)
+
+
+def list_conversation_messages(application_id, conversation_id, user_id, message_id):
+    key = (application_id, conversation_id)
+    conversation = conversation_cache.get(key)
+    if conversation is None or (message_id not in conversation.by_id and conversation.exhausted):
+        # not cached, or the message was posted after the conversation was read
+        conversation = ConversationMessages()
 
-api_gateway_url = os.environ['API_GATEWAY_URL']
+    while not conversation.resolved(message_id) and not conversation.exhausted:
+        if conversation.pages >= list_messages_max_pages:
+            logger.warning("message %s not found in the first %d pages of conversation %s",
+                           message_id, conversation.pages, conversation_id)
+            break
+        params = {
+            'applicationId': application_id,
+            'conversationId': conversation_id,
+            'maxResults': list_messages_page_size,
+        }
+        if user_id:
+            params['userId'] = user_id
+        if conversation.next_token:
+            params['nextToken'] = conversation.next_token
+        with metrics.stage('list_messages'):
+            conversation.add_page(get_qbusiness_client().list_messages(**params))
 
-auth = BotoAWSRequestsAuth(aws_host=urlparse(api_gateway_url).hostname,
-                           aws_region=os.environ['AWS_REGION'],
-                           aws_service='execute-api')
+    conversation_cache.set(key, conversation)
+    return conversation
+
+
+def enrich_feedback(body, application_id, conversation_id, user_id, message_id):
+    # Adds the prompt, the response and its sources to the feedback body. Feedback is
+    # stored without them when the conversation can't be read.
+    from botocore.exceptions import BotoCoreError, ClientError
+    try:
+        conversation = list_conversation_messages(application_id, conversation_id, user_id, message_id)
+    except (BotoCoreError, ClientError) as e:
+        logger.warning("could not read conversation %s: %s", conversation_id, e)
+        return body
+
+    target = conversation.by_id.get(message_id)
+    if target is None:
+        return body
+
+    # long conversation turns are cut to the size caps of the feedback schema instead of
+    # failing the validation
+    body['response'] = target.get('body', "")[:max_response_chars]
+    prompt = conversation.prompt_of(target)
+    if prompt is not None:
+        body['prompt'] = prompt.get('body', "")[:max_prompt_chars]
+    if target.get('sourceAttribution'):
+        body['sourceAttribution'] = json.dumps(target['sourceAttribution'], default=str)
+        body['sourceUrls'] = extract_urls_from_json(body['sourceAttribution'])
+    return body
 
-# Business Q client
-client = boto3.client('qbusiness')
 
-        
 def extract_urls_from_json(data):
     urls = []
     try:
@@ -30,14 +182,21 @@ def extract_urls_from_json(data):
         for item in data:
             urls.append(item['url'])
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.warning("could not read the source urls: %s", e)
     return urls
-    
+
 
 def lambda_handler(event, context):
-    
+    with metrics.invocation(function_name):
+        return handle_feedback_event(event)
+
+
+def feedback_body(event):
+    # Maps a PutFeedback CloudTrail event onto a feedback request body, enriched with the
+    # prompt, response and sources of the rated message
     messageId = str(event["detail"]["requestParameters"]["messageId"])
     applicationId = event["detail"]["requestParameters"]["applicationId"]
+    conversationId = event["detail"]["requestParameters"].get("conversationId")
     usefulness = event["detail"]["requestParameters"]["messageUsefulness"]['usefulness']
     submittedAt = event["detail"]["requestParameters"]["messageUsefulness"]['submittedAt']
     userId = event["detail"]["userIdentity"]["onBehalfOf"]["userId"]
@@ -49,27 +208,130 @@ def lambda_handler(event, context):
         usefulness_comment = ""
 
     # Add message details to the analytics data
-    response_data = json.dumps({
+    body = {
         'interactionId': messageId,
         'appIdentifier': applicationId,
         'feedback': usefulness,
         'comment': usefulness_comment,
         'userId': userId,
         'submittedAt': submittedAt
-    })
-            
-    # create json response payload
-    logger.info(response_data)
-    
-    # invoke api gateway url and make a post request with request data as body
-    logger.info(api_gateway_url)
-    
-    logger.debug("Posting feedback to api endpoint for message: " + messageId)
-    
+    }
+
+    if enrich_messages and conversationId:
+        with metrics.stage('enrich'):
+            enrich_feedback(body, applicationId, conversationId, userId, messageId)
+    return body
+
+
+def post_feedback(body):
+    with metrics.stage('serialize'):
+        response_data = json.dumps(body)
+
+    # payloads carry prompts and responses, they are only formatted when debug logging is enabled
+    logger.debug("posting feedback for message %s to %s: %s", body['interactionId'], api_gateway_url, response_data)
+
     # send post request to api gateway url with request data as body
-    response = requests.post(api_gateway_url, data=response_data,auth=auth)
+    with metrics.stage('http_post'):
+        response = get_feedback_api_client().post(response_data)
+    if response.status_code >= 400:
+        # rejected for good (the retryable statuses raise), retrying doesn't change the answer
+        logger.error("feedback for message %s was rejected by the feedback API with %s: %s",
+                     body['interactionId'], response.status_code, response.text)
+    return response, response_data
+
 
+def handle_feedback_event(event):
+    body = feedback_body(event)
+
+    if feedback_sink == 'direct':
+        # same validation and record layout as the feedback API, without the HTTP round trip
+        try:
+            with metrics.stage('validate'):
+                record = build_feedback_record(body)
+        except FeedbackValidationError as e:
+            logger.error("feedback for message %s was not stored: %s", body['interactionId'], e)
+            return {
+                'statusCode': 400,
+                'body': str(e)
+            }
+        return {
+            'statusCode': 200,
+            'body': get_sink().write_record(record)
+        }
+
+    response, response_data = post_feedback(body)
     return {
-        'statusCode': 200,
+        'statusCode': response.status_code,
         'body': response_data
-    }
\ No newline at end of file
+    }
+
+
+def sqs_batch_handler(event, context):
+    with metrics.invocation(function_name):
+        return handle_sqs_batch(event)
+
+
+def conversation_of(feedback_event):
+    # events of one conversation are processed in order by one worker, so the conversation
+    # is read once and its cached pages are reused
+    parameters = feedback_event["detail"]["requestParameters"]
+    return parameters["applicationId"], parameters.get("conversationId") or parameters["messageId"]
+
+
+def process_conversation(items):
+    # Enriches the events of a conversation and, with the api sink, posts them. Returns the
+    # (message id, record) pairs to store and the ids of the messages that failed. Events
+    # the API rejects with a 4xx are dropped like invalid events in direct mode.
+    records = []
+    failed_message_ids = []
+    for message_id, feedback_event in items:
+        try:
+            body = feedback_body(feedback_event)
+            if feedback_sink == 'direct':
+                with metrics.stage('validate'):
+                    records.append((message_id, build_feedback_record(body)))
+            else:
+                post_feedback(body)
+        except FeedbackValidationError as e:
+            # retrying doesn't make the event valid, it is dropped like a single event is
+            logger.error("feedback of message %s was not stored: %s", message_id, e)
+        except Exception:
+            logger.exception("feedback of message %s failed", message_id)
+            failed_message_ids.append(message_id)
+    return records, failed_message_ids
+
+
+def handle_sqs_batch(event):
+    # Queue consumer: every SQS message carries one PutFeedback event delivered by
+    # EventBridge. Conversations are enriched (and posted) concurrently by up to
+    # BATCH_CONCURRENCY workers, the direct sink stores the records of the batch together.
+    # Messages that fail are returned as batch item failures so only they are retried.
+    failed_message_ids = []
+    conversations = {}
+    for message in event['Records']:
+        try:
+            feedback_event = json.loads(message['body'])
+            key = conversation_of(feedback_event)
+        except (ValueError, KeyError, TypeError):
+            logger.error("message %s does not contain a PutFeedback event", message['messageId'])
+            failed_message_ids.append(message['messageId'])
+            continue
+        conversations.setdefault(key, []).append((message['messageId'], feedback_event))
+
+    records = []
+    workers = min(batch_concurrency, len(conversations)) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for conversation_records, conversation_failures in executor.map(process_conversation, conversations.values()):
+            records.extend(conversation_records)
+            failed_message_ids.extend(conversation_failures)
+
+    if records:
+        try:
+            get_sink().write_batch([record for _, record in records])
+        except Exception:
+            logger.exception("failed to write %d records", len(records))
+            failed_message_ids.extend(message_id for message_id, _ in records)
+
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote_plus
+
+from common.comment_index import DEFAULT_FIELDS, DEFAULT_NEGATIVE_FEEDBACK, CommentIndex
+from common.feedback_layout import is_hidden, is_in_place_part, read_records
+from common.feedback_sink import FeedbackSink
+from common.object_store import S3ObjectStore
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+# tables whose new objects are indexed, compacted generations (hidden) only repeat them
+SOURCE_TABLES = ('feedback', 'feedback_parquet')
+# record attributes indexed besides the comment, e.g. "comment,prompt"
+index_fields = os.environ.get('INDEX_FIELDS', ','.join(DEFAULT_FIELDS)).split(',')
+negative_feedback = os.environ.get('NEGATIVE_FEEDBACK', ','.join(DEFAULT_NEGATIVE_FEEDBACK)).split(',')
+# closed days whose segments a scheduled run merges, starting with yesterday
+merge_lookback_days = int(os.environ.get('MERGE_LOOKBACK_DAYS', '7'))
+
+sink = None
+index = None
+
+
+def get_index():
+    global sink, index
+    if index is None:
+        sink = FeedbackSink.from_environment()
+        index = CommentIndex(
+            S3ObjectStore(sink.bucket, client=sink.s3),
+            sink.glue_database_name,
+            partition_scheme=sink.partition_scheme,
+            fields=index_fields,
+            negative_feedback=negative_feedback,
+            compression=sink.compression,
+            max_lateness_days=sink.max_lateness.days,
+        )
+    return index
+
+
+def source_of(glue_database_name, key):
+    # Returns the table of a new data object, or None for objects that are not indexed
+    parts = key.split('/')
+    if len(parts) < 3 or parts[0] != glue_database_name or parts[1] not in SOURCE_TABLES:
+        return None
+    # compacted files only repeat records of objects that were already notified
+    if is_hidden(f'{parts[0]}/{parts[1]}/', key) or is_in_place_part(key):
+        return None
+    return parts[1]
+
+
+def object_keys(event):
+    # S3 notifications are delivered through SNS, one S3 event per SNS record
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        for s3_record in message.get('Records', []):
+            yield unquote_plus(s3_record['s3']['object']['key'])
+
+
+def lambda_handler(event, context):
+    comment_index = get_index()
+
+    # the scheduled run merges the segments of the last closed days, {"merge": "YYYY-MM-DD"}
+    # merges a single day
+    if event and event.get('merge'):
+        if event['merge'] is True:
+            today = datetime.now(timezone.utc).date()
+            days = [today - timedelta(days=offset) for offset in range(1, merge_lookback_days + 1)]
+        else:
+            days = [datetime.strptime(event['merge'], '%Y-%m-%d').date()]
+        merged = [key for key in map(comment_index.merge_day, days) if key]
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'merged': merged})
+        }
+
+    segments = []
+    for key in object_keys(event):
+        if source_of(comment_index.glue_database_name, key):
+            segments.extend(comment_index.add_records(read_records(key, comment_index.store.get(key)), key))
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'segments': len(segments)})
+    }
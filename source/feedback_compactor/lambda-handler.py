@@ -0,0 +1,356 @@
+import argparse
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from common import feedback_layout
+from common.aws_clients import aws_client
+from common.compression import compress, decompress, extension as compression_extension
+from common.feedback_layout import (
+    GENERATIONS_DIR, in_place_key, is_hidden, is_in_place_part, load_manifest, partition_values, read_records,
+    save_manifest,
+)
+from common.object_store import LocalObjectStore, S3ObjectStore
+from common.parquet_writer import to_parquet_bytes
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+# A day is closed, and safe to compact, once no record can be written to it anymore: records
+# submitted up to MAX_LATENESS_DAYS before they arrive are stored in their submittedAt partition
+closed_after_days = int(os.environ.get('CLOSED_AFTER_DAYS', int(os.environ.get('MAX_LATENESS_DAYS', '7')) + 1))
+# number of closed days that are checked on each scheduled run
+lookback_days = int(os.environ.get('LOOKBACK_DAYS', '7'))
+target_file_bytes = int(os.environ.get('TARGET_FILE_SIZE_MB', '128')) * 1024 * 1024
+# originals are moved below this prefix instead of being deleted when set
+archive_prefix = os.environ.get('ARCHIVE_PREFIX', '')
+# replaced objects are deleted this long after the switch, so queries reading them can finish
+retire_after = timedelta(minutes=int(os.environ.get('RETIRE_AFTER_MINUTES', '60')))
+read_concurrency = int(os.environ.get('READ_CONCURRENCY', '32'))
+# "parquet" rewrites the JSON day partitions into the feedback_parquet table
+output_format = os.environ.get('OUTPUT_FORMAT', 'json')
+parquet_compression = os.environ.get('PARQUET_COMPRESSION', 'snappy')
+# compression of the JSON parts, sources of any compression are read
+output_compression = os.environ.get('OUTPUT_COMPRESSION', 'none')
+# partition columns of the feedback layout, any of app, year, month, day and hour
+partition_scheme = os.environ.get('PARTITION_SCHEME', 'year,month,day').split(',')
+# "events" switches the registered Glue partitions to a new generation, "projection"
+# publishes it in place, projected partitions are always read from the layout
+partition_registration = os.environ.get('PARTITION_REGISTRATION', 'projection')
+
+
+class GlueCatalog:
+    # Points partitions of the feedback tables at a location of the data bucket
+
+    def __init__(self, client, bucket, glue_database_name):
+        self.client = client
+        self.bucket = bucket
+        self.glue_database_name = glue_database_name
+
+    def switch_location(self, prefix, location):
+        table_name = prefix.split('/')[1]
+        table = self.client.get_table(DatabaseName=self.glue_database_name, Name=table_name)['Table']
+        values = partition_values(prefix)
+        partition_input = {
+            'Values': [values[column['Name']] for column in table['PartitionKeys']],
+            'StorageDescriptor': dict(table['StorageDescriptor'], Location=f's3://{self.bucket}/{location}'),
+        }
+        try:
+            self.client.update_partition(DatabaseName=self.glue_database_name, TableName=table_name,
+                                         PartitionValueList=partition_input['Values'],
+                                         PartitionInput=partition_input)
+        except self.client.exceptions.EntityNotFoundException:
+            try:
+                self.client.create_partition(DatabaseName=self.glue_database_name, TableName=table_name,
+                                             PartitionInput=partition_input)
+            except self.client.exceptions.AlreadyExistsException:
+                # registered by the partition registrar in the meantime
+                self.client.update_partition(DatabaseName=self.glue_database_name, TableName=table_name,
+                                             PartitionValueList=partition_input['Values'],
+                                             PartitionInput=partition_input)
+
+
+def day_partitions(store, glue_database_name, day):
+    return feedback_layout.day_partitions(store, glue_database_name, day, partition_scheme)
+
+
+def read_lines(body):
+    # Feedback objects hold one record (single line JSON) or NDJSON. Anything that
+    # is not line oriented is re-serialized so every output line is one record.
+    # Returns (line, record id) pairs, records written before record ids existed are
+    # identified by their content.
+    text = body.decode('utf-8')
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    try:
+        records = [json.loads(line) for line in lines]
+    except json.JSONDecodeError:
+        record = json.loads(text)
+        lines, records = [json.dumps(record)], [record]
+    return [
+        (line, record.get('recordId', line) if isinstance(record, dict) else line)
+        for line, record in zip(lines, records)
+    ]
+
+
+def read_source(store, key):
+    # (line, record id) pairs of a JSON or Parquet object
+    body = store.get(key)
+    if key.endswith('.parquet'):
+        return [(line, record.get('recordId') or line)
+                for record in read_records(key, body) for line in [json.dumps(record)]]
+    return read_lines(decompress(key, body))
+
+
+def parquet_prefix(prefix):
+    return prefix.replace('/feedback/', '/feedback_parquet/', 1)
+
+
+def generation_location(prefix, run_id):
+    return f'{prefix}{GENERATIONS_DIR}/{run_id}/'
+
+
+def current_generation(manifest):
+    # parts of the generation a committed run published, manifests of the earlier in place
+    # compaction have none: their outputs are objects of the partition
+    return manifest.get('parts', []) if manifest else []
+
+
+def write_generation(store, location, sources, output_format='json', compression='none'):
+    # Merges the source objects into parts of roughly target_file_bytes below the location of
+    # the new generation. Returns the part keys, the number of records and of duplicates.
+    extension = 'parquet' if output_format == 'parquet' else 'json' + compression_extension(compression)
+    parts = []
+    part = []
+    part_bytes = 0
+    record_count = 0
+    duplicates = 0
+    # a record delivered more than once is kept once per generation
+    seen = set()
+
+    def flush():
+        key = f'{location}part-{len(parts):05d}.{extension}'
+        if output_format == 'parquet':
+            body = to_parquet_bytes([json.loads(line) for line in part], compression=parquet_compression)
+            store.put(key, body, ContentType='application/octet-stream')
+        else:
+            body = '\n'.join(part) + '\n'
+            if compression != 'none':
+                body = compress(body, compression)
+            store.put(key, body, ContentType='application/json')
+        parts.append(key)
+
+    with ThreadPoolExecutor(max_workers=read_concurrency) as executor:
+        for lines in executor.map(lambda key: read_source(store, key), sources):
+            for line, record_id in lines:
+                if record_id in seen:
+                    duplicates += 1
+                    continue
+                seen.add(record_id)
+                part.append(line)
+                part_bytes += len(line) + 1
+                record_count += 1
+                if part_bytes >= target_file_bytes:
+                    flush()
+                    part = []
+                    part_bytes = 0
+    if part:
+        flush()
+    return parts, record_count, duplicates
+
+
+def commit_partition(store, catalog, prefix, manifest):
+    # Rolls a run forward from the state its manifest recorded, so an interrupted run is
+    # completed by the next one. Publishing is a single switch for each kind of reader: the
+    # catalog points the partition at the new generation for Athena, and the published
+    # manifest does the same for the readers of the bucket (see feedback_layout). The
+    # replaced objects are retired once retire_after has passed.
+    # A run published in place copies its parts into the partition and retires the replaced
+    # objects right away. Athena reads the records of both only while the parts are copied;
+    # a query running then may count a record twice or fail on a retired object.
+    now = datetime.now(timezone.utc)
+    in_place = manifest.get('inPlace', False)
+    if manifest['state'] == 'staged':
+        if in_place:
+            parts = [in_place_key(prefix, key) for key in manifest['parts']]
+            for key, part in zip(manifest['parts'], parts):
+                store.copy(key, part)
+            manifest['parts'] = parts
+        elif catalog is not None:
+            catalog.switch_location(prefix, manifest['location'])
+        manifest['state'] = 'published'
+        manifest['publishedAt'] = now.isoformat()
+        save_manifest(store, prefix, manifest)
+
+    if manifest['state'] == 'published' and (in_place or now - datetime.fromisoformat(manifest['publishedAt']) >= retire_after):
+        if archive_prefix:
+            for key in manifest['sources']:
+                store.copy(key, archive_prefix.rstrip('/') + '/' + key)
+        # the previous generations and the parts of runs interrupted before their manifest,
+        # in place the staged generation too, its parts were copied into the partition
+        generations = [
+            key for key, _ in store.list_objects(f'{prefix}{GENERATIONS_DIR}/')
+            if in_place or not key.startswith(manifest['location'])
+        ]
+        previous = manifest['previous'] if in_place else []
+        store.delete(manifest['sources'] + previous + generations)
+        manifest['state'] = 'committed'
+        manifest['committedAt'] = now.isoformat()
+        save_manifest(store, prefix, manifest)
+
+    return manifest
+
+
+def staged_manifest(prefix, run_id, parts, sources, previous, in_place=False):
+    return {
+        'runId': run_id,
+        'state': 'staged',
+        'createdAt': datetime.now(timezone.utc).isoformat(),
+        'location': generation_location(prefix, run_id),
+        'parts': parts,
+        # objects of the partition merged into the generation, retired with the previous one
+        'sources': sources,
+        'previous': current_generation(previous),
+        'inPlace': in_place,
+    }
+
+
+def compact_partition(store, catalog, prefix, output_format='json', compression='none', in_place=False):
+    # Merges the current generation and the objects of a JSON partition into a new
+    # generation. With output_format parquet the generation is written to the
+    # feedback_parquet partition of the day, together with its own objects, and the JSON
+    # partition is switched to an empty generation. With in_place the generation is
+    # published in place instead of by the catalog. Returns the manifest of the run,
+    # None when there is nothing to compact or the previous run is not retired yet.
+    target = parquet_prefix(prefix) if output_format == 'parquet' else prefix
+    prefixes = [target, prefix] if target != prefix else [prefix]
+
+    manifests = {}
+    for partition in prefixes:
+        manifest = load_manifest(store, partition)
+        if manifest is not None and 'location' not in manifest:
+            # a run of the earlier in place compaction: its outputs and any sources it left
+            # are objects of the partition and merged again, duplicates are dropped
+            manifest = None
+        if manifest and manifest['state'] != 'committed':
+            logger.warning("resuming compaction run %s of %s", manifest['runId'], partition)
+            commit_partition(store, catalog, partition, manifest)
+            if manifest['state'] != 'committed':
+                return None
+        manifests[partition] = manifest
+
+    objects = {
+        partition: [key for key, _ in store.list_objects(partition)
+                    if not is_hidden(partition, key) and not is_in_place_part(key)]
+        for partition in prefixes
+    }
+    if output_format == 'parquet':
+        # every JSON record of the day moves into the feedback_parquet table
+        if not objects[prefix] and not current_generation(manifests[prefix]):
+            return None
+    elif not objects[prefix] or (len(objects[prefix]) < 2 and not current_generation(manifests[prefix])):
+        return None
+
+    run_id = f'{datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")}-{uuid.uuid4().hex[:8]}'
+    sources = [key for partition in prefixes for key in current_generation(manifests[partition]) + objects[partition]]
+    parts, record_count, duplicates = write_generation(
+        store, generation_location(target, run_id), sources, output_format, compression)
+    runs = [(partition, staged_manifest(partition, run_id, parts if partition == target else [],
+                                        objects[partition], manifests[partition], in_place))
+            for partition in prefixes]
+    result = runs[0][1]
+    result.update(records=record_count, duplicates=duplicates, inputs=len(sources))
+
+    # the manifests are written before anything visible changes, they are the commit records.
+    # The feedback_parquet partition is switched first, so the records of the day are
+    # briefly read from both tables rather than from neither.
+    for partition, manifest in runs:
+        save_manifest(store, partition, manifest)
+    for partition, manifest in runs:
+        commit_partition(store, catalog, partition, manifest)
+    return result
+
+
+def closed_days(today):
+    last_closed = today - timedelta(days=closed_after_days)
+    return [last_closed - timedelta(days=offset) for offset in range(lookback_days)]
+
+
+def lambda_handler(event, context):
+    store = S3ObjectStore(os.environ['S3_DATA_BUCKET'])
+    glue_database_name = os.environ['GLUE_DATABASE_NAME']
+    in_place = partition_registration == 'projection'
+    catalog = None if in_place else GlueCatalog(aws_client('glue'), store.bucket, glue_database_name)
+
+    # a specific day can be compacted by invoking the function with {"day": "YYYY-MM-DD"}
+    if event and event.get('day'):
+        days = [datetime.strptime(event['day'], '%Y-%m-%d').date()]
+    else:
+        days = closed_days(datetime.now(timezone.utc).date())
+
+    results = []
+    for day in days:
+        for prefix in day_partitions(store, glue_database_name, day):
+            manifest = compact_partition(store, catalog, prefix, output_format, output_compression, in_place)
+            if manifest:
+                results.append({
+                    'partition': prefix,
+                    'sources': manifest['inputs'],
+                    'outputs': len(manifest['parts']),
+                    'records': manifest['records'],
+                    'duplicates': manifest.get('duplicates', 0),
+                })
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(results)
+    }
+
+
+def main():
+    global retire_after
+    parser = argparse.ArgumentParser(description='Compact closed feedback day partitions.')
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--root', help='local directory that mirrors the data bucket')
+    location.add_argument('--bucket', help='data bucket name')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. a local stand-in')
+    parser.add_argument('--database', required=True, help='glue database name, the top level prefix')
+    parser.add_argument('--day', action='append', help='day to compact (YYYY-MM-DD), repeatable')
+    parser.add_argument('--format', choices=['json', 'parquet'], default=output_format,
+                        help='output format, parquet rewrites the days into the feedback_parquet table')
+    parser.add_argument('--compression', choices=['none', 'gzip', 'zstd'], default=output_compression,
+                        help='compression of the JSON parts')
+    parser.add_argument('--retire-after-minutes', type=int, default=int(retire_after.total_seconds() // 60),
+                        help='delete the replaced objects once the switch is this old, 0 within the run')
+    parser.add_argument('--partition-registration', choices=['projection', 'events'], default=partition_registration,
+                        help='projection publishes the compacted files in place, events switches the Glue partitions')
+    parser.add_argument('--no-catalog', action='store_true',
+                        help="don't switch the Glue partitions, only the manifests (implied by --root and --endpoint-url)")
+    args = parser.parse_args()
+
+    retire_after = timedelta(minutes=args.retire_after_minutes)
+    store = LocalObjectStore(args.root) if args.root else S3ObjectStore(args.bucket, endpoint_url=args.endpoint_url)
+    in_place = args.partition_registration == 'projection'
+    catalog = None
+    if not (in_place or args.root or args.endpoint_url or args.no_catalog):
+        catalog = GlueCatalog(aws_client('glue'), args.bucket, args.database)
+    if args.day:
+        days = [datetime.strptime(day, '%Y-%m-%d').date() for day in args.day]
+    else:
+        days = closed_days(datetime.now(timezone.utc).date())
+
+    for day in days:
+        for prefix in day_partitions(store, args.database, day):
+            manifest = compact_partition(store, catalog, prefix, args.format, args.compression, in_place)
+            if manifest:
+                print(f"{prefix}: {manifest['inputs']} objects -> {len(manifest['parts'])} files, "
+                      f"{manifest['records']} records, {manifest.get('duplicates', 0)} duplicates dropped")
+            else:
+                print(f"{prefix}: nothing to compact")
+
+
+if __name__ == '__main__':
+    main()
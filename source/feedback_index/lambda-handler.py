@@ -0,0 +1,113 @@
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+from urllib.parse import unquote_plus
+
+from common.feedback_index import FeedbackIndex
+from common.feedback_layout import day_partitions, is_hidden, is_in_place_part, partition_objects, read_records
+from common.feedback_sink import DEFAULT_PARTITION_SCHEME, FeedbackSink
+from common.object_store import LocalObjectStore, S3ObjectStore
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+# tables whose new objects are indexed, compacted generations (hidden) only repeat them
+SOURCE_TABLES = ('feedback', 'feedback_parquet')
+# conditional write attempts per index object before giving up, concurrent updates retry
+max_attempts = int(os.environ.get('INDEX_MAX_ATTEMPTS', '10'))
+
+index = None
+
+
+def get_index():
+    global index
+    if index is None:
+        sink = FeedbackSink.from_environment()
+        index = FeedbackIndex(
+            S3ObjectStore(sink.bucket, client=sink.s3),
+            sink.glue_database_name,
+            partition_scheme=sink.partition_scheme,
+            max_lateness_days=sink.max_lateness.days,
+            max_attempts=max_attempts,
+        )
+    return index
+
+
+def source_of(glue_database_name, key):
+    # Returns the table of a new data object, or None for objects that are not indexed
+    parts = key.split('/')
+    if len(parts) < 3 or parts[0] != glue_database_name or parts[1] not in SOURCE_TABLES:
+        return None
+    # compacted files only repeat records of objects that were already notified
+    if is_hidden(f'{parts[0]}/{parts[1]}/', key) or is_in_place_part(key):
+        return None
+    return parts[1]
+
+
+def object_keys(event):
+    # S3 notifications are delivered through SNS, one S3 event per SNS record
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        for s3_record in message.get('Records', []):
+            yield unquote_plus(s3_record['s3']['object']['key'])
+
+
+def rebuild_day(feedback_index, day):
+    # Reindexes a day from the partitions of both tables and replaces its index objects.
+    # While a Parquet compaction is published in one table and not yet in the other,
+    # records are read twice and the record ids dedupe them.
+    store = feedback_index.store
+    records = []
+    for table in SOURCE_TABLES:
+        for prefix in day_partitions(store, feedback_index.glue_database_name, day,
+                                     feedback_index.sink.partition_scheme, table):
+            for key in partition_objects(store, prefix):
+                records.extend((record, key) for record in read_records(key, store.get(key)))
+    return feedback_index.add_records(records, replace=True)
+
+
+def lambda_handler(event, context):
+    feedback_index = get_index()
+
+    # the index of a day is rebuilt by invoking the function with {"rebuild": "YYYY-MM-DD"}
+    if event and event.get('rebuild'):
+        day = datetime.strptime(event['rebuild'], '%Y-%m-%d').date()
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'indexed': rebuild_day(feedback_index, day)})
+        }
+
+    records = []
+    for key in object_keys(event):
+        if source_of(feedback_index.glue_database_name, key):
+            records.extend((record, key) for record in read_records(key, feedback_index.store.get(key)))
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'records': len(records), 'added': feedback_index.add_records(records)})
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the feedback read index of days from the raw partitions.')
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--root', help='local directory that mirrors the data bucket')
+    location.add_argument('--bucket', help='data bucket name')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. a local stand-in')
+    parser.add_argument('--database', required=True, help='glue database name, the top level prefix')
+    parser.add_argument('--day', action='append', required=True, help='day to rebuild (YYYY-MM-DD), repeatable')
+    parser.add_argument('--partition-scheme', default=os.environ.get('PARTITION_SCHEME', ','.join(DEFAULT_PARTITION_SCHEME)),
+                        help='partition columns of the feedback layout')
+    args = parser.parse_args()
+
+    store = LocalObjectStore(args.root) if args.root else S3ObjectStore(args.bucket, endpoint_url=args.endpoint_url)
+    feedback_index = FeedbackIndex(store, args.database, partition_scheme=args.partition_scheme.split(','))
+    for day in args.day:
+        indexed = rebuild_day(feedback_index, datetime.strptime(day, '%Y-%m-%d').date())
+        print(f"{day}: {indexed} records indexed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from common import metrics
+from common.feedback_index import FeedbackIndex
+from common.feedback_sink import FeedbackSink, parse_timestamp
+from common.object_store import S3ObjectStore
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+# dimension of the stage timing metrics (see common.metrics)
+function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'feedback_reader')
+
+# range of a request without a start, and the longest range a request may ask for
+default_range_days = int(os.environ.get('DEFAULT_RANGE_DAYS', '7'))
+max_range_days = int(os.environ.get('MAX_RANGE_DAYS', '31'))
+default_page_size = int(os.environ.get('PAGE_SIZE', '50'))
+max_page_size = int(os.environ.get('MAX_PAGE_SIZE', '500'))
+
+# every invocation reads the index, the S3 client is created during init
+sink = FeedbackSink.from_environment()
+index = FeedbackIndex(
+    S3ObjectStore(sink.bucket, client=sink.s3),
+    sink.glue_database_name,
+    partition_scheme=sink.partition_scheme,
+    max_lateness_days=sink.max_lateness.days,
+    cache_ttl=int(os.environ.get('INDEX_CACHE_TTL_SECONDS', '5')),
+)
+
+
+def error_response(message):
+    return {
+        'statusCode': 400,
+        'headers': {
+            'Content-Type': '*/*'
+        },
+        'body': message
+    }
+
+
+def parse_time_parameter(params, name, default):
+    if not params.get(name):
+        return default
+    value = parse_timestamp(params[name])
+    if value is None:
+        raise ValueError(f"Error: parameter {name} is not a valid timestamp")
+    return value
+
+
+def lambda_handler(event, context):
+    with metrics.invocation(function_name):
+        return handle_request(event)
+
+
+def handle_request(event):
+    # GET /feedback?appIdentifier=<app>&start=<time>&end=<time>&feedback=<value>,...&limit=<n>&cursor=<cursor>
+    # Times are ISO 8601 or epoch seconds, the range defaults to the last DEFAULT_RANGE_DAYS days.
+    # The response lists the records newest first and holds the cursor of the next page.
+    params = event.get('queryStringParameters') or {}
+    app = params.get('appIdentifier')
+    if not app:
+        return error_response("Error: parameter appIdentifier is a required parameter")
+    try:
+        limit = int(params.get('limit') or default_page_size)
+    except ValueError:
+        return error_response("Error: parameter limit must be a number")
+    feedback = [value for value in (params.get('feedback') or '').split(',') if value]
+    try:
+        end = parse_time_parameter(params, 'end', datetime.now(timezone.utc))
+        start = parse_time_parameter(params, 'start', end - timedelta(days=default_range_days))
+        if start >= end:
+            raise ValueError("Error: start must be before end")
+        if end - start > timedelta(days=max_range_days):
+            raise ValueError(f"Error: the time range is limited to {max_range_days} days")
+        if not 0 < limit <= max_page_size:
+            raise ValueError(f"Error: limit must be between 1 and {max_page_size}")
+        with metrics.stage('read_index'):
+            entries, cursor = index.page(app, start, end, feedback=feedback, limit=limit,
+                                         cursor=params.get('cursor'),
+                                         max_range=timedelta(days=max_range_days))
+    except ValueError as e:
+        return error_response(str(e))
+
+    metrics.count('records', len(entries))
+    items = [
+        dict({name: value for name, value in entry.items() if name != 'time'}, appIdentifier=app)
+        for entry in entries
+    ]
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps({'items': items, 'nextCursor': cursor}, ensure_ascii=False)
+    }
@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote_plus
+
+from common.feedback_layout import day_partitions, is_hidden, is_in_place_part, partition_objects, read_records
+from common.feedback_sink import DEFAULT_PARTITION_SCHEME, FeedbackSink
+from common.object_store import LocalObjectStore, S3ObjectStore
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+# Pre-aggregated feedback counts per app and day, one small JSON object per app and day:
+#   {glue_database_name}/feedback_rollups/day=YYYY-MM-DD/app={appIdentifier}.json
+#   {"app": ..., "day": ..., "records": 3, "totals": {"thumbs_up": 2, ...},
+#    "comments": {"thumbs_down": 1, ...},
+#    "hours": {"09": {"totals": {"thumbs_up": 1, ...}, "comments": {...}}, ...},
+#    "ids": ["3f2a9c...", ...], "updatedAt": ...}
+# comments counts the records with a comment per feedback value. Records are counted in the
+# hour of their partition (see FeedbackSink.partition_time), so the rollups of a day can
+# always be rebuilt from the partitions of that day. ids holds the tokens of the counted
+# records and is written by the same conditional write as the counts, so a record is counted
+# once however many objects hold it or notifications announce them.
+ROLLUP_TABLE = 'feedback_rollups'
+# tables whose new objects are counted, compacted generations (hidden) only repeat them
+SOURCE_TABLES = ('feedback', 'feedback_parquet')
+# hex digits of a record token, 64 bits tell the records of an app and day apart
+TOKEN_LENGTH = 16
+# conditional write attempts per rollup before giving up, concurrent updates retry
+max_attempts = int(os.environ.get('ROLLUP_MAX_ATTEMPTS', '10'))
+
+
+def record_token(record):
+    # Records are counted once per recordId, records written before record ids existed
+    # are identified by content
+    record_id = record.get('recordId')
+    if not record_id:
+        record_id = hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return record_id[:TOKEN_LENGTH]
+
+
+def rollup_key(glue_database_name, app, day):
+    return f"{glue_database_name}/{ROLLUP_TABLE}/day={day}/app={quote(str(app), safe='')}.json"
+
+
+def empty_rollup(app, day):
+    return {'app': app, 'day': day, 'records': 0, 'totals': {}, 'comments': {}, 'hours': {}, 'ids': []}
+
+
+def upgrade_rollup(rollup):
+    # Rollups written before the comment counters kept the full ids of the counted records
+    # and the totals of each hour directly; their comments are counted from the next rebuild.
+    # Rollups written while objects were claimed by markers kept no ids: a record they
+    # counted is counted again when it is delivered again, until the day is rebuilt.
+    record_ids = rollup.pop('recordIds', None)
+    if record_ids is not None:
+        rollup['comments'] = {}
+        rollup['hours'] = {hour: {'totals': counts, 'comments': {}} for hour, counts in rollup['hours'].items()}
+        rollup['ids'] = [record_id[:TOKEN_LENGTH] for record_id in record_ids]
+    rollup.setdefault('ids', [])
+    return rollup
+
+
+def has_comment(record):
+    return isinstance(record.get('comment'), str) and bool(record['comment'].strip())
+
+
+def merge_records(rollup, records):
+    # Adds the (record, partition time) pairs not counted yet to the counts of the rollup.
+    # Returns the number of records added.
+    counted = set(rollup['ids'])
+    added = 0
+    for record, time in records:
+        token = record_token(record)
+        if token in counted:
+            continue
+        counted.add(token)
+        rollup['ids'].append(token)
+        added += 1
+        value = str(record.get('feedback'))
+        hour = rollup['hours'].setdefault(f'{time:%H}', {'totals': {}, 'comments': {}})
+        counters = [rollup['totals'], hour['totals']]
+        if has_comment(record):
+            counters += [rollup['comments'], hour['comments']]
+        for counts in counters:
+            counts[value] = counts.get(value, 0) + 1
+    rollup['records'] += added
+    return added
+
+
+def group_records(records):
+    # Groups (record, partition time) pairs by the app and day of their rollup
+    groups = {}
+    for record, time in records:
+        groups.setdefault((str(record['appIdentifier']), f'{time:%Y-%m-%d}'), []).append((record, time))
+    return groups
+
+
+def update_rollup(store, glue_database_name, app, day, records, replace=False):
+    # Read, merge and conditionally write back; a concurrent update fails the write and
+    # the merge is repeated on the new version. replace discards the stored counts.
+    # Returns the number of records added, a rollup that counted them all is not written.
+    key = rollup_key(glue_database_name, app, day)
+    for _ in range(max_attempts):
+        body, etag = store.get_with_etag(key)
+        rollup = empty_rollup(app, day) if body is None or replace else upgrade_rollup(json.loads(body))
+        added = merge_records(rollup, records)
+        if not added and not replace:
+            return 0
+        rollup['updatedAt'] = datetime.now(timezone.utc).isoformat()
+        if store.put_if_match(key, json.dumps(rollup), etag, ContentType='application/json'):
+            return added
+    raise RuntimeError(f"rollup {key} changed {max_attempts} times during the update")
+
+
+def source_of(glue_database_name, key):
+    # Returns the table of a new data object, or None for objects that are not counted
+    parts = key.split('/')
+    if len(parts) < 3 or parts[0] != glue_database_name or parts[1] not in SOURCE_TABLES:
+        return None
+    # compacted files only repeat records of objects that were already notified
+    if is_hidden(f'{parts[0]}/{parts[1]}/', key) or is_in_place_part(key):
+        return None
+    return parts[1]
+
+
+def object_keys(event):
+    # S3 notifications are delivered through SNS, one S3 event per SNS record
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        for s3_record in message.get('Records', []):
+            yield unquote_plus(s3_record['s3']['object']['key'])
+
+
+def rebuild_day(store, glue_database_name, day, sink):
+    # Recounts a day from the partitions of both tables and replaces its rollups. Records
+    # read twice, while a Parquet compaction is published in one table and not yet in the
+    # other, are counted once.
+    records = []
+    for table in SOURCE_TABLES:
+        for prefix in day_partitions(store, glue_database_name, day, sink.partition_scheme, table):
+            for key in partition_objects(store, prefix):
+                for record in read_records(key, store.get(key)):
+                    records.append((record, sink.partition_time(record, key)))
+    # returns the number of records counted per (app, day)
+    return {
+        group: update_rollup(store, glue_database_name, *group, app_records, replace=True)
+        for group, app_records in group_records(records).items()
+    }
+
+
+def lambda_handler(event, context):
+    sink = FeedbackSink.from_environment()
+    store = S3ObjectStore(sink.bucket, client=sink.s3)
+
+    # the rollups of a day are rebuilt by invoking the function with {"rebuild": "YYYY-MM-DD"}
+    if event and event.get('rebuild'):
+        day = datetime.strptime(event['rebuild'], '%Y-%m-%d').date()
+        groups = rebuild_day(store, sink.glue_database_name, day, sink)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'rebuilt': len(groups)})
+        }
+
+    records = 0
+    added = 0
+    for key in object_keys(event):
+        if not source_of(sink.glue_database_name, key):
+            continue
+        object_records = read_records(key, store.get(key))
+        records += len(object_records)
+        times = [(record, sink.partition_time(record, key)) for record in object_records]
+        for (app, day), app_records in group_records(times).items():
+            added += update_rollup(store, sink.glue_database_name, app, day, app_records)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'records': records, 'added': added})
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the feedback rollups of days from the raw partitions.')
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--root', help='local directory that mirrors the data bucket')
+    location.add_argument('--bucket', help='data bucket name')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. a local stand-in')
+    parser.add_argument('--database', required=True, help='glue database name, the top level prefix')
+    parser.add_argument('--day', action='append', required=True, help='day to rebuild (YYYY-MM-DD), repeatable')
+    parser.add_argument('--partition-scheme', default=os.environ.get('PARTITION_SCHEME', ','.join(DEFAULT_PARTITION_SCHEME)),
+                        help='partition columns of the feedback layout')
+    args = parser.parse_args()
+
+    store = LocalObjectStore(args.root) if args.root else S3ObjectStore(args.bucket, endpoint_url=args.endpoint_url)
+    sink = FeedbackSink(args.bucket, args.database, partition_scheme=args.partition_scheme.split(','))
+    for day in args.day:
+        groups = rebuild_day(store, args.database, datetime.strptime(day, '%Y-%m-%d').date(), sink)
+        for (app, record_day), count in sorted(groups.items()):
+            print(f"{rollup_key(args.database, app, record_day)}: {count} records")
+        if not groups:
+            print(f"{day}: no records")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from common.aws_clients import aws_client
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+athena = aws_client('athena')
+glue = aws_client('glue')
+s3 = aws_client('s3')
+
+bucket = os.environ.get('S3_DATA_BUCKET')
+glue_database_name = os.environ.get('GLUE_DATABASE_NAME')
+work_group = os.environ.get('ATHENA_WORK_GROUP', 'AI-ChatbotFeedback-WorkGroup')
+# feedback tables the summary is computed from, records in both are counted once per recordId
+source_tables = os.environ.get('SOURCE_TABLES', 'feedback').split(',')
+summary_table = os.environ.get('SUMMARY_TABLE', 'feedback_daily_summary')
+partition_scheme = os.environ.get('PARTITION_SCHEME', 'year,month,day').split(',')
+# app partitions of the projected tables; without them an app partition is injected and
+# has to be filtered on, the apps of a day are then listed from the bucket
+app_identifiers = [app for app in os.environ.get('APP_IDENTIFIERS', '').split(',') if app]
+# days materialized by a scheduled run, late records of the previous days are picked up
+lookback_days = int(os.environ.get('LOOKBACK_DAYS', '3'))
+# age up to which Athena returns the results of an identical report query instead of running it
+result_reuse_minutes = int(os.environ.get('RESULT_REUSE_MINUTES', '60'))
+# report name -> named query id, "satisfaction_per_app=<id>,worst_rated_prompts=<id>"
+report_query_ids = dict(
+    item.split('=', 1) for item in os.environ.get('REPORT_QUERY_IDS', '').split(',') if item
+)
+
+POLL_SECONDS = 1
+
+
+def run_query(query_string, parameters=None, reuse_minutes=0):
+    # Runs a query to completion and returns its execution, raises when it fails
+    request = {
+        'QueryString': query_string,
+        'QueryExecutionContext': {'Database': glue_database_name},
+        'WorkGroup': work_group,
+    }
+    if parameters:
+        request['ExecutionParameters'] = parameters
+    if reuse_minutes:
+        request['ResultReuseConfiguration'] = {
+            'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': reuse_minutes}
+        }
+    query_execution_id = athena.start_query_execution(**request)['QueryExecutionId']
+    while True:
+        execution = athena.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        state = execution['Status']['State']
+        if state == 'SUCCEEDED':
+            return execution
+        if state in ('FAILED', 'CANCELLED'):
+            reason = execution['Status'].get('StateChangeReason', state)
+            raise RuntimeError(f"query {query_execution_id} {state.lower()}: {reason}")
+        time.sleep(POLL_SECONDS)
+
+
+def injected_app():
+    return 'app' in partition_scheme and not app_identifiers
+
+
+def day_apps(day):
+    # The app partitions of a day, listed from the bucket for tables with an injected app
+    apps = set()
+    paginator = s3.get_paginator('list_objects_v2')
+    for table in source_tables:
+        prefix = f"{glue_database_name}/{table}/"
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                part = common_prefix['Prefix'][len(prefix):].rstrip('/')
+                if part.startswith('app='):
+                    apps.add(part[len('app='):])
+    return sorted(apps)
+
+
+def quoted(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def day_source(day):
+    # Subquery over the partitions of a day in every feedback table
+    partition_filter = ' AND '.join(
+        f"{name} = {quoted(value)}"
+        for name, value in (('year', f'{day:%Y}'), ('month', f'{day:%m}'), ('day', f'{day:%d}'))
+        if name in partition_scheme
+    )
+    filters = [partition_filter]
+    if injected_app():
+        # an injected partition column only takes a single value per table scan
+        filters = [f"{partition_filter} AND app = {quoted(app)}" for app in day_apps(day)]
+    selects = [
+        f"SELECT recordid, interactionid, submittedat, appidentifier, feedback, comment, userid FROM {table} WHERE {where}"
+        for table in source_tables for where in filters
+    ]
+    return '\n  UNION ALL\n  '.join(selects)
+
+
+def delete_prefix(prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': objects, 'Quiet': True})
+
+
+def runs_prefix(dt):
+    # Every materialization of a day is written to its own run location below this prefix
+    return f"{glue_database_name}/{summary_table}/runs/{dt}/"
+
+
+def partition_location(dt):
+    # Location of the summary partition of a day, None when the day has no partition
+    try:
+        partition = glue.get_partition(DatabaseName=glue_database_name, TableName=summary_table,
+                                       PartitionValues=[dt])
+    except glue.exceptions.EntityNotFoundException:
+        return None
+    return partition['Partition']['StorageDescriptor']['Location']
+
+
+def delete_replaced_runs(dt, current):
+    # Deletes the runs of a day other than the one its partition points to. That run may be
+    # read by queries started before the partition is switched again, it is kept until the
+    # next materialization of the day.
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=runs_prefix(dt), Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            if current is None or not current.endswith('/' + common_prefix['Prefix']):
+                delete_prefix(common_prefix['Prefix'])
+
+
+def materialize_day(day):
+    # Replaces the summary partition of a day with counts computed from the feedback tables.
+    # The counts are written to a new run location by a CTAS query, then the partition is
+    # switched to it in the catalog, so readers see either the previous or the new counts.
+    dt = f'{day:%Y-%m-%d}'
+    source = day_source(day)
+    current = partition_location(dt)
+    delete_replaced_runs(dt, current)
+    if not source:
+        return run_query(f"ALTER TABLE {summary_table} DROP IF EXISTS PARTITION (dt = {quoted(dt)})")
+
+    run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}_{uuid.uuid4().hex[:8]}"
+    location = f"s3://{bucket}/{runs_prefix(dt)}{run_id}/"
+    # the staging table only names the run location for the CTAS query, dropping it
+    # leaves the files in place
+    stage_table = f"{summary_table}_stage_{run_id.lower()}"
+    run_query(
+        f"CREATE TABLE {stage_table}\n"
+        f"WITH (format = 'PARQUET', write_compression = 'SNAPPY', external_location = {quoted(location)}) AS\n"
+        "SELECT appidentifier, feedback, count(*) AS ratings,\n"
+        "  count_if(coalesce(comment, '') <> '') AS comments,\n"
+        "  count(DISTINCT userid) AS users\n"
+        "FROM (\n"
+        "  SELECT arbitrary(appidentifier) AS appidentifier, arbitrary(feedback) AS feedback,\n"
+        "    arbitrary(comment) AS comment, arbitrary(userid) AS userid\n"
+        "  FROM (\n"
+        f"  {source}\n"
+        "  )\n"
+        # a record stored in both tables or delivered twice is counted once; records written
+        # before record ids existed are identified by the attributes the record id is built from
+        "  GROUP BY coalesce(recordid, concat_ws('|', appidentifier, userid, interactionid, feedback, comment, submittedat))\n"
+        ")\n"
+        "GROUP BY appidentifier, feedback"
+    )
+    run_query(f"DROP TABLE IF EXISTS {stage_table}")
+    if current is None:
+        return run_query(
+            f"ALTER TABLE {summary_table} ADD IF NOT EXISTS PARTITION (dt = {quoted(dt)}) LOCATION {quoted(location)}"
+        )
+    return run_query(f"ALTER TABLE {summary_table} PARTITION (dt = {quoted(dt)}) SET LOCATION {quoted(location)}")
+
+
+def run_report(report, app=None):
+    # Runs a saved report query; identical runs within RESULT_REUSE_MINUTES reuse the
+    # stored result instead of scanning the tables again
+    if report not in report_query_ids:
+        raise ValueError(f"unknown report {report}, use one of {', '.join(sorted(report_query_ids))}")
+    named_query = athena.get_named_query(NamedQueryId=report_query_ids[report])['NamedQuery']
+    parameters = None
+    if '?' in named_query['QueryString']:
+        if not app:
+            raise ValueError(f"report {report} needs the app to report on")
+        parameters = [quoted(app)] * named_query['QueryString'].count('?')
+    return run_query(named_query['QueryString'], parameters, reuse_minutes=result_reuse_minutes)
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    # {"report": "<name>", "app": "<app>"} runs a report, the output location is returned
+    if event.get('report'):
+        execution = run_report(event['report'], event.get('app'))
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'queryExecutionId': execution['QueryExecutionId'],
+                'outputLocation': execution['ResultConfiguration']['OutputLocation'],
+                'reused': execution.get('Statistics', {}).get('ResultReuseInformation', {}).get('ReusedPreviousResult', False),
+            })
+        }
+
+    # {"day": "YYYY-MM-DD"} materializes a day, scheduled runs the last LOOKBACK_DAYS days
+    if event.get('day'):
+        days = [datetime.strptime(event['day'], '%Y-%m-%d').date()]
+    else:
+        today = datetime.now(timezone.utc).date()
+        days = [today - timedelta(days=offset) for offset in range(1, lookback_days + 1)]
+    for day in days:
+        materialize_day(day)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'days': [f'{day:%Y-%m-%d}' for day in days]})
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Materialize the daily feedback summary or run a saved report.')
+    parser.add_argument('--day', action='append', help='day to materialize (YYYY-MM-DD), repeatable')
+    parser.add_argument('--report', help='saved report to run: ' + ', '.join(sorted(report_query_ids)))
+    parser.add_argument('--app', help='app to report on, for layouts with an injected app partition')
+    args = parser.parse_args()
+
+    if args.report:
+        execution = run_report(args.report, args.app)
+        print(execution['ResultConfiguration']['OutputLocation'])
+    for day in args.day or []:
+        materialize_day(datetime.strptime(day, '%Y-%m-%d').date())
+        print(f"{summary_table} dt={day}")
+
+
+if __name__ == '__main__':
+    main()
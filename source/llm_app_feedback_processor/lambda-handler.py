@@ -1,127 +1,274 @@
-import boto3
-import json
+import base64
 import logging
 import os
-import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+
+from common import json_codec, metrics
+from common.aws_clients import aws_client, retry_config
+from common.feedback_sink import FeedbackSink, FeedbackValidationError, build_feedback_record
+from common.object_store import is_throttled
 
 
 logger = logging.getLogger()
-logger.setLevel(logging.ERROR)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
 
-# S3 client
-s3 = boto3.client('s3')
+# dimension of the stage timing metrics (see common.metrics)
+function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'llm_app_feedback_processor')
 
-# sink the feedback json to the s3 bucket
-s3_bucket = os.environ['S3_DATA_BUCKET']
-glue_database_name = os.environ['GLUE_DATABASE_NAME']
+# sink the feedback json to the s3 bucket, every invocation writes so the client is created during init.
+# Throttled writes are retried by the client (see common.aws_clients.retry_config).
+sink = FeedbackSink.from_environment(s3_client=aws_client('s3', config=retry_config()))
 
+# upper bound on the number of records accepted in a single batch request
+max_batch_records = int(os.environ.get('MAX_BATCH_RECORDS', '500'))
 
-    
 
-def lambda_handler(event, context):
-    error_response = """{{
-        "statusCode": 400,
-        "headers": {{
-            "Content-Type": "*/*"
-            }},
-        "body": "Error: parameter {param} is a required parameter"
-    }}"""
-    if (event['body']) and (event['body'] is not None):
-        body = json.loads(event['body'])
-        try:
-            prompt = body['prompt']
-        except KeyError:
-            prompt = "N.A."
-            logger.warning("prompt is missing in the request body")
-        
-        try:
-            response = body['response']
-        except KeyError:
-            response = "N.A."
-            logger.warning("response is missing in the request body")
+def parse_request_body(raw_body, headers):
+    # Returns the decoded body and whether it is a batch of records.
+    # Batches are either a JSON array or an NDJSON stream (one record per line).
+    content_type = ""
+    for name, value in (headers or {}).items():
+        if name.lower() == 'content-type' and value:
+            content_type = value.lower()
+
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        return parse_ndjson(raw_body), True
 
+    try:
+        body = json_codec.loads(raw_body)
+    except json_codec.JSONDecodeError as e:
+        # a single JSON document followed by more data is an NDJSON stream
+        if e.msg == "Extra data":
+            return parse_ndjson(raw_body), True
+        raise
+
+    return body, isinstance(body, list)
+
+
+def parse_ndjson(raw_body):
+    items = []
+    for line in raw_body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
         try:
-            feedback = body['feedback']
-        except KeyError:
-            logger.error("feedback is missing in the request body")
-            error_response = error_response.format(param="feedback")
-            return json.loads(error_response)
-        
+            items.append(json_codec.loads(line))
+        except json_codec.JSONDecodeError:
+            # keep the position so the caller can report the failure per item
+            items.append(None)
+    return items
+
+
+def batch_handler(items):
+    if len(items) > max_batch_records:
+        return {
+            'statusCode': 413,
+            'body': f'Error: a batch can contain at most {max_batch_records} records'
+        }
+
+    results = []
+    records = []
+    with metrics.stage('validate'):
+        for index, item in enumerate(items):
+            try:
+                record = build_feedback_record(item)
+            except FeedbackValidationError as e:
+                results.append({'index': index, 'status': 'error', 'error': str(e)})
+                continue
+            records.append(record)
+            results.append({'index': index, 'status': 'ok', 'interactionId': record['interactionId']})
+
+    if records:
         try:
-            userId = body['userId']        
-        except KeyError:            
-            logger.error("userId is missing in the request body")
-            error_response = error_response.format(param="userId")
-            return json.loads(error_response)
-        
-        try:            
-            appIdentifier = body['appIdentifier']
-        except KeyError:
-            logger.error("appIdentifier is missing in the request body")
-            error_response = error_response.format(param="appIdentifier")
-            return json.loads(error_response)
+            sink.write_batch(records)
+        except sink.s3.exceptions.ClientError as e:
+            if not is_throttled(e):
+                raise
+            return throttled_response(e)
+
+    return {
+        'statusCode': 200 if records else 400,
+        'body': json_codec.dumps({
+            'accepted': len(records),
+            'rejected': len(items) - len(records),
+            'results': results
+        })
+    }
+
 
+def sqs_batch_handler(event, context):
+    with metrics.invocation(function_name):
+        return handle_sqs_batch(event)
+
+
+def handle_sqs_batch(event):
+    # Queue consumer: every SQS message carries the raw body of one POST /feedback request.
+    # Valid records of all messages are written together, and messages that cannot be
+    # stored are returned as batch item failures so only they are retried.
+    failed_message_ids = []
+    records = []
+    written_message_ids = []
+
+    for message in event['Records']:
+        message_id = message['messageId']
         try:
-            interactionId = body['interactionId']
-        except KeyError:
-            logger.warning("interactionId is missing in the request body")
-            interactionId=str(uuid.uuid4())            
-        
+            with metrics.stage('parse'):
+                body, is_batch = parse_request_body(message['body'], None)
+        except json_codec.JSONDecodeError:
+            logger.error("message %s does not contain valid JSON", message_id)
+            failed_message_ids.append(message_id)
+            continue
+
+        message_records = []
+        with metrics.stage('validate'):
+            for item in (body if is_batch else [body]):
+                try:
+                    message_records.append(build_feedback_record(item))
+                except FeedbackValidationError as e:
+                    logger.error("message %s: %s", message_id, e)
+
+        if not message_records:
+            failed_message_ids.append(message_id)
+            continue
+        records.extend(message_records)
+        written_message_ids.append(message_id)
+
+    if records:
         try:
-            comment = body['comment']
-        
-        except KeyError:
-            logger.info("comment is a missing in the request body")
-            comment = ""
+            sink.write_batch(records)
+        except Exception:
+            logger.exception("failed to write %d records", len(records))
+            failed_message_ids.extend(written_message_ids)
 
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
+
+
+def firehose_transform_handler(event, context):
+    with metrics.invocation(function_name):
+        return handle_firehose_batch(event)
+
+
+def transform_firehose_record(firehose_record):
+    # Returns the NDJSON lines and the partition of the records in one request body.
+    # The arrival time is the ingest time, so a retried batch yields identical records.
+    raw_body = base64.b64decode(firehose_record['data']).decode('utf-8')
+    with metrics.stage('parse'):
+        body, is_batch = parse_request_body(raw_body, None)
+    ingested_at = datetime.fromtimestamp(firehose_record['approximateArrivalTimestamp'] / 1000, timezone.utc)
+
+    records = []
+    with metrics.stage('validate'):
+        for item in (body if is_batch else [body]):
+            try:
+                records.append(build_feedback_record(item, ingested_at=ingested_at))
+            except FeedbackValidationError as e:
+                logger.error("firehose record %s: %s", firehose_record['recordId'], e)
+    if not records:
+        raise ValueError("no valid feedback record")
+
+    # Dynamic partitioning writes a Firehose record into a single partition, so a batch
+    # request whose records span partitions (e.g. submitted around midnight) is stored in
+    # the partition of its first record rather than failing the whole request
+    partition = sink.partition_values(records[0])
+    if any(sink.partition_values(record) != partition for record in records[1:]):
+        logger.info("firehose record %s spans partitions, stored in %s", firehose_record['recordId'], partition)
+
+    with metrics.stage('serialize'):
+        data = ''.join(json_codec.dumps(sink.prepare(record)) + '\n' for record in records)
+    return data, partition, len(records)
+
+
+def handle_firehose_batch(event):
+    # Firehose record transformation: every Firehose record carries the raw body of one
+    # POST /feedback request. Valid records are returned as NDJSON with the partition
+    # columns as partition keys of the dynamic partitioning, requests without any valid
+    # record as ProcessingFailed, which Firehose writes to the error output prefix.
+    results = []
+    record_count = 0
+    for firehose_record in event['records']:
         try:
-            sourceAttribution = body['sourceAttribution']
-            logger.info(sourceAttribution)
-        except KeyError:
-            logger.warning("sourceAttribution is a missing in the request body")
-            sourceAttribution = ""
-    
+            data, partition_keys, count = transform_firehose_record(firehose_record)
+        except (ValueError, KeyError) as e:
+            # JSONDecodeError and UnicodeDecodeError are ValueErrors
+            logger.error("firehose record %s failed: %s", firehose_record['recordId'], e)
+            results.append({
+                'recordId': firehose_record['recordId'],
+                'result': 'ProcessingFailed',
+                'data': firehose_record['data'],
+            })
+            continue
+        record_count += count
+        results.append({
+            'recordId': firehose_record['recordId'],
+            'result': 'Ok',
+            'data': base64.b64encode(data.encode('utf-8')).decode('ascii'),
+            'metadata': {'partitionKeys': partition_keys},
+        })
+    metrics.count('records', record_count)
+    return {'records': results}
+
+
+def error_response(error):
+    # every invalid attribute of the body is reported, one message per line
+    return {
+        'statusCode': 400,
+        'headers': {
+            'Content-Type': '*/*'
+        },
+        'body': '\n'.join(message for _, message in error.errors)
+    }
+
+
+def throttled_response(error):
+    # S3 still throttles the write after the client retries. Writes are idempotent, so the
+    # client is asked to send the request again instead of losing the feedback.
+    logger.error("feedback write throttled: %s", error)
+    return {
+        'statusCode': 503,
+        'headers': {
+            'Retry-After': '1'
+        },
+        'body': 'Error: the feedback store is busy, retry the request'
+    }
+
+
+def lambda_handler(event, context):
+    with metrics.invocation(function_name):
+        return handle_request(event)
+
+
+def handle_request(event):
+    if (event['body']) and (event['body'] is not None):
         try:
-            source_attribution_urls = body['sourceUrls']
-            logger.info(source_attribution_urls)
-        
-        except KeyError:
-            logger.warning("sourceUrls is a missing in the request body")
-            source_attribution_urls = []
+            with metrics.stage('parse'):
+                body, is_batch = parse_request_body(event['body'], event.get('headers'))
+        except json_codec.JSONDecodeError:
+            return error_response(FeedbackValidationError("body", "Error: request body is not valid JSON"))
+        if is_batch:
+            return batch_handler(body)
 
         try:
-            submittedAt = body['submittedAt']
-            logger.info(submittedAt)
-        except KeyError:
-            current_date = datetime.now()
-            submittedAt = current_date.strftime("%b %d, %Y, %I:%M:%S %p")
+            with metrics.stage('validate'):
+                record = build_feedback_record(body)
+        except FeedbackValidationError as e:
+            return error_response(e)
     else:
         return {
             'statusCode': 400,
             'body': 'Error: request body is missing'
         }
-        
-    response_data = json.dumps({
-            'interactionId': interactionId,
-            'prompt': prompt,
-            'response': response,
-            'source_attribution_urls': source_attribution_urls,
-            'sourceAttribution': sourceAttribution,
-            'appIdentifier': appIdentifier,
-            'feedback': feedback,
-            'comment':   comment,
-            'userId': userId,
-            'submittedAt': submittedAt
-        })           
-    current_date = datetime.now()
-    key = f'{glue_database_name}/feedback/year={current_date.year}/month={current_date.strftime("%m")}/day={current_date.strftime("%d")}/{interactionId}.json'
-    
-    bucket_name = s3_bucket
-    s3.put_object(Body=response_data, Bucket=bucket_name, Key=key)
-    
+
+    try:
+        response_data = sink.write_record(record)
+    except sink.s3.exceptions.ClientError as e:
+        if not is_throttled(e):
+            raise
+        return throttled_response(e)
+
     # Return the JSON response
     return {
         'statusCode': 200,
         'body': response_data
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+from urllib.parse import unquote_plus
+
+from common.aws_clients import aws_client
+
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'ERROR'))
+
+glue = aws_client('glue')
+
+glue_database_name = os.environ['GLUE_DATABASE_NAME']
+# tables whose partitions are registered, their data lives below {glue_database_name}/{table}/
+table_names = os.environ.get('GLUE_TABLES', 'feedback').split(',')
+
+# partitions registered by this container, so repeated writes to a partition skip Glue
+registered_partitions = set()
+# table definitions, read once per container
+table_cache = {}
+
+
+def get_table(table_name):
+    if table_name not in table_cache:
+        table_cache[table_name] = glue.get_table(DatabaseName=glue_database_name, Name=table_name)['Table']
+    return table_cache[table_name]
+
+
+def partition_of(key):
+    # Maps an object key to (table, partition values), or None for objects that are not data.
+    # Hidden objects (manifests, staging directories) are skipped like Athena does.
+    parts = key.split('/')
+    if len(parts) < 3 or parts[0] != glue_database_name or parts[1] not in table_names:
+        return None
+    if any(part.startswith(('_', '.')) for part in parts[2:]):
+        return None
+
+    table = get_table(parts[1])
+    values = dict(part.split('=', 1) for part in parts[2:-1] if '=' in part)
+    partition_keys = [column['Name'] for column in table['PartitionKeys']]
+    if not all(name in values for name in partition_keys):
+        logger.warning("object %s is not in a partition of %s", key, parts[1])
+        return None
+    return parts[1], tuple(values[name] for name in partition_keys)
+
+
+def partition_input(table, values):
+    location = table['StorageDescriptor']['Location'].rstrip('/')
+    for column, value in zip(table['PartitionKeys'], values):
+        location += f"/{column['Name']}={value}"
+    storage_descriptor = dict(table['StorageDescriptor'], Location=location)
+    return {'Values': list(values), 'StorageDescriptor': storage_descriptor}
+
+
+def register_partitions(partitions):
+    by_table = {}
+    for table_name, values in partitions:
+        by_table.setdefault(table_name, []).append(values)
+
+    for table_name, values_list in by_table.items():
+        table = get_table(table_name)
+        # BatchCreatePartition accepts up to 100 partitions per call
+        for start in range(0, len(values_list), 100):
+            chunk = values_list[start:start + 100]
+            response = glue.batch_create_partition(
+                DatabaseName=glue_database_name,
+                TableName=table_name,
+                PartitionInputList=[partition_input(table, values) for values in chunk],
+            )
+            for error in response.get('Errors', []):
+                if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException':
+                    raise RuntimeError(f"failed to register partition {error['PartitionValues']}: {error['ErrorDetail']}")
+            registered_partitions.update((table_name, values) for values in chunk)
+
+
+def object_keys(event):
+    # S3 notifications are delivered through SNS, one S3 event per SNS record
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        for s3_record in message.get('Records', []):
+            yield unquote_plus(s3_record['s3']['object']['key'])
+
+
+def lambda_handler(event, context):
+    partitions = set()
+    for key in object_keys(event):
+        partition = partition_of(key)
+        if partition and partition not in registered_partitions:
+            partitions.add(partition)
+
+    if partitions:
+        register_partitions(sorted(partitions))
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'registered': len(partitions)})
+    }
@@ -0,0 +1,239 @@
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import closing
+from datetime import timedelta
+
+# Backfill: feedback submitted before the EventBridge rule existed, or stored by a faulty
+# release, is rebuilt from the PutFeedback events CloudTrail keeps in the trail bucket.
+# Log files are processed in parallel by worker processes, each streaming its file and
+# storing the records like the direct sink of businessq_feedback_processor does, so they
+# get the recordIds and partitions of the live records. Events are mapped onto feedback
+# bodies by the function's own handler. Completed files are appended to a checkpoint file
+# and skipped when an interrupted run is started again.
+#
+#   python source/tools/cloudtrail_backfill.py --trail-bucket <trail bucket> \
+#       --bucket <data bucket> --database chatbot_user_feedback --start 2024-01-01 --end 2024-03-31
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER_PATH = os.path.join(REPO_ROOT, 'deployment', 'ai-chatbot-feedback-analytics', 'lambda_assets', 'layer')
+HANDLER_PATH = os.path.join(REPO_ROOT, 'source', 'businessq_feedback_processor', 'lambda-handler.py')
+sys.path.insert(0, LAYER_PATH)
+
+from common.aws_clients import aws_client, retry_config  # noqa: E402
+from common.cloudtrail_logs import day_prefixes, is_put_feedback, iter_records  # noqa: E402
+from common.feedback_query import parse_time  # noqa: E402
+from common.feedback_sink import (  # noqa: E402
+    DEFAULT_PARTITION_SCHEME, FeedbackSink, FeedbackValidationError, build_feedback_record, parse_timestamp,
+)
+from common.object_store import LocalObjectStore, S3ObjectStore  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# set in every worker process by init_backfill_worker
+handler = None
+backfill_trail = None
+backfill_options = None
+sink = None
+
+
+def load_handler():
+    # The handler of the function, loaded with the api sink so importing it doesn't create
+    # a sink from the environment of the function. Only its event mapping is used.
+    os.environ['FEEDBACK_SINK'] = 'api'
+    spec = importlib.util.spec_from_file_location('businessq_feedback_processor', HANDLER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def trail_store(options):
+    if options['trail_root']:
+        return LocalObjectStore(options['trail_root'])
+    return S3ObjectStore(options['trail_bucket'], endpoint_url=options['endpoint_url'])
+
+
+def init_backfill_worker(options):
+    global handler, backfill_trail, backfill_options, sink
+    handler = load_handler()
+    handler.enrich_messages = options['enrich']
+    backfill_options = options
+    backfill_trail = trail_store(options)
+    if not options['dry_run']:
+        sink = FeedbackSink(
+            options['bucket'], options['database'],
+            output_format=options['output_format'],
+            partition_scheme=options['partition_scheme'],
+            compression=options['compression'],
+            key_shards=options['key_shards'],
+            s3_client=aws_client('s3', endpoint_url=options['endpoint_url'], config=retry_config()),
+        )
+
+
+def backfill_file(key):
+    # Stores the PutFeedback records of the backfill range found in a log file, in batches
+    # of up to batch_size records. Returns the counts of the file.
+    counts = {'key': key, 'events': 0, 'records': 0, 'invalid': 0}
+    start, end = backfill_options['start'], backfill_options['end']
+    batch = []
+    with closing(backfill_trail.open(key)) as stream:
+        for event in iter_records(stream):
+            if not is_put_feedback(event):
+                continue
+            event_time = parse_timestamp(event.get('eventTime'))
+            if event_time is None or not start <= event_time < end:
+                continue
+            counts['events'] += 1
+            try:
+                # the event time stands in for the ingest time, a record is stored in the
+                # partition it would have been stored in when it was submitted
+                batch.append(build_feedback_record(handler.feedback_body({'detail': event}), ingested_at=event_time))
+            except (FeedbackValidationError, KeyError, TypeError) as e:
+                logger.warning("PutFeedback event %s in %s was not stored: %s", event.get('eventID'), key, e)
+                counts['invalid'] += 1
+                continue
+            if len(batch) >= backfill_options['batch_size']:
+                counts['records'] += store_backfill_batch(batch)
+                batch = []
+    if batch:
+        counts['records'] += store_backfill_batch(batch)
+    return counts
+
+
+def store_backfill_batch(records):
+    if not backfill_options['dry_run']:
+        sink.write_batch(records, overwrite=backfill_options['force'])
+    return len(records)
+
+
+def backfill_keys(trail, options, accounts=None, regions=None):
+    # The log files of the days of the range. Events of the last minutes of a day are
+    # delivered in files of the next day, so one more day is listed.
+    for prefix in day_prefixes(trail, options['logs_prefix'], options['start'],
+                               options['end'] + timedelta(days=1), accounts, regions):
+        for key, _ in trail.list_objects(prefix):
+            if key.endswith('.json.gz'):
+                yield key
+
+
+def read_checkpoint(path):
+    # Keys of the files completed by earlier runs
+    done = set()
+    if not os.path.exists(path):
+        return done
+    line = ''
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['key'])
+            except (ValueError, KeyError):
+                # the last line of an interrupted run may be cut off
+                pass
+    if line and not line.endswith('\n'):
+        # the lines of this run start after the cut off line
+        with open(path, 'a') as f:
+            f.write('\n')
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill Q Business feedback from the CloudTrail logs of the trail bucket.')
+    trail_location = parser.add_mutually_exclusive_group(required=True)
+    trail_location.add_argument('--trail-root', help='local directory that mirrors the trail bucket')
+    trail_location.add_argument('--trail-bucket', help='trail bucket name')
+    parser.add_argument('--logs-prefix', default='AWSLogs/',
+                        help='prefix of the account folders, e.g. AWSLogs/o-abc123/ for an organization trail')
+    parser.add_argument('--account', action='append', help='only this account, repeatable (default all)')
+    parser.add_argument('--region', action='append', help='only this region, repeatable (default all)')
+    parser.add_argument('--start', required=True, help='first day (YYYY-MM-DD) or time (ISO 8601)')
+    parser.add_argument('--end', help='last day (YYYY-MM-DD) or end time (ISO 8601, exclusive), defaults to start')
+    parser.add_argument('--bucket', help='data bucket name, required unless --dry-run is given')
+    parser.add_argument('--database', required=True, help='glue database name, the top level prefix')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint, e.g. a local stand-in')
+    parser.add_argument('--partition-scheme', default=os.environ.get('PARTITION_SCHEME', ','.join(DEFAULT_PARTITION_SCHEME)),
+                        help='partition columns of the feedback layout')
+    parser.add_argument('--output-format', choices=['json', 'parquet'], default=os.environ.get('OUTPUT_FORMAT', 'json'))
+    parser.add_argument('--compression', choices=['none', 'gzip', 'zstd'], default=os.environ.get('OUTPUT_COMPRESSION', 'none'),
+                        help='compression of the JSON objects')
+    parser.add_argument('--key-shards', type=int, default=int(os.environ.get('KEY_SHARDS', '0')),
+                        help='hash sub-prefixes of the partitions, as configured for the stack')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records per stored object at most')
+    parser.add_argument('--checkpoint', help='file recording the completed log files (default backfill-<start>-<end>.checkpoint)')
+    parser.add_argument('--enrich', action='store_true',
+                        help='add prompts and responses with ListMessages, for conversations that still exist')
+    parser.add_argument('--force', action='store_true',
+                        help='replace the objects an earlier backfill stored for the same records, e.g. after a mapping fix')
+    parser.add_argument('--dry-run', action='store_true', help='count the feedback events without storing them')
+    args = parser.parse_args()
+    if not args.bucket and not args.dry_run:
+        parser.error('--bucket is required unless --dry-run is given')
+
+    start = parse_time(args.start)
+    end = parse_time(args.end or args.start, end=True)
+    options = {
+        'trail_root': args.trail_root,
+        'trail_bucket': args.trail_bucket,
+        'logs_prefix': args.logs_prefix,
+        'endpoint_url': args.endpoint_url,
+        'bucket': args.bucket,
+        'database': args.database,
+        'partition_scheme': args.partition_scheme.split(','),
+        'output_format': args.output_format,
+        'compression': args.compression,
+        'key_shards': args.key_shards,
+        'batch_size': args.batch_size,
+        'enrich': args.enrich,
+        'dry_run': args.dry_run,
+        'force': args.force,
+        'start': start,
+        'end': end,
+    }
+    checkpoint = args.checkpoint or f"backfill-{start:%Y%m%d}-{end:%Y%m%d}.checkpoint"
+    done = set() if args.dry_run else read_checkpoint(checkpoint)
+
+    trail = trail_store(options)
+    keys = (key for key in backfill_keys(trail, options, args.account, args.region) if key not in done)
+
+    totals = {'files': 0, 'events': 0, 'records': 0, 'invalid': 0}
+    failed = []
+    log = open(os.devnull if args.dry_run else checkpoint, 'a')
+    with log, ProcessPoolExecutor(max_workers=args.workers, initializer=init_backfill_worker,
+                                  initargs=(options,)) as executor:
+        # a few files per worker are queued at a time, the file list is consumed as it is listed
+        pending = {}
+        while True:
+            for key in itertools.islice(keys, args.workers * 2 - len(pending)):
+                pending[executor.submit(backfill_file, key)] = key
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = pending.pop(future)
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    # not checkpointed, the file is processed again by the next run
+                    print(f"{key}: {e}", file=sys.stderr)
+                    failed.append(key)
+                    continue
+                log.write(json.dumps(counts) + '\n')
+                log.flush()
+                totals['files'] += 1
+                for name in ('events', 'records', 'invalid'):
+                    totals[name] += counts[name]
+                if totals['files'] % 100 == 0:
+                    print(json.dumps(totals), file=sys.stderr)
+
+    print(json.dumps(dict(totals, skipped=len(done), failed=len(failed))))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()